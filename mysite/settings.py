@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 
 from pathlib import Path
 from decouple import config, Csv
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -51,6 +52,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'polls.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -91,6 +93,150 @@ DATABASES = {
     }
 }
 
+# Read replicas, as a comma separated list of SQLite files kept in step with
+# db.sqlite3 by external replication (or the sync_replicas command when
+# trying it out locally). Views wrapped in polls.routers.read_from_replica
+# read from them, see polls.routers.ReplicaRouter.
+DB_REPLICAS = config('DB_REPLICAS', default='', cast=Csv())
+DATABASE_REPLICAS = []
+for number, replica in enumerate(DB_REPLICAS, start=1):
+    DATABASES[f'replica{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / replica,
+        # tests read the replica through the test database
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+# Horizontal partitioning: a comma separated list of SQLite files that
+# become the poll databases polls1..N. Every question, with its choices and
+# votes, lives in one of them (see polls.partitions), users and sessions stay
+# in db.sqlite3. Create their tables with migrate --database polls1 etc.
+DB_POLL_PARTITIONS = config('DB_POLL_PARTITIONS', default='', cast=Csv())
+POLL_DATABASES = []
+for number, partition in enumerate(DB_POLL_PARTITIONS, start=1):
+    DATABASES[f'polls{number}'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / partition,
+    }
+    POLL_DATABASES.append(f'polls{number}')
+# Seconds a process trusts its cached poll placements after rebalance_polls
+# moved a poll (a lookup that misses the poll re-reads the directory anyway)
+POLLS_PLACEMENT_CACHE_TIMEOUT = config('POLLS_PLACEMENT_CACHE_TIMEOUT', default=300, cast=int)
+
+DATABASE_ROUTERS = ['polls.partitions.PartitionRouter', 'polls.routers.ReplicaRouter']
+
+# Seconds a client's reads stay on the primary after it wrote, e.g. voted
+POLLS_REPLICA_STICKY_SECONDS = config('POLLS_REPLICA_STICKY_SECONDS', default=10, cast=int)
+
+# 'production' tunes SQLite for concurrent readers and a busy vote writer
+DB_PROFILE = config('DB_PROFILE', default='development')
+
+# PRAGMA statements run on every new SQLite connection (see polls.signals)
+SQLITE_PRAGMAS = {}
+
+if DB_PROFILE == 'production':
+    for database in DATABASES.values():
+        database['CONN_MAX_AGE'] = config('DB_CONN_MAX_AGE', default=600, cast=int)
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+        'synchronous': 'NORMAL',
+        # negative means KiB, so about 64 MB of page cache
+        'cache_size': config('SQLITE_CACHE_SIZE', default=-64000, cast=int),
+        'mmap_size': config('SQLITE_MMAP_SIZE', default=268435456, cast=int),
+        'temp_store': 'MEMORY',
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+# Cached results, pages and ETags are invalidated by bumping version keys,
+# which every worker process must see, with an atomic incr(). The local
+# memory cache is private to one process, so it only suits runserver. The
+# production profile needs Memcached or Redis: the database and file caches
+# emulate incr() with a get and a set, and the database cache would add a
+# write transaction to every vote on the SQLite file.
+SHARED_CACHE_BACKENDS = [
+    'django.core.cache.backends.redis.RedisCache',
+    'django.core.cache.backends.memcached.PyMemcacheCache',
+    'django.core.cache.backends.memcached.PyLibMCCache',
+]
+if DB_PROFILE == 'production':
+    CACHE_BACKEND = config('CACHE_BACKEND', default='')
+    if CACHE_BACKEND not in SHARED_CACHE_BACKENDS:
+        raise ImproperlyConfigured(
+            f"DB_PROFILE=production needs CACHE_BACKEND set to one of "
+            f"{', '.join(SHARED_CACHE_BACKENDS)}, and CACHE_LOCATION to its server.")
+    CACHE_LOCATION = config('CACHE_LOCATION')
+else:
+    CACHE_BACKEND = config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache')
+    CACHE_LOCATION = config('CACHE_LOCATION', default='ku-polls')
+
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': CACHE_LOCATION,
+    }
+}
+
+# Sessions live in django_session. With Memcached or Redis (required by the
+# production profile) they are read through the cache ('cached_db'), so a
+# request only touches the table when the session itself changes (e.g. on
+# login). Never use 'cached_db' or 'cache' with the local memory cache: a
+# worker would keep serving a session that another worker logged out.
+if CACHE_BACKEND in SHARED_CACHE_BACKENDS:
+    SESSION_ENGINE = config('SESSION_ENGINE',
+                            default='django.contrib.sessions.backends.cached_db')
+else:
+    SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+
+# Flash messages live in a signed cookie, never in the session
+MESSAGE_STORAGE = config('MESSAGE_STORAGE',
+                         default='django.contrib.messages.storage.cookie.CookieStorage')
+
+# How long (seconds) a snapshot of poll results stays in the cache
+POLLS_RESULTS_CACHE_TIMEOUT = config('POLLS_RESULTS_CACHE_TIMEOUT', default=300, cast=int)
+# How long (seconds) the index page and its question list fragment are cached.
+# Keep it near the update_poll_status interval, since open/closed depends on time.
+POLLS_INDEX_CACHE_TIMEOUT = config('POLLS_INDEX_CACHE_TIMEOUT', default=60, cast=int)
+
+
+# Write-behind vote buffer: acknowledge votes at once and write them in batches
+POLLS_VOTE_BUFFER = config('POLLS_VOTE_BUFFER', default=False, cast=bool)
+POLLS_VOTE_BUFFER_BATCH_SIZE = config('POLLS_VOTE_BUFFER_BATCH_SIZE', default=500, cast=int)
+POLLS_VOTE_BUFFER_FLUSH_INTERVAL = config('POLLS_VOTE_BUFFER_FLUSH_INTERVAL',
+                                          default=0.5, cast=float)
+
+
+# Most ballots a kiosk may upload in one request to polls:submit_ballots
+POLLS_BALLOT_BATCH_MAX = config('POLLS_BALLOT_BATCH_MAX', default=5000, cast=int)
+
+
+# Days after a poll closed before archive_votes moves its votes to ArchivedVote.
+# Late kiosk ballots on an archived poll move its votes back, so keep it longer
+# than kiosks usually take to upload.
+POLLS_ARCHIVE_VOTES_AFTER_DAYS = config('POLLS_ARCHIVE_VOTES_AFTER_DAYS', default=90, cast=int)
+
+
+# Serve the detail, results and vote pages with native async views (for ASGI)
+POLLS_ASYNC_VIEWS = config('POLLS_ASYNC_VIEWS', default=False, cast=bool)
+
+
+# Let the results page subscribe to the live results stream (needs ASGI)
+POLLS_LIVE_RESULTS = config('POLLS_LIVE_RESULTS', default=False, cast=bool)
+# Seconds over which vote changes are coalesced into one stream message
+POLLS_LIVE_RESULTS_TICK = config('POLLS_LIVE_RESULTS_TICK', default=1.0, cast=float)
+# Seconds before a live results stream ends and the browser reconnects. It
+# bounds streams whose client went away, which Django doesn't notice.
+POLLS_LIVE_RESULTS_MAX_AGE = config('POLLS_LIVE_RESULTS_MAX_AGE', default=3600, cast=int)
+
+
+# Share of requests timed by polls.middleware.PerformanceMiddleware (0 = off).
+# Its summary lives in the cache, so perf_summary needs a shared cache.
+POLLS_PERF_SAMPLE_RATE = config('POLLS_PERF_SAMPLE_RATE', default=0.0, cast=float)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
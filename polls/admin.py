@@ -1,11 +1,53 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.admin.options import IncorrectLookupParameters
+from django.http import Http404
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from .models import Question, Choice
+from .cache import bump_index_version
+from .models import ChoiceVoteShard, Question, Choice, ResultsSnapshot
+from .partitions import get_poll_or_404
+
+
+class PollDatabaseFilter(admin.SimpleListFilter):
+    """
+    With partitioned polls, list the polls of one poll database at a time.
+
+    A changelist needs one queryset to count, sort and page, so there is no
+    "All" choice; the first poll database is shown by default.
+    """
+    title = "poll database"
+    parameter_name = "database"
+
+    def lookups(self, request, model_admin):
+        return [(alias, alias) for alias in settings.POLL_DATABASES]
+
+    def selected(self):
+        return self.value() or settings.POLL_DATABASES[0]
+
+    def queryset(self, request, queryset):
+        if not settings.POLL_DATABASES:
+            return queryset
+        if self.selected() not in settings.POLL_DATABASES:
+            raise IncorrectLookupParameters(f"Unknown poll database {self.value()}.")
+        return queryset.using(self.selected())
+
+    def choices(self, changelist):
+        for lookup, title in self.lookup_choices:
+            yield {
+                "selected": self.selected() == lookup,
+                "query_string": changelist.get_query_string({self.parameter_name: lookup}),
+                "display": title,
+            }
 
 
 class ChoiceInline(admin.TabularInline):
     model = Choice
     extra = 3
+    # maintained by the vote view, see reconcile_vote_counts
+    readonly_fields = ["votes"]
 
 
 class QuestionAdmin(admin.ModelAdmin):
@@ -13,11 +55,100 @@ class QuestionAdmin(admin.ModelAdmin):
         (None, {"fields": ["question_text"]}),
         ("Set publish date", {"fields": ["pub_date"], "classes": ["collapse"]}),
         ("Set end date", {"fields": ["end_date"], "classes": ["collapse"]}),
+        ("Vote counters", {"fields": ["counter_shards"], "classes": ["collapse"]}),
     ]
     inlines = [ChoiceInline]
-    list_display = ["question_text", "pub_date", "was_published_recently", "end_date"]
-    list_filter = ["pub_date"]
+    list_display = ["question_text", "pub_date", "was_published_recently", "end_date", "status",
+                    "total_votes"]
+    list_filter = [PollDatabaseFilter, "status", "pub_date"]
+    actions = ["close_polls_now"]
+    # skip the extra COUNT(*) over the whole table on filtered pages
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        # one grouped query for the whole page instead of a sum per row; the
+        # shards are summed in a subquery so the two joins don't multiply
+        shards = ChoiceVoteShard.objects.filter(choice__question=OuterRef("pk")).order_by() \
+            .values("choice__question").annotate(total=Sum("votes")).values("total")
+        return super().get_queryset(request).annotate(
+            total_votes=Coalesce(Sum("choice__votes"), 0) + Coalesce(Subquery(shards), 0))
+
+    def get_object(self, request, object_id, from_field=None):
+        if not settings.POLL_DATABASES:
+            return super().get_object(request, object_id, from_field)
+        try:
+            return get_poll_or_404(self.get_queryset(request), int(object_id))
+        except (ValueError, Http404):
+            return None
+
+    def get_formset_kwargs(self, request, obj, inline, prefix):
+        kwargs = super().get_formset_kwargs(request, obj, inline, prefix)
+        if obj.pk is not None and obj._state.db:
+            # the choices live in the database of their question
+            kwargs["queryset"] = kwargs["queryset"].using(obj._state.db)
+        return kwargs
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # the snapshot of a closed poll must show its edited choices
+        ResultsSnapshot.objects.db_manager(form.instance._state.db).refresh([form.instance.pk])
+
+    @admin.display(ordering="total_votes", description="Total votes")
+    def total_votes(self, obj):
+        return obj.total_votes
+
+    @admin.action(description="Close selected polls now")
+    def close_polls_now(self, request, queryset):
+        """End voting on the selected published polls with a single UPDATE."""
+        now = timezone.now()
+        # a scheduled poll would only be reopened by update_poll_status
+        questions = Question.objects.using(queryset.db)
+        to_close = list(questions.filter(
+            pk__in=queryset.values("pk"), pub_date__lte=now,
+        ).exclude(status=Question.Status.CLOSED).values_list("pk", flat=True))
+        closed = questions.filter(pk__in=to_close).update(
+            end_date=now, status=Question.Status.CLOSED)
+        if closed:
+            ResultsSnapshot.objects.db_manager(queryset.db).freeze(to_close)
+            bump_index_version()
+        self.message_user(request, f"Closed {closed} poll(s).")
+
+
+class ChoiceAdmin(admin.ModelAdmin):
+    """
+    Changelist of all choices. Choice ids are only unique within one poll
+    database, so with partitioned polls choices are edited on their question.
+    """
+    list_display = ["choice_text", "question", "total_votes"]
+    list_select_related = ["question"]
+    search_fields = ["choice_text"]
+    # a text box instead of a <select> of every question
+    raw_id_fields = ["question"]
+    readonly_fields = ["votes"]
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_total_votes()
+
+    def has_module_permission(self, request):
+        return not settings.POLL_DATABASES and super().has_module_permission(request)
+
+    def has_view_permission(self, request, obj=None):
+        return not settings.POLL_DATABASES and super().has_view_permission(request, obj)
+
+    def has_add_permission(self, request):
+        return not settings.POLL_DATABASES and super().has_add_permission(request)
+
+    def has_change_permission(self, request, obj=None):
+        return not settings.POLL_DATABASES and super().has_change_permission(request, obj)
+
+    def has_delete_permission(self, request, obj=None):
+        return not settings.POLL_DATABASES and super().has_delete_permission(request, obj)
+
+    @admin.display(ordering="total_votes", description="Votes")
+    def total_votes(self, obj):
+        return obj.total_votes
 
 
-admin.site.register(Choice)
+admin.site.register(Choice, ChoiceAdmin)
 admin.site.register(Question, QuestionAdmin)
@@ -0,0 +1,177 @@
+"""
+Native async versions of the detail, results and vote views.
+
+They are used instead of the sync views when POLLS_ASYNC_VIEWS is on, so an
+ASGI server such as uvicorn runs them on the event loop without a thread hop
+per request. Database work uses the async ORM API; the remaining sync parts
+(session loading, the vote transaction and template rendering, which reads
+messages from the session) are wrapped in sync_to_async.
+"""
+import asyncio
+import json
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib import messages
+from django.contrib.auth.views import redirect_to_login
+from django.conf import settings
+from django.http import HttpResponseRedirect, StreamingHttpResponse
+from django.shortcuts import redirect, render
+from django.urls import reverse
+from django.db.models import Prefetch
+from django.utils import timezone
+from django.views import View
+
+from .cache import aget_results, aresults_version
+from .events import broker
+from .models import Choice, Question, Vote
+from .partitions import aget_poll_or_404
+from .routers import stick_to_primary, use_replica
+from .views import save_vote
+
+
+def async_login_required(view_func):
+    """
+    Async counterpart of login_required.
+
+    request.user is lazy and loads the session and user from the database on
+    first access, so it is resolved in a thread before the view runs.
+    """
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+class DetailView(View):
+    """Async view for displaying the voting form of a question."""
+    template_name = 'polls/detail.html'
+
+    async def get(self, request, pk):
+        question = await aget_poll_or_404(
+            Question.objects.filter(pub_date__lte=timezone.now()).prefetch_related(
+                Prefetch('choice_set', queryset=Choice.objects.order_by('id'))), pk)
+
+        # Check if the poll is votable
+        if not question.can_vote():
+            return redirect('polls:closed_poll')
+
+        previous_choice = None
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if is_authenticated:
+            choice_id = await Vote.objects.using(question._state.db) \
+                .filter(user=request.user, question=question) \
+                .values_list('choice_id', flat=True).afirst()
+            previous_choice = next(
+                (choice for choice in question.choice_set.all() if choice.id == choice_id),
+                None,
+            )
+
+        context = {'question': question, 'object': question,
+                   'previous_choice': previous_choice}
+        return await sync_to_async(render)(request, self.template_name, context)
+
+
+class ResultsView(View):
+    """Async view for displaying the vote counts of a question, read from a replica."""
+    template_name = 'polls/results.html'
+
+    async def get(self, request, pk):
+        # method_decorator would hide from View that get() is a coroutine
+        with use_replica(request):
+            question = await aget_poll_or_404(Question.objects.select_related('snapshot'), pk)
+            context = {'question': question, 'object': question,
+                       'results': await aget_results(question),
+                       'live_results': settings.POLLS_LIVE_RESULTS}
+            return await sync_to_async(render)(request, self.template_name, context)
+
+
+@async_login_required
+async def vote(request, question_id):
+    """
+    Async version of polls.views.vote.
+
+    Args:
+        request (HttpRequest): The HTTP request object.
+        question_id (int): The ID of the question being voted on.
+
+    Returns:
+        HttpResponse: A redirect to the results page if the vote is successful, or
+        back to the voting form if there is an error.
+    """
+    question = await aget_poll_or_404(Question.objects.all(), question_id)
+    if not question.can_vote():
+        messages.error(request, "Voting is not allowed for this question.")
+        return redirect("polls:index")
+    try:
+        selected_choice = await question.choice_set.aget(pk=request.POST["choice"])
+    except (KeyError, Choice.DoesNotExist):
+        messages.error(request, "You didn't select a choice.")
+        return redirect("polls:detail", question_id)
+    # the vote is written in one short transaction, which must run in a thread
+    await sync_to_async(save_vote)(request, question, selected_choice)
+    return stick_to_primary(HttpResponseRedirect(reverse("polls:results", args=(question.id,))))
+
+
+async def stream_results(question, tick, keepalive=15, max_age=3600):
+    """
+    Yield Server-Sent Events with the vote counts of question.
+
+    The current counts are sent at once. After that the stream waits for a
+    change, then for tick more seconds, so a burst of votes within one tick
+    is sent as a single message. A comment line is sent every keepalive
+    seconds without changes to keep proxies from closing the connection.
+
+    Django 4.2 doesn't stop a streaming response when the client goes away,
+    so the stream ends by itself: after max_age seconds (the browser then
+    reconnects), or with a "closed" event after the final counts once the
+    poll no longer takes votes.
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + max_age
+    changed = broker.subscribe(question.id)
+    try:
+        while True:
+            version = await aresults_version(question.id)
+            results = await aget_results(question)
+            payload = {
+                "choices": [{"id": row["id"], "votes": row["votes"]} for row in results],
+                "total": sum(row["votes"] for row in results),
+            }
+            yield f"id: {version}\ndata: {json.dumps(payload)}\n\n"
+            if not question.can_vote():
+                yield "event: closed\ndata: {}\n\n"
+                return
+            while True:
+                timeout = min(keepalive, deadline - loop.time())
+                if timeout <= 0:
+                    return
+                try:
+                    await asyncio.wait_for(changed.wait(), timeout)
+                    break
+                except asyncio.TimeoutError:
+                    if not question.can_vote():
+                        # send the final counts
+                        break
+                    yield ": keepalive\n\n"
+            await asyncio.sleep(tick)
+            changed.clear()
+    finally:
+        broker.unsubscribe(question.id, changed)
+
+
+async def results_stream(request, pk):
+    """Stream live vote counts of a question as text/event-stream."""
+    question = await aget_poll_or_404(Question.objects.all(), pk)
+    response = StreamingHttpResponse(
+        stream_results(question, settings.POLLS_LIVE_RESULTS_TICK,
+                       max_age=settings.POLLS_LIVE_RESULTS_MAX_AGE),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # tell nginx not to buffer the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
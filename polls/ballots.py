@@ -0,0 +1,151 @@
+"""
+Validation of ballot batches uploaded by offline voting kiosks.
+
+A kiosk collects ballots while it has no connection and uploads them later
+as a list of records like
+
+    {"user": 12, "question": 3, "choice": 7, "cast_at": "2026-10-18T09:15:00+07:00"}
+
+The records are checked with one query for the users and one for the choices
+(with their questions) per poll database, however many records there are,
+and the accepted ones are applied with polls.partitions.record_ballots().
+"""
+import datetime
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Choice
+from .partitions import poll_db
+
+ACCEPTED = "accepted"
+SUPERSEDED = "superseded"
+REJECTED = "rejected"
+
+# how far ahead of the server clock a kiosk clock may run
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+# keep every IN (...) list well under SQLite's variable limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def _chunks(values, size=LOOKUP_CHUNK_SIZE):
+    values = iter(values)
+    while chunk := list(islice(values, size)):
+        yield chunk
+
+
+def _parse_record(record):
+    """Return (user_id, question_id, choice_id, cast_at) or raise ValueError."""
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    try:
+        ids = [record[key] for key in ("user", "question", "choice")]
+    except KeyError as missing:
+        raise ValueError(f"{missing.args[0]} is required")
+    if not all(isinstance(value, int) and not isinstance(value, bool) for value in ids):
+        raise ValueError("user, question and choice must be integer ids")
+    cast_at = parse_datetime(str(record.get("cast_at") or ""))
+    if cast_at is None:
+        raise ValueError("cast_at must be an ISO 8601 timestamp")
+    if timezone.is_naive(cast_at):
+        cast_at = timezone.make_aware(cast_at)
+    return (*ids, cast_at)
+
+
+def _voting_windows(pairs, database_of):
+    """
+    Return {(question_id, choice_id): (pub_date, end_date)} for the pairs
+    whose choice belongs to the question, looking each question up in
+    database_of(question_id).
+    """
+    # choice ids are only unique within one poll database
+    choice_ids = defaultdict(set)
+    for question_id, choice_id in pairs:
+        choice_ids[database_of(question_id)].add(choice_id)
+    windows = {}
+    for database, ids in choice_ids.items():
+        for chunk in _chunks(ids):
+            windows.update(
+                ((question_id, pk), (pub_date, end_date))
+                for pk, question_id, pub_date, end_date in Choice.objects.using(database)
+                .filter(pk__in=chunk)
+                .values_list("pk", "question_id", "question__pub_date", "question__end_date")
+            )
+    return {pair: window for pair, window in windows.items() if pair in pairs}
+
+
+def check_ballots(records, now=None):
+    """
+    Validate a batch of kiosk ballot records.
+
+    A ballot is accepted when its user is active, its choice belongs to its
+    question, and the question was open at the time the ballot was cast.
+    When a user cast several accepted ballots on one question the latest
+    cast_at wins and the others are reported as superseded.
+
+    Args:
+        records (list): The decoded records, in upload order.
+        now (datetime): The server time. Defaults to timezone.now().
+
+    Returns:
+        tuple: The per-record results, a list of {"status": ..., "error": ...}
+        dicts in the order of records, and the (user_id, question_id,
+        choice_id) tuples to apply, in the order they were cast.
+    """
+    now = now or timezone.now()
+    results = []
+    parsed = {}
+    for index, record in enumerate(records):
+        try:
+            parsed[index] = _parse_record(record)
+            results.append({"status": ACCEPTED})
+        except ValueError as error:
+            results.append({"status": REJECTED, "error": str(error)})
+
+    user_ids = {ballot[0] for ballot in parsed.values()}
+    active_users = set()
+    for chunk in _chunks(user_ids):
+        active_users.update(User.objects.filter(pk__in=chunk, is_active=True)
+                            .values_list("pk", flat=True))
+    pairs = {ballot[1:3] for ballot in parsed.values()}
+    choices = _voting_windows(pairs, poll_db)
+    # a cached placement may be stale if rebalance_polls moved the poll
+    missing = pairs - choices.keys()
+    if missing and settings.POLL_DATABASES:
+        choices.update(_voting_windows(
+            missing, lambda question_id: poll_db(question_id, refresh=True)))
+
+    latest = {}
+    for index, (user_id, question_id, choice_id, cast_at) in parsed.items():
+        error = None
+        voting_window = choices.get((question_id, choice_id))
+        if user_id not in active_users:
+            error = "unknown user"
+        elif voting_window is None:
+            error = "choice does not belong to question"
+        elif cast_at > now + CLOCK_SKEW:
+            error = "cast_at is in the future"
+        elif cast_at < voting_window[0] or (voting_window[1] is not None
+                                            and cast_at > voting_window[1]):
+            error = "voting was not open at cast_at"
+        if error:
+            results[index] = {"status": REJECTED, "error": error}
+            continue
+        key = user_id, question_id
+        if key in latest:
+            # the earlier of the two loses, ties go to the later upload
+            previous = latest[key]
+            if parsed[previous][3] > cast_at:
+                results[index] = {"status": SUPERSEDED}
+                continue
+            results[previous] = {"status": SUPERSEDED}
+        latest[key] = index
+
+    ballots = [parsed[index][:3] for index in sorted(latest.values(),
+                                                     key=lambda i: parsed[i][3])]
+    return results, ballots
@@ -0,0 +1,118 @@
+"""
+Helpers shared by the benchmark management commands.
+
+Benchmarks run against a scratch SQLite file created like a test database,
+so they never touch the real data and concurrent workers can share it. Only
+the default database is replaced, so they refuse to run with partitioned
+polls, whose questions would go to the real poll databases.
+"""
+import datetime
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from importlib import import_module
+from io import StringIO
+from types import ModuleType
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.urls import include, path
+from django.utils import timezone
+
+from .models import Choice, Question, Vote
+from .urls import build_urlpatterns
+
+
+def _check_not_partitioned():
+    if settings.POLL_DATABASES:
+        raise CommandError("Benchmarks only replace the default database, "
+                           "unset DB_POLL_PARTITIONS to run them.")
+
+
+@contextmanager
+def scratch_database(verbosity=0):
+    """Create a throwaway file-based database, migrate it and use it as default."""
+    _check_not_partitioned()
+    tmpdir = tempfile.mkdtemp(prefix="polls-bench-")
+    test_settings = connection.settings_dict["TEST"]
+    old_test_name = test_settings["NAME"]
+    test_settings["NAME"] = os.path.join(tmpdir, "bench.sqlite3")
+    try:
+        old_name = connection.creation.create_test_db(verbosity=verbosity, autoclobber=True,
+                                                      serialize=False)
+        try:
+            yield
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity)
+    finally:
+        # later test databases of this process get their usual name again
+        test_settings["NAME"] = old_test_name
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+
+def polls_urlconf(use_async=False):
+    """Return a copy of the site's root URLconf serving the sync or async polls views."""
+    site = import_module(settings.ROOT_URLCONF)
+    urlconf = ModuleType(f"polls_bench_{'async' if use_async else 'sync'}_urls")
+    urlconf.urlpatterns = [
+        path("polls/", include((build_urlpatterns(use_async=use_async), "polls"))),
+    ] + [pattern for pattern in site.urlpatterns if str(pattern.pattern) != "polls/"]
+    return urlconf
+
+
+def percentile(values, pct):
+    """Return the pct-th percentile of values (nearest rank)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def seed_polls(rng, users, questions, choices, votes, batch_size=1000):
+    """
+    Fill the database with synthetic polls using bulk inserts.
+
+    Args:
+        rng (random.Random): Source of randomness, seed it for repeatable data.
+        users (int): Number of users to create.
+        questions (int): Number of questions, published over the past days.
+        choices (int): Number of choices per question.
+        votes (int): Number of votes, at most one per user and question.
+
+    Returns:
+        tuple: The created users and a dict of question id to its choice ids.
+    """
+    _check_not_partitioned()
+    now = timezone.now()
+    user_list = User.objects.bulk_create(
+        (User(username=f"bench{i}") for i in range(users)), batch_size=batch_size)
+    question_list = Question.objects.bulk_create(
+        (Question(question_text=f"Benchmark question {i}",
+                  pub_date=now - datetime.timedelta(hours=i + 1))
+         for i in range(questions)),
+        batch_size=batch_size)
+    choice_list = Choice.objects.bulk_create(
+        (Choice(question=question, choice_text=f"Choice {i}")
+         for question in question_list for i in range(choices)),
+        batch_size=batch_size)
+    poll_choices = {}
+    for choice in choice_list:
+        poll_choices.setdefault(choice.question_id, []).append(choice.id)
+
+    ballots = {}
+    votes = min(votes, users * questions)
+    while len(ballots) < votes:
+        user = rng.choice(user_list)
+        question_id = rng.choice(question_list).id
+        ballots[user.id, question_id] = rng.choice(poll_choices[question_id])
+    Vote.objects.bulk_create(
+        (Vote(user_id=user_id, question_id=question_id, choice_id=choice_id)
+         for (user_id, question_id), choice_id in ballots.items()),
+        batch_size=batch_size)
+    call_command("reconcile_vote_counts", verbosity=0, stdout=StringIO())
+    return user_list, poll_choices
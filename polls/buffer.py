@@ -0,0 +1,125 @@
+"""
+Write-behind buffer for votes.
+
+When POLLS_VOTE_BUFFER is on, the vote view only validates a ballot and puts
+it in an in-process queue. A background thread applies the queued ballots in
+batches with polls.partitions.record_ballots(), one transaction per batch and
+poll database, so a burst of voters does not queue up on SQLite's single
+write lock.
+"""
+import atexit
+import logging
+import threading
+from collections import deque
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .cache import bump_results_version
+from .partitions import record_ballots
+
+logger = logging.getLogger(__name__)
+
+
+class VoteBuffer:
+    """
+    Queue of accepted ballots and the thread that flushes them.
+
+    Attributes:
+        batch_size (int): Maximum number of ballots applied per transaction.
+        flush_interval (float): Seconds the flusher waits between flushes.
+    """
+
+    def __init__(self, batch_size=500, flush_interval=0.5):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = deque()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._queue)
+
+    def submit(self, user_id, question_id, choice_id):
+        """Accept a ballot. It is written to the database by a later flush."""
+        self._queue.append((user_id, question_id, choice_id))
+        if len(self._queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self):
+        """
+        Apply every queued ballot, one transaction per batch.
+
+        Returns:
+            int: The number of ballots taken from the queue.
+        """
+        flushed = 0
+        with self._flush_lock:
+            while self._queue:
+                batch = []
+                while self._queue and len(batch) < self.batch_size:
+                    batch.append(self._queue.popleft())
+                self._apply(batch)
+                flushed += len(batch)
+        return flushed
+
+    def _apply(self, batch):
+        try:
+            questions = record_ballots(batch)
+        except Exception:
+            # One bad ballot (e.g. a choice deleted meanwhile) must not drop
+            # the whole batch, so retry the ballots one by one.
+            logger.exception("Vote batch failed, applying ballots one at a time")
+            questions = set()
+            for ballot in batch:
+                try:
+                    questions |= record_ballots([ballot])
+                except Exception:
+                    logger.exception("Dropped ballot %r", ballot)
+        for question_id in questions:
+            bump_results_version(question_id)
+
+    def start(self):
+        """Start the flusher thread if it is not running yet."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="vote-buffer",
+                                            daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the flusher thread and drain whatever is still queued."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Vote buffer flush failed")
+        connection.close()
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_vote_buffer():
+    """Return the process-wide vote buffer, starting its flusher on first use."""
+    global _buffer
+    with _buffer_lock:
+        if _buffer is None:
+            _buffer = VoteBuffer(batch_size=settings.POLLS_VOTE_BUFFER_BATCH_SIZE,
+                                 flush_interval=settings.POLLS_VOTE_BUFFER_FLUSH_INTERVAL)
+            _buffer.start()
+    return _buffer
@@ -0,0 +1,191 @@
+"""
+Versioned caches for poll results and the index page.
+
+Cached data is stored under a key that embeds a version number. Recording a
+vote bumps the question's results version, and changing a question or
+choice bumps the index version, so stale entries are never read again and
+simply expire from the cache.
+
+Cache entries are filled from the primary database only. A replica can lag
+behind the version it is read under, and its stale data would otherwise be
+cached and served to everyone until the next bump.
+"""
+import hashlib
+import time
+from collections import Counter
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.utils.cache import patch_vary_headers
+
+from .events import broker
+from .models import Choice, Question, ResultsSnapshot
+from .routers import use_primary
+
+# hit / miss counters of this process
+stats = Counter()
+
+
+INDEX_VERSION_KEY = "polls:index:version"
+
+
+def _version_key(question_id):
+    return f"polls:results:{question_id}:version"
+
+
+def _get_version(key):
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock, so a version that was evicted is never reused.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _bump_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        # nothing cached under this version yet
+        cache.add(key, time.time_ns(), None)
+
+
+def results_version(question_id):
+    """Return the current results version of a question."""
+    return _get_version(_version_key(question_id))
+
+
+def bump_results_version(question_id):
+    """Invalidate the cached results of a question and notify live streams."""
+    _bump_version(_version_key(question_id))
+    broker.publish(question_id)
+
+
+def index_version():
+    """Return the current version of the index page."""
+    return _get_version(INDEX_VERSION_KEY)
+
+
+def bump_index_version():
+    """Invalidate the cached index page and question list fragments."""
+    _bump_version(INDEX_VERSION_KEY)
+
+
+def _results_rows(question):
+    # read from the primary even if the question came from a replica
+    using = question._state.db
+    if using in settings.DATABASE_REPLICAS:
+        using = DEFAULT_DB_ALIAS
+    # the counters of sharded questions are summed in the same query
+    return Choice.objects.using(using).filter(question=question) \
+        .with_total_votes().order_by("id") \
+        .values_list("id", "choice_text", "total_votes")
+
+
+def _as_results(rows):
+    return [{"id": pk, "choice_text": text, "votes": votes} for pk, text, votes in rows]
+
+
+def _snapshot_results(question):
+    """Return the frozen results of a closed question, or None if it has no snapshot."""
+    if question.status != Question.Status.CLOSED:
+        return None
+    try:
+        # loaded with the question when the view used select_related("snapshot")
+        return _as_results(question.snapshot.results)
+    except ResultsSnapshot.DoesNotExist:
+        return None
+
+
+def get_results(question):
+    """
+    Return the vote counts of a question.
+
+    A closed poll is served from its snapshot, other polls from the cache
+    when possible.
+
+    Returns:
+        list: One dict per choice with the keys id, choice_text and votes,
+        in choice id order.
+    """
+    results = _snapshot_results(question)
+    if results is not None:
+        return results
+    key = f"polls:results:{question.pk}:{results_version(question.pk)}"
+    results = cache.get(key)
+    if results is None:
+        stats["misses"] += 1
+        results = _as_results(_results_rows(question))
+        cache.set(key, results, settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    else:
+        stats["hits"] += 1
+    return results
+
+
+async def aresults_version(question_id):
+    """Async version of results_version()."""
+    key = _version_key(question_id)
+    version = await cache.aget(key)
+    if version is None:
+        await cache.aadd(key, time.time_ns(), None)
+        version = await cache.aget(key)
+    return version
+
+
+async def aget_results(question):
+    """Async version of get_results(), reading the choices with the async ORM."""
+    if question.status == Question.Status.CLOSED:
+        if Question.snapshot.is_cached(question):
+            results = _snapshot_results(question)
+        else:
+            results = await ResultsSnapshot.objects.using(question._state.db) \
+                .filter(pk=question.pk).values_list("results", flat=True).afirst()
+            results = None if results is None else _as_results(results)
+        if results is not None:
+            return results
+    key = f"polls:results:{question.pk}:{await aresults_version(question.pk)}"
+    results = await cache.aget(key)
+    if results is None:
+        stats["misses"] += 1
+        results = _as_results([row async for row in _results_rows(question)])
+        await cache.aset(key, results, settings.POLLS_RESULTS_CACHE_TIMEOUT)
+    else:
+        stats["hits"] += 1
+    return results
+
+
+def results_cache_stats():
+    """Return the hit and miss counts of the results cache in this process."""
+    return {"hits": stats["hits"], "misses": stats["misses"]}
+
+
+def anonymous_cache_page(view_func):
+    """
+    Cache whole GET responses of view_func for visitors who are not logged in.
+
+    Entries are keyed on the index version and the full path, so they are
+    dropped whenever a question or choice changes. Pages are rendered from the
+    primary before they are cached. Logged-in users always get a freshly
+    rendered page, and responses carry Vary: Cookie so that downstream caches
+    keep the two apart.
+    """
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "GET" or request.user.is_authenticated:
+            return view_func(request, *args, **kwargs)
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        key = f"polls:page:{index_version()}:{path}"
+        response = cache.get(key)
+        if response is None:
+            with use_primary():
+                response = view_func(request, *args, **kwargs)
+                if hasattr(response, "render") and callable(response.render):
+                    response.render()
+            # never share a response that sets cookies
+            if response.status_code == 200 and not response.cookies:
+                cache.set(key, response, settings.POLLS_INDEX_CACHE_TIMEOUT)
+        patch_vary_headers(response, ["Cookie"])
+        return response
+    return wrapper
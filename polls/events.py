@@ -0,0 +1,49 @@
+"""
+In-process publish/subscribe of results changes.
+
+bump_results_version() publishes the id of every question whose results
+changed. Live results streams subscribe to one question and are woken up on
+their own event loop. Only subscribers in the same process are notified.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+
+class ResultsBroker:
+    """Fan out "results changed" notifications to subscribed event loops."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = defaultdict(set)
+
+    def subscribe(self, question_id):
+        """
+        Subscribe the running event loop to a question.
+
+        Returns:
+            asyncio.Event: Set whenever the question's results change. The
+            subscriber clears it once it has sent an update.
+        """
+        event = asyncio.Event()
+        with self._lock:
+            self._subscribers[question_id].add((asyncio.get_running_loop(), event))
+        return event
+
+    def unsubscribe(self, question_id, event):
+        """Remove a subscription made by subscribe()."""
+        with self._lock:
+            subscribers = self._subscribers[question_id]
+            subscribers.difference_update({s for s in subscribers if s[1] is event})
+            if not subscribers:
+                del self._subscribers[question_id]
+
+    def publish(self, question_id):
+        """Notify the subscribers of a question. Safe to call from any thread."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(question_id, ()))
+        for loop, event in subscribers:
+            loop.call_soon_threadsafe(event.set)
+
+
+broker = ResultsBroker()
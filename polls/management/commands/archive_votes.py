@@ -0,0 +1,68 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from polls.models import ArchivedVote, Question, Vote
+from polls.partitions import poll_databases
+
+
+class Command(BaseCommand):
+    """
+    Move the votes of polls closed more than --days ago to ArchivedVote.
+
+    Votes are moved in batches, each copied and deleted in one transaction,
+    so an interrupted run leaves every vote in exactly one of the tables and
+    can simply be started again. The vote counters are not touched, so the
+    results stay the same. Votes come back to the Vote table when their poll
+    is reopened or a late kiosk ballot arrives for it.
+    """
+
+    help = "Archive the votes of long closed polls out of the Vote table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.POLLS_ARCHIVE_VOTES_AFTER_DAYS,
+            help="Archive polls closed at least this many days ago "
+                 "(default: POLLS_ARCHIVE_VOTES_AFTER_DAYS).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=2000,
+            help="Votes moved per transaction (default: 2000).",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only report how many votes would be archived.",
+        )
+
+    def handle(self, *args, **options):
+        cutoff = timezone.now() - datetime.timedelta(days=options["days"])
+        archived = 0
+        for database in poll_databases():
+            questions = Question.objects.using(database).filter(
+                status=Question.Status.CLOSED, end_date__lt=cutoff).values("pk")
+            votes = Vote.objects.using(database).filter(question__in=questions)
+            if options["dry_run"]:
+                archived += votes.count()
+                continue
+            archived += self._archive(database, votes, options["batch_size"])
+        verb = "Would archive" if options["dry_run"] else "Archived"
+        self.stdout.write(self.style.SUCCESS(f"{verb} {archived} votes."))
+
+    def _archive(self, database, votes, batch_size):
+        """Move votes to ArchivedVote batch_size at a time, return how many moved."""
+        moved = 0
+        while True:
+            with transaction.atomic(using=database):
+                batch = list(votes.order_by("pk")
+                             .values_list("pk", "question_id", "choice_id", "user_id")[:batch_size])
+                if not batch:
+                    return moved
+                ArchivedVote.objects.using(database).bulk_create(
+                    ArchivedVote(question_id=question_id, choice_id=choice_id, user_id=user_id)
+                    for _, question_id, choice_id, user_id in batch
+                )
+                Vote.objects.using(database).filter(pk__in=[pk for pk, _, _, _ in batch]).delete()
+            moved += len(batch)
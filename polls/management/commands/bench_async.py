@@ -0,0 +1,119 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import AsyncClient, Client, override_settings
+from django.urls import reverse
+
+from polls.bench import percentile, polls_urlconf, scratch_database
+from polls.models import Choice, Question
+
+
+class Command(BaseCommand):
+    """
+    Compare the sync and async view stacks under the same concurrent load.
+
+    Each worker is a logged-in voter that loops over the detail, vote and
+    results pages. The sync stack runs the workers in threads through the
+    WSGI test handler, the async stack runs them as tasks on one event loop
+    through the ASGI test handler.
+    """
+
+    help = "Benchmark requests/sec of the sync and async detail/vote/results views."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--requests", type=int, default=300,
+            help="Requests per stack (default: 300).",
+        )
+        parser.add_argument(
+            "--concurrency", type=int, default=10,
+            help="Number of concurrent voters (default: 10).",
+        )
+
+    def handle(self, *args, **options):
+        concurrency = options["concurrency"]
+        per_worker = max(1, options["requests"] // concurrency)
+
+        with scratch_database():
+            question = Question.objects.create(question_text="Benchmark question")
+            choices = Choice.objects.bulk_create(
+                Choice(question=question, choice_text=f"Choice {i}") for i in range(4)
+            )
+            users = [User.objects.create_user(username=f"bench{i}")
+                     for i in range(concurrency)]
+            paths = self._paths(question, choices)
+
+            rows = []
+            with override_settings(ROOT_URLCONF=polls_urlconf(use_async=False)):
+                rows.append(("sync", *self._run_sync(users, paths, per_worker)))
+            with override_settings(ROOT_URLCONF=polls_urlconf(use_async=True)):
+                rows.append(("async", *self._run_async(users, paths, per_worker)))
+
+        self.stdout.write(f"{'stack':<6} {'requests':>8} {'seconds':>8} {'req/s':>8} "
+                          f"{'p50 ms':>8} {'p95 ms':>8}")
+        for stack, latencies, elapsed in rows:
+            self.stdout.write(
+                f"{stack:<6} {len(latencies):>8} {elapsed:>8.2f} "
+                f"{len(latencies) / elapsed:>8.1f} "
+                f"{percentile(latencies, 50) * 1000:>8.2f} "
+                f"{percentile(latencies, 95) * 1000:>8.2f}"
+            )
+
+    def _paths(self, question, choices):
+        """Return the request cycle of one voter as (method, url, data) tuples."""
+        with override_settings(ROOT_URLCONF=polls_urlconf()):
+            return [
+                ("get", reverse("polls:detail", args=(question.id,)), None),
+                ("post", reverse("polls:vote", args=(question.id,)),
+                 {"choice": choices[0].id}),
+                ("get", reverse("polls:results", args=(question.id,)), None),
+            ]
+
+    def _run_sync(self, users, paths, per_worker):
+        def worker(user):
+            client = Client()
+            client.force_login(user)
+            latencies = []
+            try:
+                for i in range(per_worker):
+                    method, url, data = paths[i % len(paths)]
+                    start = time.perf_counter()
+                    getattr(client, method)(url, data)
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            return latencies
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=len(users)) as pool:
+            results = list(pool.map(worker, users))
+        elapsed = time.perf_counter() - start
+        return [latency for latencies in results for latency in latencies], elapsed
+
+    def _run_async(self, users, paths, per_worker):
+        clients = []
+        for user in users:
+            client = AsyncClient()
+            client.force_login(user)
+            clients.append(client)
+
+        async def worker(client):
+            latencies = []
+            for i in range(per_worker):
+                method, url, data = paths[i % len(paths)]
+                start = time.perf_counter()
+                await getattr(client, method)(url, data)
+                latencies.append(time.perf_counter() - start)
+            return latencies
+
+        async def main():
+            return await asyncio.gather(*(worker(client) for client in clients))
+
+        start = time.perf_counter()
+        results = asyncio.run(main())
+        elapsed = time.perf_counter() - start
+        return [latency for latencies in results for latency in latencies], elapsed
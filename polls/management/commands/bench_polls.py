@@ -0,0 +1,151 @@
+import json
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from polls.bench import percentile, polls_urlconf, scratch_database, seed_polls
+
+PATHS = ["index", "detail", "vote", "results"]
+
+
+class Command(BaseCommand):
+    """
+    Load test the polls request paths on synthetic data.
+
+    A scratch database is filled with users, questions, choices and votes by
+    bulk inserts. Concurrent logged-in clients then request the index,
+    detail, vote and results pages in random order through the test client.
+    Throughput, latency percentiles and queries per request are reported per
+    path, and can be written as JSON and compared with an earlier run.
+    """
+
+    help = "Benchmark the index, detail, vote and results paths under concurrent load."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--questions", type=int, default=50)
+        parser.add_argument("--choices", type=int, default=4,
+                            help="Choices per question (default: 4).")
+        parser.add_argument("--votes", type=int, default=5000)
+        parser.add_argument("--requests", type=int, default=1000,
+                            help="Total number of requests (default: 1000).")
+        parser.add_argument("--concurrency", type=int, default=8,
+                            help="Number of concurrent clients (default: 8).")
+        parser.add_argument("--seed", type=int, default=0,
+                            help="Random seed, for repeatable runs (default: 0).")
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--baseline",
+                            help="JSON results of an earlier run to compare against.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        concurrency = options["concurrency"]
+        # every client logs in as a user of its own
+        if not 1 <= concurrency <= options["users"]:
+            raise CommandError(f"--concurrency must be between 1 and --users ({options['users']}).")
+        per_worker = max(1, options["requests"] // concurrency)
+
+        with scratch_database(), override_settings(ROOT_URLCONF=polls_urlconf()):
+            users, poll_choices = seed_polls(rng, options["users"], options["questions"],
+                                             options["choices"], options["votes"])
+            plans = [self._plan(random.Random(rng.random()), poll_choices, per_worker)
+                     for _ in range(concurrency)]
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                samples = list(pool.map(self._worker, users[:concurrency], plans))
+            elapsed = time.perf_counter() - start
+
+        samples = [sample for worker_samples in samples for sample in worker_samples]
+        report = {
+            "config": {key: options[key] for key in
+                       ("users", "questions", "choices", "votes", "requests",
+                        "concurrency", "seed")},
+            "total": self._summary(samples, elapsed),
+            "paths": {name: self._summary([s for s in samples if s[0] == name], elapsed)
+                      for name in PATHS},
+        }
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"], encoding="utf-8") as fp:
+                baseline = json.load(fp)
+        self._print(report, baseline)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as fp:
+                json.dump(report, fp, indent=2, sort_keys=True)
+                fp.write("\n")
+
+    def _plan(self, rng, poll_choices, count):
+        """Return the (path name, method, url, data) requests of one client."""
+        question_ids = list(poll_choices)
+        plan = []
+        for _ in range(count):
+            name = rng.choice(PATHS)
+            question_id = rng.choice(question_ids)
+            if name == "index":
+                plan.append((name, "get", reverse("polls:index"), None))
+            elif name == "vote":
+                plan.append((name, "post", reverse("polls:vote", args=(question_id,)),
+                             {"choice": rng.choice(poll_choices[question_id])}))
+            else:
+                plan.append((name, "get", reverse(f"polls:{name}", args=(question_id,)),
+                             None))
+        return plan
+
+    def _worker(self, user, plan):
+        client = Client()
+        client.force_login(user)
+        queries = 0
+
+        def count_queries(execute, sql, params, many, context):
+            nonlocal queries
+            queries += 1
+            return execute(sql, params, many, context)
+
+        samples = []
+        try:
+            with connection.execute_wrapper(count_queries):
+                for name, method, url, data in plan:
+                    queries = 0
+                    start = time.perf_counter()
+                    response = getattr(client, method)(url, data)
+                    latency = time.perf_counter() - start
+                    samples.append((name, latency, queries, response.status_code))
+        finally:
+            connection.close()
+        return samples
+
+    def _summary(self, samples, elapsed):
+        latencies = [latency for _, latency, _, _ in samples]
+        return {
+            "requests": len(samples),
+            "errors": sum(1 for *_, status in samples if status >= 400),
+            "throughput": round(len(samples) / elapsed, 1) if elapsed else 0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "queries_per_request": round(
+                sum(queries for _, _, queries, _ in samples) / len(samples), 2)
+            if samples else 0,
+        }
+
+    def _print(self, report, baseline):
+        columns = ["requests", "errors", "throughput", "p50_ms", "p95_ms", "p99_ms",
+                   "queries_per_request"]
+        self.stdout.write(f"{'path':<8}" + "".join(f"{c:>21}" for c in columns))
+        rows = [("total", report["total"])] + list(report["paths"].items())
+        for name, summary in rows:
+            cells = []
+            for column in columns:
+                cell = f"{summary[column]}"
+                if baseline:
+                    before = (baseline["total"] if name == "total"
+                              else baseline["paths"].get(name, {})).get(column)
+                    if before:
+                        cell += f" ({(summary[column] - before) / before:+.0%})"
+                cells.append(f"{cell:>21}")
+            self.stdout.write(f"{name:<8}" + "".join(cells))
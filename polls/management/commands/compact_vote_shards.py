@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from polls.models import ChoiceVoteShard
+from polls.partitions import poll_databases
+
+
+class Command(BaseCommand):
+    """
+    Fold the counter shards of sharded questions back into Choice.votes.
+
+    Run it periodically (e.g. from cron) so the shard rows of a busy poll
+    stay few, and after lowering a question's counter_shards. Choices are
+    compacted one batch per transaction.
+    """
+
+    help = "Fold ChoiceVoteShard rows into Choice.votes."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of choices to compact per transaction (default: 500).",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        folded = choices = 0
+        for database in poll_databases():
+            shards = ChoiceVoteShard.objects.db_manager(database)
+            last_pk = 0
+            while True:
+                batch = list(
+                    shards.filter(choice_id__gt=last_pk)
+                    .order_by("choice_id").values_list("choice_id", flat=True)
+                    .distinct()[:batch_size]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1]
+                folded += shards.compact(batch)
+                choices += len(batch)
+        self.stdout.write(self.style.SUCCESS(
+            f"Folded {folded} shards into {choices} choices."))
@@ -0,0 +1,80 @@
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import serializers
+from django.core.management.base import BaseCommand, CommandError
+
+from polls.models import ArchivedVote, Choice, Question, Vote
+from polls.serialization import FORMATS, guess_format, peak_memory_mb, write_records
+
+
+class Command(BaseCommand):
+    """
+    Dump polls, choices and votes (archived ones too) as a fixture without
+    loading them all.
+
+    Rows are read with QuerySet.iterator() and written as they are read, so
+    the output can be much larger than memory. The JSON format is the one
+    loaddata and import_polls read. Partitioned polls are not supported.
+    """
+
+    help = "Stream polls, choices and votes to a JSON or NDJSON fixture."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "-o", "--output",
+            help="File to write to (default: standard output).",
+        )
+        parser.add_argument(
+            "--format", choices=FORMATS,
+            help="Fixture format (default: guessed from --output, else json).",
+        )
+        parser.add_argument(
+            "--users", action="store_true",
+            help="Also export users, e.g. to seed another environment.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=2000,
+            help="Rows fetched from the database per round trip (default: 2000).",
+        )
+
+    def handle(self, *args, **options):
+        if settings.POLL_DATABASES:
+            # choice and vote ids are only unique within one poll database
+            raise CommandError("export_polls doesn't support partitioned polls.")
+        output = options["output"]
+        fmt = options["format"] or (guess_format(output) if output else "json")
+        querysets = [Question.objects.all(), Choice.objects.all(), Vote.objects.all(),
+                     ArchivedVote.objects.all()]
+        if options["users"]:
+            querysets.insert(0, User.objects.all())
+
+        start = time.perf_counter()
+        records = self._records(querysets, options["batch_size"])
+        if output:
+            with open(output, "w", encoding="utf-8") as fp:
+                total = write_records(fp, records, fmt)
+        else:
+            # the fixture is written in pieces, don't add a newline to each
+            self.stdout.ending = ""
+            total = write_records(self.stdout, records, fmt)
+
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed else 0
+        summary = f"Exported {total} rows in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        peak = peak_memory_mb()
+        if peak is not None:
+            summary += f", peak memory {peak:.1f} MB"
+        # keep standard output clean for the fixture itself
+        (self.stdout if output else self.stderr).write(self.style.SUCCESS(summary + "."))
+
+    def _records(self, querysets, batch_size):
+        for queryset in querysets:
+            rows = queryset.order_by("pk").iterator(chunk_size=batch_size)
+            while True:
+                chunk = list(islice(rows, batch_size))
+                if not chunk:
+                    break
+                yield from serializers.serialize("python", chunk)
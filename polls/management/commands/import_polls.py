@@ -0,0 +1,118 @@
+import time
+from itertools import groupby
+
+from django.apps import apps
+from django.conf import settings
+from django.core import serializers
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from polls.models import ArchivedVote, Choice, Question, Vote
+from polls.serialization import FORMATS, guess_format, iter_records, peak_memory_mb
+
+
+class Command(BaseCommand):
+    """
+    Load poll fixtures by streaming them into bulk inserts.
+
+    Unlike loaddata, the file is never read into memory as a whole and rows
+    are written with one bulk INSERT per batch, one transaction per batch.
+    Existing rows with the same primary key are overwritten, like loaddata
+    does. Votes without a question (the format before Vote.question existed)
+    get it from their choice. Partitioned polls are not supported.
+    """
+
+    help = "Stream JSON or NDJSON poll fixtures into the database in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("fixtures", nargs="+", help="Fixture files to load.")
+        parser.add_argument(
+            "--format", choices=FORMATS,
+            help="Fixture format (default: guessed from the file name).",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=1000,
+            help="Number of rows per INSERT and per transaction (default: 1000).",
+        )
+
+    def handle(self, *args, **options):
+        if settings.POLL_DATABASES:
+            # choice and vote ids are only unique within one poll database
+            raise CommandError("import_polls doesn't support partitioned polls. Import with "
+                               "DB_POLL_PARTITIONS unset, then run rebalance_polls --unplaced.")
+        batch_size = options["batch_size"]
+        total = 0
+        imported_questions = imported_votes = False
+        start = time.perf_counter()
+
+        for path in options["fixtures"]:
+            fmt = options["format"] or guess_format(path)
+            try:
+                fp = open(path, encoding="utf-8")
+            except OSError as e:
+                raise CommandError(f"Cannot read {path}: {e}")
+            with fp:
+                for model, batch in self._batches(iter_records(fp, fmt), batch_size):
+                    with transaction.atomic():
+                        self._save(model, batch)
+                    total += len(batch)
+                    imported_questions = imported_questions or model is Question
+                    imported_votes = imported_votes or model in (Vote, ArchivedVote)
+                    if options["verbosity"] > 1:
+                        self.stdout.write(f"{total} rows imported")
+
+        if imported_questions:
+            # bulk inserts skip Question.save(), which sets the status
+            Question.objects.update_status()
+        if imported_votes:
+            # the counters of the imported choices must match the imported votes
+            call_command("reconcile_vote_counts", stdout=self.stdout, verbosity=0)
+
+        elapsed = time.perf_counter() - start
+        rate = total / elapsed if elapsed else 0
+        summary = f"Imported {total} rows in {elapsed:.2f}s ({rate:.0f} rows/s)"
+        peak = peak_memory_mb()
+        if peak is not None:
+            summary += f", peak memory {peak:.1f} MB"
+        self.stdout.write(self.style.SUCCESS(summary + "."))
+
+    def _batches(self, records, batch_size):
+        """Group consecutive records of the same model into batches of objects."""
+        for label, group in groupby(records, key=lambda record: record["model"].lower()):
+            try:
+                model = apps.get_model(label)
+            except (LookupError, ValueError):
+                raise CommandError(f"Unknown model in fixture: {label}")
+            batch = []
+            for record in group:
+                batch.append(next(serializers.deserialize("python", [record])))
+                if len(batch) >= batch_size:
+                    yield model, batch
+                    batch = []
+            if batch:
+                yield model, batch
+
+    def _save(self, model, batch):
+        objects = [item.object for item in batch]
+        if model is Vote:
+            self._fill_vote_questions(objects)
+        fields = [field.name for field in model._meta.concrete_fields
+                  if not field.primary_key]
+        model.objects.bulk_create(objects, update_conflicts=True,
+                                  unique_fields=[model._meta.pk.name],
+                                  update_fields=fields)
+        for item in batch:
+            for name, values in item.m2m_data.items():
+                if values:
+                    getattr(item.object, name).set(values)
+
+    def _fill_vote_questions(self, votes):
+        missing = {vote.choice_id for vote in votes if vote.question_id is None}
+        if not missing:
+            return
+        questions = dict(Choice.objects.filter(pk__in=missing)
+                         .values_list("id", "question_id"))
+        for vote in votes:
+            if vote.question_id is None:
+                vote.question_id = questions.get(vote.choice_id)
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from polls.middleware import get_summary, reset_summary
+
+
+class Command(BaseCommand):
+    """
+    Print the per-URL-name timings recorded by PerformanceMiddleware.
+
+    The summary is kept in the default cache, so this only sees the web
+    server's numbers when that cache is shared between processes, i.e. the
+    Redis or Memcached cache of the production profile. With the local
+    memory cache it never sees anything.
+    """
+
+    help = "Show the request timings collected by PerformanceMiddleware."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true",
+            help="Clear the summary after printing it.",
+        )
+
+    def handle(self, *args, **options):
+        summary = get_summary()
+        if not summary:
+            self.stdout.write("No requests recorded. Is POLLS_PERF_SAMPLE_RATE above 0?")
+        else:
+            self.stdout.write(f"{'url name':<24} {'requests':>8} {'avg ms':>8} {'max ms':>8} "
+                              f"{'sql ms':>8} {'queries':>8} {'tpl ms':>8}")
+            rows = sorted(summary.items(), key=lambda item: item[1]["total"], reverse=True)
+            for name, entry in rows:
+                n = entry["requests"]
+                self.stdout.write(
+                    f"{name:<24} {n:>8} {entry['total'] / n * 1000:>8.2f} "
+                    f"{entry['max'] * 1000:>8.2f} {entry['sql'] / n * 1000:>8.2f} "
+                    f"{entry['queries'] / n:>8.1f} {entry['template'] / n * 1000:>8.2f}"
+                )
+        if options["reset"]:
+            reset_summary()
+            self.stdout.write(self.style.SUCCESS("Summary cleared."))
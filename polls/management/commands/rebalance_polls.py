@@ -0,0 +1,123 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from polls.cache import bump_index_version, bump_results_version
+from polls.models import (ArchivedVote, Choice, ChoiceVoteShard, PollPlacement, Question,
+                          ResultsSnapshot, Vote)
+
+
+class Command(BaseCommand):
+    """
+    Move polls, with their choices, votes (archived ones too), counter shards
+    and results snapshots, to another poll database.
+
+    The poll is copied into the target database in one transaction, its
+    placement is switched, and only then is it deleted from the source.
+    Polls that are not placed yet are taken from the default database, so
+    this also moves existing polls into the partitions after turning them on.
+    Votes cast on a poll while it moves can be lost, so move polls while
+    they are quiet, e.g. after they closed.
+    """
+
+    help = "Move polls between the POLL_DATABASES partitions."
+
+    def add_arguments(self, parser):
+        parser.add_argument("question_ids", nargs="*", type=int, help="Ids of the polls to move.")
+        parser.add_argument(
+            "--to", dest="target",
+            help="Poll database to move to (default: the one the poll id hashes to).",
+        )
+        parser.add_argument(
+            "--unplaced", action="store_true",
+            help="Move every poll still in the default database.",
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=2000,
+            help="Votes copied per INSERT (default: 2000).",
+        )
+
+    def handle(self, *args, **options):
+        databases = settings.POLL_DATABASES
+        if not databases:
+            raise CommandError("Polls are not partitioned, set DB_POLL_PARTITIONS.")
+        target = options["target"]
+        if target is not None and target not in databases:
+            raise CommandError(f"{target} is not one of {', '.join(databases)}.")
+        question_ids = list(options["question_ids"])
+        if options["unplaced"]:
+            placed = set(PollPlacement.objects.values_list("pk", flat=True))
+            question_ids += [pk for pk in Question.objects.using(DEFAULT_DB_ALIAS)
+                             .order_by("pk").values_list("pk", flat=True) if pk not in placed]
+        if not question_ids:
+            raise CommandError("Give the ids of the polls to move, or --unplaced.")
+
+        for question_id in question_ids:
+            source = self._source(question_id)
+            destination = target or databases[question_id % len(databases)]
+            if source == destination:
+                self.stdout.write(f"Poll {question_id} is already in {destination}.")
+                continue
+            votes = self._move(question_id, source, destination, options["batch_size"])
+            self.stdout.write(self.style.SUCCESS(
+                f"Moved poll {question_id} with {votes} votes from {source} to {destination}."))
+
+    def _source(self, question_id):
+        database = PollPlacement.objects.filter(pk=question_id) \
+            .values_list("database", flat=True).first()
+        if database is None:
+            database = DEFAULT_DB_ALIAS
+        if not Question.objects.using(database).filter(pk=question_id).exists():
+            raise CommandError(f"Poll {question_id} not found in {database}.")
+        return database
+
+    def _move(self, question_id, source, destination, batch_size):
+        """Copy a poll to destination, switch its placement, delete the original."""
+        question = Question.objects.using(source).get(pk=question_id)
+        with transaction.atomic(using=destination):
+            # the question keeps its id, which is unique across all databases
+            Question.objects.using(destination).bulk_create([question])
+            # choice ids are per database, so choices get new ids there
+            old_choices = list(Choice.objects.using(source).filter(question_id=question_id)
+                               .order_by("pk"))
+            old_ids = [choice.pk for choice in old_choices]
+            for choice in old_choices:
+                choice.pk = None
+            new_choices = Choice.objects.using(destination).bulk_create(old_choices)
+            new_ids = dict(zip(old_ids, (choice.pk for choice in new_choices)))
+
+            ChoiceVoteShard.objects.using(destination).bulk_create(
+                ChoiceVoteShard(choice_id=new_ids[choice_id], shard=shard, votes=votes)
+                for choice_id, shard, votes in ChoiceVoteShard.objects.using(source)
+                .filter(choice_id__in=old_ids).values_list("choice_id", "shard", "votes")
+            )
+            copied = 0
+            for model in (Vote, ArchivedVote):
+                rows = model.objects.using(source).filter(question_id=question_id) \
+                    .order_by("pk").values_list("user_id", "choice_id") \
+                    .iterator(chunk_size=batch_size)
+                while chunk := list(islice(rows, batch_size)):
+                    model.objects.using(destination).bulk_create(
+                        model(question_id=question_id, user_id=user_id,
+                              choice_id=new_ids[choice_id])
+                        for user_id, choice_id in chunk
+                    )
+                    copied += len(chunk)
+            snapshot = ResultsSnapshot.objects.using(source).filter(pk=question_id).first()
+            if snapshot is not None:
+                # choice ids in the frozen results change with the choices
+                for row in snapshot.results:
+                    row[0] = new_ids[row[0]]
+                ResultsSnapshot.objects.using(destination).bulk_create([snapshot])
+        PollPlacement.objects.place(question_id, destination)
+
+        with transaction.atomic(using=source):
+            Vote.objects.using(source).filter(question_id=question_id).delete()
+            ArchivedVote.objects.using(source).filter(question_id=question_id).delete()
+            ChoiceVoteShard.objects.using(source).filter(choice_id__in=old_ids).delete()
+            Question.objects.using(source).filter(pk=question_id).delete()
+        bump_results_version(question_id)
+        bump_index_version()
+        return copied
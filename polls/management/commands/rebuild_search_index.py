@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS
+
+from polls.partitions import poll_databases
+from polls.search import rebuild_search_index
+
+
+class Command(BaseCommand):
+    """
+    Refill the polls_question_fts search index from the questions and choices.
+
+    The triggers keep the index current, so this is only needed after writes
+    that bypassed them, e.g. rows loaded with the triggers dropped, or to
+    compact the index after heavy churn.
+    """
+
+    help = "Rebuild the full-text search index of the polls."
+
+    def handle(self, *args, **options):
+        for database in poll_databases():
+            using = database or DEFAULT_DB_ALIAS
+            if rebuild_search_index(using):
+                self.stdout.write(self.style.SUCCESS(f"Rebuilt the search index of {using}."))
+            else:
+                self.stdout.write(f"{using} has no search index, search uses LIKE there.")
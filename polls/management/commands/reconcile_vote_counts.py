@@ -0,0 +1,112 @@
+from collections import Counter, defaultdict
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F
+
+from polls.models import ArchivedVote, Choice, ChoiceVoteShard, ResultsSnapshot, Vote
+from polls.partitions import poll_databases
+
+
+class Command(BaseCommand):
+    """
+    Recompute the denormalized Choice.votes counters from the Vote and
+    ArchivedVote tables.
+
+    The stored count includes any counter shards, and a fixed choice has the
+    shard votes read under lock folded into Choice.votes. Choices are processed in primary key
+    order, one batch per transaction, so the command can run against a live
+    database without holding a long lock. With partitioned polls every poll
+    database is reconciled in turn. The results snapshots of closed polls
+    whose counters were fixed are taken again.
+    """
+
+    help = "Recompute Choice.votes from Vote rows and report any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Number of choices to reconcile per transaction (default: 500).",
+        )
+        parser.add_argument(
+            "--dry-run", action="store_true",
+            help="Only report drift, do not write the corrected counters.",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        dry_run = options["dry_run"]
+        checked = drifted = 0
+        for database in poll_databases():
+            batch_checked, batch_drifted = self._reconcile(database, batch_size, dry_run,
+                                                           options["verbosity"])
+            checked += batch_checked
+            drifted += batch_drifted
+
+        summary = f"Checked {checked} choices, {drifted} drifted."
+        if drifted and not dry_run:
+            summary += " Counters fixed."
+        self.stdout.write(self.style.SUCCESS(summary))
+
+    def _reconcile(self, database, batch_size, dry_run, verbosity):
+        """Reconcile the choices of one poll database, return (checked, drifted)."""
+        choices = Choice.objects.using(database)
+        checked = drifted = 0
+        last_pk = 0
+
+        while True:
+            with transaction.atomic(using=database):
+                batch = list(
+                    choices.filter(pk__gt=last_pk)
+                    .order_by("pk")
+                    .with_total_votes()
+                    .values_list("pk", "votes", "total_votes", "question_id")[:batch_size]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1][0]
+                # locked before counting, like ChoiceVoteShardManager.compact(),
+                # so only what was read here is folded in below
+                shards = defaultdict(list)
+                for shard_pk, choice_id, votes in (
+                        ChoiceVoteShard.objects.using(database).select_for_update()
+                        .filter(choice_id__in=[pk for pk, _, _, _ in batch])
+                        .values_list("pk", "choice_id", "votes")):
+                    shards[choice_id].append((shard_pk, votes))
+                actual = Counter()
+                # archived votes still count
+                for model in (Vote, ArchivedVote):
+                    actual.update(dict(
+                        model.objects.using(database)
+                        .filter(choice_id__in=[pk for pk, _, _, _ in batch])
+                        .values_list("choice_id")
+                        .annotate(total=Count("id"))
+                        .order_by()
+                    ))
+                fixed = set()
+                folded = defaultdict(list)
+                for pk, base, stored, question_id in batch:
+                    counted = actual.get(pk, 0)
+                    if stored == counted:
+                        continue
+                    drifted += 1
+                    if verbosity > 0:
+                        self.stdout.write(self.style.WARNING(
+                            f"Choice {pk}: stored {stored}, counted {counted}"
+                        ))
+                    if not dry_run:
+                        # skip the row if a vote moved it since we read it
+                        if choices.filter(pk=pk, votes=base).update(votes=counted):
+                            for shard_pk, votes in shards[pk]:
+                                folded[votes].append(shard_pk)
+                            fixed.add(question_id)
+                # take away what was read, votes added since then stay in the shards
+                for votes, shard_pks in folded.items():
+                    ChoiceVoteShard.objects.using(database).filter(pk__in=shard_pks) \
+                        .update(votes=F("votes") - votes)
+                ChoiceVoteShard.objects.using(database).filter(
+                    pk__in=[pk for pks in folded.values() for pk in pks], votes=0).delete()
+                # closed polls show their snapshot, which must show the fix too
+                ResultsSnapshot.objects.db_manager(database).refresh(fixed)
+                checked += len(batch)
+        return checked, drifted
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from polls.cache import bump_index_version
+from polls.models import ResultsSnapshot
+from polls.partitions import poll_databases
+
+
+class Command(BaseCommand):
+    """
+    Take the results snapshots of closed polls that have none yet.
+
+    update_poll_status snapshots polls as they close, so this is for the
+    polls that closed before snapshots existed. It can be run again at any
+    time; polls that already have a snapshot are skipped.
+    """
+
+    help = "Backfill the results snapshots of closed polls."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size", type=int, default=500,
+            help="Polls snapshotted per transaction (default: 500).",
+        )
+
+    def handle(self, *args, **options):
+        frozen = 0
+        for database in poll_databases():
+            frozen += ResultsSnapshot.objects.db_manager(database) \
+                .freeze_closed(options["batch_size"])
+        if frozen:
+            # the index shows the final totals
+            bump_index_version()
+        self.stdout.write(self.style.SUCCESS(f"Took {frozen} results snapshots."))
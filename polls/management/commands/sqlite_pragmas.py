@@ -0,0 +1,70 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+REPORTED_PRAGMAS = [
+    "journal_mode",
+    "synchronous",
+    "busy_timeout",
+    "cache_size",
+    "mmap_size",
+    "temp_store",
+    "wal_autocheckpoint",
+    "page_size",
+    "page_count",
+    "freelist_count",
+]
+
+
+class Command(BaseCommand):
+    """
+    Report the SQLite pragmas in effect and run routine maintenance.
+
+    The values shown are those of a fresh connection, so they include
+    everything applied from SQLITE_PRAGMAS by the connection_created hook.
+    """
+
+    help = "Show SQLite pragmas in effect, optionally run PRAGMA optimize and a WAL checkpoint."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database", default=DEFAULT_DB_ALIAS,
+            help="Database alias to inspect (default: default).",
+        )
+        parser.add_argument(
+            "--optimize", action="store_true",
+            help="Run PRAGMA optimize.",
+        )
+        parser.add_argument(
+            "--checkpoint", action="store_true",
+            help="Run PRAGMA wal_checkpoint(TRUNCATE).",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != "sqlite":
+            raise CommandError(f"Database '{options['database']}' is not SQLite.")
+
+        with connection.cursor() as cursor:
+            for name in REPORTED_PRAGMAS:
+                cursor.execute(f"PRAGMA {name}")
+                row = cursor.fetchone()
+                # e.g. mmap_size has no value on an in-memory database
+                self.stdout.write(f"{name} = {row[0] if row else 'n/a'}")
+
+            if options["optimize"]:
+                cursor.execute("PRAGMA optimize")
+                self.stdout.write(self.style.SUCCESS("PRAGMA optimize done."))
+
+            if options["checkpoint"]:
+                cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                busy, log_frames, checkpointed = cursor.fetchone()
+                if log_frames == -1:
+                    self.stdout.write("Not in WAL mode, nothing to checkpoint.")
+                elif busy:
+                    self.stdout.write(self.style.WARNING(
+                        "Checkpoint could not complete, the database is busy."
+                    ))
+                else:
+                    self.stdout.write(self.style.SUCCESS(
+                        f"Checkpointed {checkpointed} of {log_frames} WAL frames."
+                    ))
@@ -0,0 +1,35 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+
+class Command(BaseCommand):
+    """
+    Copy the primary SQLite database over each of its read replicas.
+
+    Production replicas are kept in step by replication outside Django. This
+    command makes a consistent snapshot with SQLite's online backup API, so
+    replica routing can be tried out locally with a second SQLite file.
+    """
+
+    help = "Copy the primary database into every SQLite alias in DATABASE_REPLICAS."
+
+    def handle(self, *args, **options):
+        if not settings.DATABASE_REPLICAS:
+            raise CommandError("No replicas configured, set DB_REPLICAS.")
+        primary = connections[DEFAULT_DB_ALIAS]
+        if primary.vendor != "sqlite":
+            raise CommandError("sync_replicas only copies SQLite databases.")
+        primary.ensure_connection()
+        for alias in settings.DATABASE_REPLICAS:
+            name = connections[alias].settings_dict["NAME"]
+            # the replica's own connection may hold an old snapshot
+            connections[alias].close()
+            target = sqlite3.connect(name)
+            try:
+                primary.connection.backup(target)
+            finally:
+                target.close()
+            self.stdout.write(self.style.SUCCESS(f"Copied {DEFAULT_DB_ALIAS} to {alias} ({name})."))
@@ -0,0 +1,58 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from polls.cache import bump_index_version
+from polls.models import ArchivedVote, Question, ResultsSnapshot
+from polls.partitions import poll_databases
+
+
+class Command(BaseCommand):
+    """
+    Move polls along their lifecycle as pub_date and end_date pass.
+
+    Scheduled polls whose pub_date has come are opened and open polls whose
+    end_date has passed are closed, with one bulk UPDATE per transition.
+    Polls that closed get their results snapshot.
+    Run it once from cron, or keep it running with --loop.
+    """
+
+    help = "Flip polls between scheduled, open and closed at their date boundaries."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop", action="store_true",
+            help="Keep running, updating every --interval seconds.",
+        )
+        parser.add_argument(
+            "--interval", type=float, default=60,
+            help="Seconds between updates with --loop (default: 60).",
+        )
+        parser.add_argument(
+            "--all", action="store_true",
+            help="Check closed polls too, e.g. after dates were changed with bulk updates.",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            changed = 0
+            for database in poll_databases():
+                questions = Question.objects.using(database)
+                snapshots = ResultsSnapshot.objects.db_manager(database)
+                if not options["all"]:
+                    # closed polls never reopen as time passes
+                    questions = questions.exclude(status=Question.Status.CLOSED)
+                changed += questions.update_status()
+                if options["all"]:
+                    # polls reopened by changed dates
+                    snapshots.exclude(question__status=Question.Status.CLOSED).delete()
+                    ArchivedVote.objects.db_manager(database).restore(
+                        questions.exclude(status=Question.Status.CLOSED).values("pk"))
+                snapshots.freeze_closed()
+            if changed:
+                bump_index_version()
+            if changed or not options["loop"]:
+                self.stdout.write(f"Updated the status of {changed} polls.")
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
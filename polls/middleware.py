@@ -0,0 +1,203 @@
+"""
+Per-request performance instrumentation.
+
+PerformanceMiddleware times the SQL queries, the template rendering and the
+whole request for a sample of requests. The timings are sent back in a
+Server-Timing header, so they show up in the browser's network panel, and
+are added to a per-URL-name summary kept in the cache, which the
+perf_summary command prints.
+
+Every number of the summary is a separate cache key that is only ever
+increased with cache.incr(), and the URL names are read from the URLconf
+rather than kept in the cache. That needs a backend whose incr() is atomic
+and keeps the key's expiry: Redis or Memcached, which the production profile
+requires, or the local memory cache within one process. The database and
+file caches emulate incr() with a get and a set, and lose updates. The
+summary only covers all worker processes, and is only visible to
+perf_summary, when the cache is shared between processes.
+"""
+import random
+import time
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.urls import URLResolver, get_resolver
+
+# summed fields, times in microseconds since incr() only takes integers
+FIELDS = ["requests", "total", "sql", "queries", "template"]
+
+
+class RequestTimings:
+    """Timings collected while one request is handled."""
+
+    def __init__(self):
+        self.queries = 0
+        self.sql = 0.0
+        self.template = 0.0
+        self._render_start = None
+
+    def __call__(self, execute, sql, params, many, context):
+        # used as a database execute wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql += time.perf_counter() - start
+            self.queries += 1
+
+    def render_started(self):
+        self._render_start = time.perf_counter()
+
+    def render_finished(self, response):
+        self.template += time.perf_counter() - self._render_start
+
+
+def _wrap_connections(stack, timings):
+    """Time the queries of this thread's connections until stack is closed."""
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(timings))
+
+
+class PerformanceMiddleware:
+    """
+    Record SQL, template and total time of a sample of requests.
+
+    The share of requests instrumented is POLLS_PERF_SAMPLE_RATE. When it is
+    0 the middleware removes itself from the chain at startup, so it costs
+    nothing. It runs natively in both sync (WSGI) and async (ASGI) chains.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.sample_rate = settings.POLLS_PERF_SAMPLE_RATE
+        if not self.sample_rate:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            return self.get_response(request)
+
+        timings = request._perf_timings = RequestTimings()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            _wrap_connections(stack, timings)
+            response = self.get_response(request)
+        total = time.perf_counter() - start
+
+        self.add_header(response, timings, total)
+        if request.resolver_match is not None:
+            record(request.resolver_match.view_name, timings, total)
+        return response
+
+    async def __acall__(self, request):
+        """Async version of __call__(), used when the rest of the chain is async."""
+        if random.random() >= self.sample_rate:
+            return await self.get_response(request)
+
+        timings = request._perf_timings = RequestTimings()
+        start = time.perf_counter()
+        # connections are per thread and the queries of this request run in
+        # its sync_to_async thread, so the wrappers are installed there
+        stack = ExitStack()
+        await sync_to_async(_wrap_connections)(stack, timings)
+        try:
+            response = await self.get_response(request)
+        finally:
+            await sync_to_async(stack.close)()
+        total = time.perf_counter() - start
+
+        self.add_header(response, timings, total)
+        if request.resolver_match is not None:
+            await sync_to_async(record)(request.resolver_match.view_name, timings, total)
+        return response
+
+    @staticmethod
+    def add_header(response, timings, total):
+        response["Server-Timing"] = (
+            f'db;dur={timings.sql * 1000:.2f};desc="{timings.queries} queries", '
+            f"tpl;dur={timings.template * 1000:.2f}, "
+            f"total;dur={total * 1000:.2f}"
+        )
+
+    def process_template_response(self, request, response):
+        timings = getattr(request, "_perf_timings", None)
+        if timings is not None:
+            # TemplateResponses are rendered after this hook returns
+            timings.render_started()
+            response.add_post_render_callback(timings.render_finished)
+        return response
+
+
+def _key(view_name, field):
+    return f"polls:perf:{view_name}:{field}"
+
+
+def _add(key, delta):
+    """Atomically add delta to the counter under key, creating it if needed."""
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, None):
+            return delta
+        # a concurrent request created it between the two calls
+        return cache.incr(key, delta)
+
+
+def record(view_name, timings, total):
+    """Add one request's timings to the summary of its URL name."""
+    values = {
+        "requests": 1,
+        "total": round(total * 1e6),
+        "sql": round(timings.sql * 1e6),
+        "queries": timings.queries,
+        "template": round(timings.template * 1e6),
+    }
+    for field, value in values.items():
+        _add(_key(view_name, field), value)
+    # the maximum can't be incremented, a near simultaneous slower request may win
+    max_key = _key(view_name, "max")
+    if values["total"] > cache.get(max_key, 0):
+        cache.set(max_key, values["total"], None)
+
+
+def _view_names(resolver=None, namespace=""):
+    """Yield the view name of every URL pattern, as ResolverMatch.view_name has it."""
+    resolver = resolver or get_resolver()
+    for pattern in resolver.url_patterns:
+        if isinstance(pattern, URLResolver):
+            prefix = f"{namespace}{pattern.namespace}:" if pattern.namespace else namespace
+            yield from _view_names(pattern, prefix)
+        else:
+            yield f"{namespace}{pattern.name}" if pattern.name else pattern.lookup_str
+
+
+def get_summary():
+    """Return the recorded timings, keyed by URL name, with times in seconds."""
+    summary = {}
+    for view_name in dict.fromkeys(_view_names()):
+        values = cache.get_many([_key(view_name, field) for field in FIELDS + ["max"]])
+        entry = {field: values.get(_key(view_name, field), 0) for field in FIELDS + ["max"]}
+        if not entry["requests"]:
+            continue
+        for field in ("total", "sql", "template", "max"):
+            entry[field] /= 1e6
+        summary[view_name] = entry
+    return summary
+
+
+def reset_summary():
+    """Forget the recorded timings."""
+    cache.delete_many([_key(view_name, field) for view_name in dict.fromkeys(_view_names())
+                       for field in FIELDS + ["max"]])
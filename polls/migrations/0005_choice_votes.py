@@ -0,0 +1,29 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def count_existing_votes(apps, schema_editor):
+    """Fill the new counter from the votes that were already recorded."""
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    counts = Vote.objects.values('choice_id').annotate(total=Count('id'))
+    for row in counts:
+        Choice.objects.filter(pk=row['choice_id']).update(votes=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0004_remove_choice_votes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='choice',
+            name='votes',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(count_existing_votes, migrations.RunPython.noop),
+    ]
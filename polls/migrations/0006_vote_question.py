@@ -0,0 +1,49 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:40
+
+from django.db import migrations, models
+from django.db.models import Count, F, Max
+import django.db.models.deletion
+
+
+def fill_vote_question(apps, schema_editor):
+    """
+    Copy the question of each vote's choice onto the vote and drop duplicate
+    votes of a user on one question, keeping the latest one.
+    """
+    Choice = apps.get_model('polls', 'Choice')
+    Vote = apps.get_model('polls', 'Vote')
+    for choice in Choice.objects.all().only('id', 'question_id'):
+        Vote.objects.filter(choice_id=choice.id).update(question_id=choice.question_id)
+    duplicates = Vote.objects.values('user_id', 'question_id') \
+        .annotate(latest=Max('id'), total=Count('id')).filter(total__gt=1)
+    for row in duplicates:
+        stale = Vote.objects.filter(user_id=row['user_id'], question_id=row['question_id']) \
+            .exclude(id=row['latest'])
+        for vote in stale:
+            Choice.objects.filter(pk=vote.choice_id).update(votes=F('votes') - 1)
+        stale.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0005_choice_votes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.RunPython(fill_vote_question, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='vote',
+            name='question',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='polls.question'),
+        ),
+        migrations.AddConstraint(
+            model_name='vote',
+            constraint=models.UniqueConstraint(fields=('user', 'question'), name='unique_vote_per_user_question'),
+        ),
+    ]
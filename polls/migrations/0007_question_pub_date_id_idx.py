@@ -0,0 +1,17 @@
+# Generated by Django 4.2.4 on 2026-10-18 02:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0006_vote_question'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['-pub_date', 'id'], name='question_pub_date_id_idx'),
+        ),
+    ]
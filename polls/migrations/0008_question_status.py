@@ -0,0 +1,28 @@
+# Generated by Django 4.2.4 on 2026-10-18 02:31
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def set_initial_status(apps, schema_editor):
+    """Store the status implied by the dates of the existing questions."""
+    Question = apps.get_model('polls', 'Question')
+    now = timezone.now()
+    Question.objects.filter(pub_date__gt=now).update(status='scheduled')
+    Question.objects.filter(pub_date__lte=now, end_date__lt=now).update(status='closed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0007_question_pub_date_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='status',
+            field=models.CharField(choices=[('scheduled', 'Scheduled'), ('open', 'Open'), ('closed', 'Closed')], db_index=True, default='open', editable=False, max_length=9),
+        ),
+        migrations.RunPython(set_initial_status, migrations.RunPython.noop),
+    ]
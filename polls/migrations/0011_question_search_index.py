@@ -0,0 +1,85 @@
+# Generated by Django 4.2.4 on 2026-10-18 09:40
+
+from django.db import OperationalError, migrations
+
+# One row per question, with rowid = question id. choice_text holds all the
+# choices of the question. The triggers only fire on text changes, so vote
+# counter updates on polls_choice don't touch the index.
+CHOICES_OF = "(SELECT group_concat(choice_text, ' ') FROM polls_choice WHERE question_id = {})"
+
+CREATE_INDEX = [
+    """CREATE VIRTUAL TABLE polls_question_fts USING fts5(
+        question_text, choice_text, tokenize = 'unicode61 remove_diacritics 2')""",
+    """CREATE TRIGGER polls_question_fts_ai AFTER INSERT ON polls_question BEGIN
+        INSERT INTO polls_question_fts (rowid, question_text, choice_text)
+        VALUES (new.id, new.question_text, coalesce({}, ''));
+    END""".format(CHOICES_OF.format("new.id")),
+    """CREATE TRIGGER polls_question_fts_au AFTER UPDATE OF question_text ON polls_question BEGIN
+        UPDATE polls_question_fts SET question_text = new.question_text WHERE rowid = new.id;
+    END""",
+    """CREATE TRIGGER polls_question_fts_ad AFTER DELETE ON polls_question BEGIN
+        DELETE FROM polls_question_fts WHERE rowid = old.id;
+    END""",
+    """CREATE TRIGGER polls_choice_fts_ai AFTER INSERT ON polls_choice BEGIN
+        UPDATE polls_question_fts SET choice_text = {}
+        WHERE rowid = new.question_id;
+    END""".format(CHOICES_OF.format("new.question_id")),
+    """CREATE TRIGGER polls_choice_fts_au AFTER UPDATE OF choice_text, question_id
+    ON polls_choice BEGIN
+        UPDATE polls_question_fts SET choice_text = coalesce({}, '')
+        WHERE rowid = old.question_id;
+        UPDATE polls_question_fts SET choice_text = {}
+        WHERE rowid = new.question_id;
+    END""".format(CHOICES_OF.format("old.question_id"), CHOICES_OF.format("new.question_id")),
+    """CREATE TRIGGER polls_choice_fts_ad AFTER DELETE ON polls_choice BEGIN
+        UPDATE polls_question_fts SET choice_text = coalesce({}, '')
+        WHERE rowid = old.question_id;
+    END""".format(CHOICES_OF.format("old.question_id")),
+    # the same statement as the rebuild_search_index command
+    """INSERT INTO polls_question_fts (rowid, question_text, choice_text)
+    SELECT id, question_text, coalesce({}, '') FROM polls_question""".format(
+        CHOICES_OF.format("polls_question.id")),
+]
+
+DROP_INDEX = [
+    "DROP TRIGGER IF EXISTS polls_question_fts_ai",
+    "DROP TRIGGER IF EXISTS polls_question_fts_au",
+    "DROP TRIGGER IF EXISTS polls_question_fts_ad",
+    "DROP TRIGGER IF EXISTS polls_choice_fts_ai",
+    "DROP TRIGGER IF EXISTS polls_choice_fts_au",
+    "DROP TRIGGER IF EXISTS polls_choice_fts_ad",
+    "DROP TABLE IF EXISTS polls_question_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    """Create the FTS5 index, unless the database can't; search then uses LIKE."""
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(CREATE_INDEX[0])
+        except OperationalError:
+            # SQLite built without FTS5
+            return
+        for statement in CREATE_INDEX[1:]:
+            cursor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in DROP_INDEX:
+            cursor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0010_pollplacement_vote_user_no_constraint'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.4 on 2026-10-18 03:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('polls', '0011_question_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ResultsSnapshot',
+            fields=[
+                ('question', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='snapshot', serialize=False, to='polls.question')),
+                ('results', models.JSONField()),
+                ('total_votes', models.PositiveIntegerField()),
+                ('taken_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
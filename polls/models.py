@@ -1,10 +1,65 @@
 import datetime
-from django.db import models
+import random
+from collections import Counter, defaultdict
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, connections, models, transaction
+from django.db.models import Case, F, Max, Q, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 from django.contrib import admin
 from django.contrib.auth.models import User
 
 
+class QuestionQuerySet(models.QuerySet):
+    def published(self, now=None):
+        """
+        Return the questions whose pub_date has passed.
+
+        Open and closed polls are selected on the indexed status alone. The
+        stored status lags behind the dates until update_poll_status runs, so
+        a poll still marked scheduled is included once its pub_date has come.
+        """
+        now = now or timezone.now()
+        Status = self.model.Status
+        return self.filter(Q(status__in=[Status.OPEN, Status.CLOSED])
+                           | Q(status=Status.SCHEDULED, pub_date__lte=now))
+
+    def with_is_open(self, now=None):
+        """
+        Annotate is_open, whether the poll takes votes going by its end_date.
+
+        Meant for published questions. Unlike the stored status it doesn't
+        wait for update_poll_status.
+        """
+        now = now or timezone.now()
+        return self.annotate(is_open=Case(
+            When(Q(end_date__isnull=True) | Q(end_date__gte=now), then=Value(True)),
+            default=Value(False),
+            output_field=models.BooleanField(),
+        ))
+
+    def update_status(self, now=None):
+        """
+        Store the lifecycle status that the dates of these questions imply.
+
+        Runs one bulk UPDATE per status, touching only rows that change.
+
+        Returns:
+            int: The number of questions whose status changed.
+        """
+        now = now or timezone.now()
+        Status = self.model.Status
+        changed = self.filter(pub_date__gt=now).exclude(status=Status.SCHEDULED) \
+            .update(status=Status.SCHEDULED)
+        changed += self.filter(pub_date__lte=now, end_date__lt=now) \
+            .exclude(status=Status.CLOSED).update(status=Status.CLOSED)
+        changed += self.filter(Q(end_date__isnull=True) | Q(end_date__gte=now),
+                               pub_date__lte=now) \
+            .exclude(status=Status.OPEN).update(status=Status.OPEN)
+        return changed
+
+
 # Create your models here.
 class Question(models.Model):
     """
@@ -14,11 +69,36 @@ class Question(models.Model):
         question_text (str): The text of the question.
         pub_date (datetime): The publication date of the question.
         end_date (datetime): The ending date for voting on the question.
+        status (str): The stored lifecycle state (scheduled, open or closed).
+            It is set on save and moved along by the update_poll_status
+            command, so lists can filter on it in SQL. can_vote() and
+            is_published() still compute from the dates.
+        counter_shards (int): When above 0, votes on this question update one
+            of this many ChoiceVoteShard rows per choice instead of the
+            Choice.votes row itself, which spreads the writes of a hot poll.
     """
 
+    class Status(models.TextChoices):
+        SCHEDULED = "scheduled", "Scheduled"
+        OPEN = "open", "Open"
+        CLOSED = "closed", "Closed"
+
     question_text = models.CharField(max_length=200)
     pub_date = models.DateTimeField('data published', default=timezone.now)
     end_date = models.DateTimeField('data end', null=True)
+    status = models.CharField(max_length=9, choices=Status.choices, default=Status.OPEN,
+                              db_index=True, editable=False)
+    counter_shards = models.PositiveSmallIntegerField(
+        default=0, help_text="Spread the vote counters of a busy poll over this many rows "
+                             "(0 to count on the choice itself).")
+
+    objects = QuestionQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # keyset pagination order of the index page
+            models.Index(fields=["-pub_date", "id"], name="question_pub_date_id_idx"),
+        ]
 
     @admin.display(
         boolean=True,
@@ -51,10 +131,53 @@ class Question(models.Model):
         else:
             return self.pub_date <= now <= self.end_date
 
+    def compute_status(self, now=None):
+        """
+        Returns the lifecycle status implied by pub_date and end_date.
+        """
+        now = now or timezone.now()
+        if self.pub_date > now:
+            return self.Status.SCHEDULED
+        if self.end_date is not None and self.end_date < now:
+            return self.Status.CLOSED
+        return self.Status.OPEN
+
+    def save(self, *args, **kwargs):
+        if settings.POLL_DATABASES:
+            if self.pk is None:
+                # ids must be unique across all poll databases
+                self.pk = PollPlacement.objects.allocate()
+            kwargs["using"] = PollPlacement.objects.database_for(self.pk)
+        self.status = self.compute_status()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None:
+            kwargs["update_fields"] = {*update_fields, "status"}
+        adding = self._state.adding
+        super().save(*args, **kwargs)
+        if adding:
+            return
+        snapshots = ResultsSnapshot.objects.db_manager(self._state.db)
+        if self.status == self.Status.CLOSED:
+            snapshots.freeze([self.pk])
+        else:
+            # reopened, the snapshot is taken again when it closes
+            snapshots.filter(question=self).delete()
+            ArchivedVote.objects.db_manager(self._state.db).restore([self.pk])
+
     def __str__(self) -> str:
         return self.question_text
 
 
+class ChoiceQuerySet(models.QuerySet):
+    def with_total_votes(self):
+        """
+        Annotate total_votes, Choice.votes plus the choice's counter shards,
+        summed by the database in one grouped query.
+        """
+        return self.annotate(
+            total_votes=F("votes") + Coalesce(Sum("choicevoteshard__votes"), 0))
+
+
 class Choice(models.Model):
     """
     Represents a choice for a poll question.
@@ -62,22 +185,459 @@ class Choice(models.Model):
     Attributes:
         question (Question): The question to which this choice belongs.
         choice_text (str): The text of the choice.
-        votes (int): The number of votes received for this choice.
+        votes (int): The number of votes received for this choice. This is a
+            denormalized counter maintained by the vote view, use the
+            reconcile_vote_counts command to recompute it from Vote. On a
+            question with counter_shards the recent votes sit in
+            ChoiceVoteShard rows until compact_vote_shards folds them in, so
+            read the count with Choice.objects.with_total_votes().
     """
     question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice_text = models.CharField(max_length=200)
-    # votes = models.IntegerField(default=0)
+    votes = models.IntegerField(default=0)
 
-    @property
-    def votes(self):
-        # count the votes for this choice
-        return self.vote_set.count()
+    objects = ChoiceQuerySet.as_manager()
+
+    def save(self, *args, **kwargs):
+        if settings.POLL_DATABASES:
+            kwargs["using"] = PollPlacement.objects.database_for(self.question_id)
+        super().save(*args, **kwargs)
 
     def __str__(self) -> str:
         return self.choice_text
 
 
+class ChoiceVoteShardManager(models.Manager):
+    """Manager that adds to counter shards with upserts."""
+
+    def _upsert_sql(self):
+        qn = connections[self.db].ops.quote_name
+        table = qn(self.model._meta.db_table)
+        return (
+            f"INSERT INTO {table} ({qn('choice_id')}, {qn('shard')}, {qn('votes')}) ",
+            f" ON CONFLICT ({qn('choice_id')}, {qn('shard')}) "
+            f"DO UPDATE SET {qn('votes')} = {table}.{qn('votes')} + excluded.{qn('votes')}",
+        )
+
+    def add(self, choice_ids, delta, shard_count):
+        """
+        Add delta to a random shard of each choice selected by choice_ids.
+
+        Args:
+            choice_ids: QuerySet selecting a single column of choice ids.
+            delta (int): The number of votes to add, negative to take away.
+            shard_count (int): The number of shards of the question.
+        """
+        insert, conflict = self._upsert_sql()
+        sql, params = choice_ids.query.sql_with_params()
+        with connections[self.db].cursor() as cursor:
+            # the WHERE keeps SQLite from reading ON CONFLICT as a join constraint
+            cursor.execute(f"{insert} SELECT ids.*, %s, %s FROM ({sql}) ids WHERE true{conflict}",
+                           [random.randrange(shard_count), delta, *params])
+
+    def add_many(self, rows):
+        """
+        Add to many shards at once.
+
+        Args:
+            rows: Iterable of (choice_id, shard, delta) tuples.
+        """
+        rows = list(rows)
+        if not rows:
+            return
+        insert, conflict = self._upsert_sql()
+        with connections[self.db].cursor() as cursor:
+            cursor.executemany(f"{insert} VALUES (%s, %s, %s){conflict}", rows)
+
+    def compact(self, choice_ids):
+        """
+        Fold the shards of the given choices into Choice.votes.
+
+        The shard rows are locked first where the database supports it, so a
+        vote landing in between is neither lost nor counted twice.
+
+        Returns:
+            int: The number of shard rows folded in.
+        """
+        with transaction.atomic(using=self.db):
+            shards = list(self.select_for_update().filter(choice_id__in=choice_ids)
+                          .values_list("pk", "choice_id", "votes"))
+            totals = Counter()
+            for _, choice_id, votes in shards:
+                totals[choice_id] += votes
+            by_delta = defaultdict(list)
+            for choice_id, delta in totals.items():
+                if delta:
+                    by_delta[delta].append(choice_id)
+            for delta, ids in by_delta.items():
+                Choice.objects.using(self.db).filter(pk__in=ids).update(votes=F("votes") + delta)
+            self.filter(pk__in=[pk for pk, _, _ in shards]).delete()
+        return len(shards)
+
+
+class ChoiceVoteShard(models.Model):
+    """
+    One slice of the vote counter of a choice on a sharded question.
+
+    A choice's count is Choice.votes plus the votes of all its shards.
+    """
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    shard = models.PositiveSmallIntegerField()
+    votes = models.IntegerField(default=0)
+
+    objects = ChoiceVoteShardManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["choice", "shard"], name="unique_choice_vote_shard"),
+        ]
+
+
+class ResultsSnapshotManager(models.Manager):
+    """Manager that takes the snapshots of closed polls."""
+
+    def freeze(self, question_ids):
+        """
+        Take, or take again, the snapshots of questions from their counters.
+
+        Returns:
+            int: The number of snapshots written.
+        """
+        question_ids = list(question_ids)
+        if not question_ids:
+            return 0
+        rows = defaultdict(list)
+        for question_id, pk, text, votes in Choice.objects.using(self.db) \
+                .filter(question_id__in=question_ids).with_total_votes() \
+                .order_by("question_id", "id") \
+                .values_list("question_id", "id", "choice_text", "total_votes"):
+            rows[question_id].append([pk, text, votes])
+        snapshots = self.bulk_create(
+            [self.model(question_id=question_id, results=rows[question_id],
+                        total_votes=sum(votes for _, _, votes in rows[question_id]))
+             for question_id in question_ids],
+            update_conflicts=True, unique_fields=["question"],
+            update_fields=["results", "total_votes", "taken_at"],
+        )
+        return len(snapshots)
+
+    def refresh(self, question_ids):
+        """Take again the existing snapshots of questions, e.g. after a late ballot."""
+        return self.freeze(self.filter(question_id__in=question_ids)
+                           .values_list("question_id", flat=True))
+
+    def freeze_closed(self, batch_size=500):
+        """
+        Snapshot the closed polls that have no snapshot yet.
+
+        Each batch of polls is snapshotted in its own transaction.
+
+        Returns:
+            int: The number of snapshots taken.
+        """
+        missing = Question.objects.using(self.db) \
+            .filter(status=Question.Status.CLOSED, snapshot__isnull=True) \
+            .order_by("pk").values_list("pk", flat=True)
+        frozen = 0
+        while question_ids := list(missing[:batch_size]):
+            with transaction.atomic(using=self.db):
+                frozen += self.freeze(question_ids)
+        return frozen
+
+
+class ResultsSnapshot(models.Model):
+    """
+    The final vote counts of a closed poll.
+
+    A closed poll takes no more votes, so its results page and the index read
+    this one row instead of its choices and counters. results holds one
+    [choice id, choice text, votes] list per choice, in choice id order.
+    """
+    question = models.OneToOneField(Question, on_delete=models.CASCADE, primary_key=True,
+                                    related_name="snapshot")
+    results = models.JSONField()
+    total_votes = models.PositiveIntegerField()
+    taken_at = models.DateTimeField(auto_now=True)
+
+    objects = ResultsSnapshotManager()
+
+    def __str__(self) -> str:
+        return f"Results of {self.question_id}"
+
+
+class VoteManager(models.Manager):
+    """Manager that records votes with a single upsert per ballot."""
+
+    def record(self, user, choice):
+        """
+        Record that user votes for choice, replacing any earlier vote of the
+        user on the same question, and keep the vote counters in step.
+
+        The ballot itself is written by one INSERT ... ON CONFLICT DO UPDATE
+        statement on the (user, question) unique constraint, so concurrent
+        double submits can never leave two votes behind. On a question with
+        counter_shards the counters are adjusted in a random shard.
+
+        Returns:
+            bool: True if a vote was created or moved, False if the user had
+            already voted for this choice.
+        """
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        shard_count = choice.question.counter_shards
+        with transaction.atomic(using=self.db):
+            # Take the previous choice down first. This is the first write of
+            # the transaction, so on SQLite it also takes the write lock.
+            previous = self.filter(user=user, question_id=choice.question_id) \
+                .exclude(choice=choice).values("choice_id")
+            choices = Choice.objects.using(self.db)
+            counter_shards = ChoiceVoteShard.objects.db_manager(self.db)
+            if shard_count:
+                counter_shards.add(previous, -1, shard_count)
+            else:
+                choices.filter(pk__in=previous).update(votes=F("votes") - 1)
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"INSERT INTO {table} ({qn('user_id')}, {qn('question_id')}, "
+                    f"{qn('choice_id')}) VALUES (%s, %s, %s) "
+                    f"ON CONFLICT ({qn('user_id')}, {qn('question_id')}) "
+                    f"DO UPDATE SET {qn('choice_id')} = excluded.{qn('choice_id')} "
+                    f"WHERE {table}.{qn('choice_id')} <> excluded.{qn('choice_id')}",
+                    [user.pk, choice.question_id, choice.pk],
+                )
+                changed = cursor.rowcount > 0
+            if changed and shard_count:
+                counter_shards.add(choices.filter(pk=choice.pk).values("pk"), 1, shard_count)
+            elif changed:
+                choices.filter(pk=choice.pk).update(votes=F("votes") + 1)
+        return changed
+
+    def record_many(self, ballots, batch_size=500):
+        """
+        Record many ballots in one transaction.
+
+        When the same user votes more than once on a question the last ballot
+        wins. Votes are written with bulk upserts on the (user, question)
+        constraint and each touched counter, or one random shard of it on a
+        question with counter_shards, is adjusted once.
+
+        Args:
+            ballots: Iterable of (user_id, question_id, choice_id) tuples, in
+                the order they were cast.
+            batch_size (int): Maximum number of rows per INSERT statement.
+
+        Returns:
+            set: The ids of the questions whose votes changed.
+        """
+        latest = {}
+        for user_id, question_id, choice_id in ballots:
+            latest[user_id, question_id] = choice_id
+        if not latest:
+            return set()
+        user_ids = {user_id for user_id, _ in latest}
+        question_ids = {question_id for _, question_id in latest}
+
+        with transaction.atomic(using=self.db):
+            # a kiosk may upload ballots for a poll archived since it closed
+            ArchivedVote.objects.db_manager(self.db).restore(question_ids)
+            existing = {
+                (user_id, question_id): choice_id
+                for user_id, question_id, choice_id in self.filter(
+                    user_id__in=user_ids, question_id__in=question_ids,
+                ).values_list("user_id", "question_id", "choice_id")
+            }
+            deltas = Counter()
+            changed = []
+            for (user_id, question_id), choice_id in latest.items():
+                previous = existing.get((user_id, question_id))
+                if previous == choice_id:
+                    continue
+                if previous is not None:
+                    deltas[previous] -= 1
+                deltas[choice_id] += 1
+                changed.append(self.model(user_id=user_id, question_id=question_id,
+                                          choice_id=choice_id))
+            self.bulk_create(changed, batch_size=batch_size, update_conflicts=True,
+                             unique_fields=["user", "question"], update_fields=["choice"])
+            shard_counts = dict(
+                Choice.objects.using(self.db).filter(pk__in=deltas, question__counter_shards__gt=0)
+                .values_list("pk", "question__counter_shards")
+            ) if deltas else {}
+            ChoiceVoteShard.objects.db_manager(self.db).add_many(
+                (choice_id, random.randrange(shard_counts[choice_id]), delta)
+                for choice_id, delta in deltas.items() if delta and choice_id in shard_counts
+            )
+            # one UPDATE per distinct delta rather than one per choice
+            by_delta = defaultdict(list)
+            for choice_id, delta in deltas.items():
+                if delta and choice_id not in shard_counts:
+                    by_delta[delta].append(choice_id)
+            for delta, choice_ids in by_delta.items():
+                Choice.objects.using(self.db).filter(pk__in=choice_ids) \
+                    .update(votes=F("votes") + delta)
+            changed = {vote.question_id for vote in changed}
+            # kiosk ballots cast before a poll closed can arrive after it
+            ResultsSnapshot.objects.db_manager(self.db).refresh(changed)
+        return changed
+
+
 class Vote(models.Model):
     """Records a Vote of a Choice by a User."""
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
+    choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
+    # users stay in the default database when polls are partitioned
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+
+    objects = VoteManager()
+
+    class Meta:
+        constraints = [
+            # also serves as the (user, question) lookup index
+            models.UniqueConstraint(fields=["user", "question"],
+                                    name="unique_vote_per_user_question"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if self.question_id is None:
+            self.question_id = self.choice.question_id
+        if settings.POLL_DATABASES:
+            kwargs["using"] = PollPlacement.objects.database_for(self.question_id)
+        super().save(*args, **kwargs)
+
+
+class ArchivedVoteManager(models.Manager):
+    """Manager that brings archived votes back when their poll takes votes again."""
+
+    def restore(self, question_ids, batch_size=2000):
+        """
+        Move the archived votes of questions back to the Vote table.
+
+        Votes are looked up in Vote only, so this must run before a reopened
+        poll, or a late ballot on an archived poll, is voted on; otherwise an
+        earlier vote of the same user would not be replaced.
+
+        Returns:
+            int: The number of votes restored.
+        """
+        with transaction.atomic(using=self.db):
+            archived = self.filter(question_id__in=question_ids)
+            rows = list(archived.values_list("user_id", "question_id", "choice_id"))
+            if not rows:
+                return 0
+            Vote.objects.using(self.db).bulk_create(
+                [Vote(user_id=user_id, question_id=question_id, choice_id=choice_id)
+                 for user_id, question_id, choice_id in rows],
+                batch_size=batch_size,
+            )
+            archived.delete()
+        return len(rows)
+
+
+class ArchivedVote(models.Model):
+    """
+    A vote on a long closed poll, moved out of the Vote table by the
+    archive_votes command.
+
+    Archived votes still count in audits and reconcile_vote_counts, but the
+    vote pages only ever look at Vote, which keeps that table and its
+    indexes the size of the polls people still vote on.
+    """
+    question = models.ForeignKey(Question, on_delete=models.CASCADE)
     choice = models.ForeignKey(Choice, on_delete=models.CASCADE)
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_constraint=False)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    objects = ArchivedVoteManager()
+
+
+class PollPlacementManager(models.Manager):
+    """
+    Manager of the poll directory. It always works on the default database
+    and caches placements for POLLS_PLACEMENT_CACHE_TIMEOUT seconds. They only
+    change through rebalance_polls, and a poll missing from its cached
+    database is looked up again with refresh.
+    """
+
+    def get_queryset(self):
+        return super().get_queryset().using(DEFAULT_DB_ALIAS)
+
+    @staticmethod
+    def _key(question_id):
+        return f"polls:placement:{question_id}"
+
+    def _fallback(self, question_id):
+        # not placed yet, e.g. a question from before partitioning
+        return settings.POLL_DATABASES[question_id % len(settings.POLL_DATABASES)]
+
+    def database_for(self, question_id, refresh=False):
+        """
+        Return the alias of the poll database holding a question.
+
+        With refresh the cached placement is ignored and read again from the
+        directory, e.g. after the poll was not found where the cache said.
+        """
+        database = None if refresh else cache.get(self._key(question_id))
+        if database is None:
+            database = self.filter(pk=question_id).values_list("database", flat=True).first()
+            if database is None:
+                return self._fallback(question_id)
+            cache.set(self._key(question_id), database, settings.POLLS_PLACEMENT_CACHE_TIMEOUT)
+        return database
+
+    async def adatabase_for(self, question_id, refresh=False):
+        """Async version of database_for()."""
+        database = None if refresh else await cache.aget(self._key(question_id))
+        if database is None:
+            database = await self.filter(pk=question_id) \
+                .values_list("database", flat=True).afirst()
+            if database is None:
+                return self._fallback(question_id)
+            await cache.aset(self._key(question_id), database,
+                             settings.POLLS_PLACEMENT_CACHE_TIMEOUT)
+        return database
+
+    def place(self, question_id, database):
+        """Record that a question now lives in database."""
+        self.update_or_create(pk=question_id, defaults={"database": database})
+        # other processes keep their cached placement until it expires
+        cache.set(self._key(question_id), database, settings.POLLS_PLACEMENT_CACHE_TIMEOUT)
+
+    def allocate(self):
+        """
+        Reserve a new question id and place it on a poll database.
+
+        Ids are handed out above every question still in the default
+        database, so polls from before partitioning keep their ids until
+        rebalance_polls --unplaced moves them.
+
+        Returns:
+            int: The id the new question must be saved with.
+        """
+        with transaction.atomic(using=DEFAULT_DB_ALIAS):
+            placement = self.create(database="")
+            legacy = Question.objects.using(DEFAULT_DB_ALIAS).aggregate(last=Max("pk"))["last"]
+            if legacy is not None and placement.pk <= legacy:
+                # only the first time, the id sequence continues from here
+                placement.delete()
+                last = self.aggregate(last=Max("pk"))["last"] or 0
+                placement = self.create(pk=max(legacy, last) + 1, database="")
+            databases = settings.POLL_DATABASES
+            placement.database = databases[placement.pk % len(databases)]
+            placement.save(update_fields=["database"])
+        cache.set(self._key(placement.pk), placement.database,
+                  settings.POLLS_PLACEMENT_CACHE_TIMEOUT)
+        return placement.pk
+
+
+class PollPlacement(models.Model):
+    """
+    Directory of the database each question lives in, kept in the default
+    database when polls are partitioned (see polls.partitions).
+
+    The id of a placement is the id of its question, so the directory also
+    hands out question ids that are unique across all poll databases.
+    """
+    database = models.CharField(max_length=100)
+
+    objects = PollPlacementManager()
@@ -0,0 +1,179 @@
+"""
+Horizontal partitioning of polls over several databases.
+
+When POLL_DATABASES lists database aliases, every question lives there,
+together with its choices, votes and counter shards, in the database its
+PollPlacement names. Users, sessions and the placement directory itself stay
+in the default database. With POLL_DATABASES empty nothing here changes how
+queries are routed.
+
+A poll looked up by id is read with get_poll_or_404() or
+Question.objects.using(poll_db(pk));
+objects reached from it (question.choice_set, choice.question, ...) follow it
+through PartitionRouter. Lists of polls run on every poll database and are
+merged with fan_out().
+"""
+import heapq
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from django.http import Http404
+
+from .models import ArchivedVote, Choice, PollPlacement, Question, Vote
+
+# models kept in the database of their poll
+POLL_MODELS = {"question", "choice", "vote", "archivedvote", "choicevoteshard",
+               "resultssnapshot"}
+
+
+def poll_db(question_id, refresh=False):
+    """
+    Return the alias of the database holding a question.
+
+    Placements are cached, so this costs a cache lookup per request. Returns
+    None when polls are not partitioned, which leaves the choice to the
+    routers (e.g. the read replicas). With refresh the placement is read
+    from the directory.
+    """
+    if not settings.POLL_DATABASES:
+        return None
+    return PollPlacement.objects.database_for(question_id, refresh=refresh)
+
+
+async def apoll_db(question_id, refresh=False):
+    """Async version of poll_db()."""
+    if not settings.POLL_DATABASES:
+        return None
+    return await PollPlacement.objects.adatabase_for(question_id, refresh=refresh)
+
+
+def get_poll_or_404(queryset, pk):
+    """
+    Return the question pk of queryset, read from the database of the poll.
+
+    A cached placement goes stale when rebalance_polls moves the poll from
+    another process, so a miss is tried once more on the placement read
+    from the directory.
+
+    Raises:
+        Http404: If the question is in neither database.
+    """
+    database = poll_db(pk)
+    try:
+        return queryset.using(database).get(pk=pk)
+    except queryset.model.DoesNotExist:
+        if database is not None and (fresh := poll_db(pk, refresh=True)) != database:
+            try:
+                return queryset.using(fresh).get(pk=pk)
+            except queryset.model.DoesNotExist:
+                pass
+    raise Http404("No question found matching the query")
+
+
+async def aget_poll_or_404(queryset, pk):
+    """Async version of get_poll_or_404()."""
+    database = await apoll_db(pk)
+    try:
+        return await queryset.using(database).aget(pk=pk)
+    except queryset.model.DoesNotExist:
+        if database is not None and (fresh := await apoll_db(pk, refresh=True)) != database:
+            try:
+                return await queryset.using(fresh).aget(pk=pk)
+            except queryset.model.DoesNotExist:
+                pass
+    raise Http404("No question found matching the query")
+
+
+def poll_databases():
+    """
+    Return the databases to run a query over all polls on.
+
+    That is POLL_DATABASES, or [None] (let the routers decide) when polls
+    are not partitioned.
+    """
+    return settings.POLL_DATABASES or [None]
+
+
+def fan_out(queryset, limit, key):
+    """
+    Return the first limit rows of queryset across all poll databases.
+
+    The queryset must be ordered consistently with key. Each database returns
+    at most limit rows and the partial results are merged, lazily, so nothing
+    is queried before the result is iterated.
+    """
+    if not settings.POLL_DATABASES:
+        return queryset[:limit]
+    parts = [queryset.using(database)[:limit] for database in settings.POLL_DATABASES]
+    return islice(heapq.merge(*parts, key=key), limit)
+
+
+def record_ballots(ballots, batch_size=500):
+    """
+    Vote.objects.record_many() for ballots that may span poll databases.
+
+    The ballots of each database are recorded in their own transaction.
+
+    Returns:
+        set: The ids of the questions whose votes changed.
+    """
+    by_database = defaultdict(list)
+    for ballot in ballots:
+        by_database[poll_db(ballot[1])].append(ballot)
+    changed = set()
+    for database, group in by_database.items():
+        changed |= Vote.objects.db_manager(database).record_many(group, batch_size=batch_size)
+    return changed
+
+
+class PartitionRouter:
+    """
+    Keep the objects of a poll in the database of their question.
+
+    Only queries with an instance hint (saves, related managers) can be
+    routed by poll, the others fall through to the next router.
+    """
+
+    def _db_for_instance(self, instance):
+        if instance._state.db:
+            return instance._state.db
+        if isinstance(instance, Question):
+            question_id = instance.pk
+        elif isinstance(instance, (Choice, Vote, ArchivedVote)):
+            question_id = instance.question_id
+        else:
+            question_id = None
+        return poll_db(question_id) if question_id is not None else None
+
+    def _route(self, model, **hints):
+        if not settings.POLL_DATABASES or model._meta.app_label != "polls":
+            return None
+        if model._meta.model_name not in POLL_MODELS:
+            return DEFAULT_DB_ALIAS
+        instance = hints.get("instance")
+        if instance is not None and instance._meta.model_name in POLL_MODELS:
+            return self._db_for_instance(instance)
+        return None
+
+    db_for_read = _route
+    db_for_write = _route
+
+    def allow_relation(self, obj1, obj2, **hints):
+        if not settings.POLL_DATABASES:
+            return None
+        in_poll = [obj._meta.model_name in POLL_MODELS for obj in (obj1, obj2)]
+        if all(in_poll):
+            # a new question, choice or vote is saved to its poll's database
+            # by save(), whatever database it was created for
+            if obj1._state.adding or obj2._state.adding:
+                return True
+            return obj1._state.db == obj2._state.db
+        # votes point at users in the default database
+        return any(in_poll) or None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if settings.POLL_DATABASES and model_name == "pollplacement":
+            return db == DEFAULT_DB_ALIAS
+        return None
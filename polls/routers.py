@@ -0,0 +1,112 @@
+"""
+Read-replica routing.
+
+Views wrapped in read_from_replica() send their reads to one of the
+DATABASE_REPLICAS aliases, everything else (every write, and the reads of
+all other views) goes to the primary. After a user writes, e.g. votes, the
+response sets a short-lived cookie that keeps their reads on the primary
+until the replicas have caught up, so they always see their own vote.
+Responses that go into a shared cache are rendered inside use_primary(), so
+a lagging replica is never cached for everyone.
+"""
+import asyncio
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+PRIMARY_COOKIE = "polls_primary"
+
+_replica_reads = ContextVar("polls_replica_reads", default=False)
+_primary_only = ContextVar("polls_primary_only", default=False)
+
+
+@contextmanager
+def use_replica(request=None):
+    """
+    Send the reads made inside the block to a replica.
+
+    Reads stay on the primary if request carries the cookie set by
+    stick_to_primary().
+    """
+    sticky = request is not None and PRIMARY_COOKIE in request.COOKIES
+    token = _replica_reads.set(not sticky and not _primary_only.get())
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+@contextmanager
+def use_primary():
+    """Keep the reads made inside the block on the primary, even inside use_replica()."""
+    primary_token = _primary_only.set(True)
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+        _primary_only.reset(primary_token)
+
+
+def read_from_replica(view_func):
+    """
+    Run a sync or async view with its reads sent to a replica.
+
+    Template responses are rendered inside the block, so lazy querysets in
+    the context are read from the replica too.
+    """
+    if asyncio.iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def async_wrapper(request, *args, **kwargs):
+            with use_replica(request):
+                return await view_func(request, *args, **kwargs)
+        return async_wrapper
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        with use_replica(request):
+            response = view_func(request, *args, **kwargs)
+            if hasattr(response, "render") and callable(response.render):
+                response.render()
+        return response
+    return wrapper
+
+
+def stick_to_primary(response):
+    """Keep the next reads of this client on the primary for a short while."""
+    if settings.DATABASE_REPLICAS:
+        response.set_cookie(PRIMARY_COOKIE, "1", max_age=settings.POLLS_REPLICA_STICKY_SECONDS,
+                            httponly=True, samesite="Lax")
+    return response
+
+
+class ReplicaRouter:
+    """Route reads inside use_replica() to a random replica, everything else to the primary."""
+
+    def db_for_read(self, model, **hints):
+        # the database cache holds the version keys, which must be current
+        if model._meta.app_label == "django_cache":
+            return DEFAULT_DB_ALIAS
+        if settings.DATABASE_REPLICAS and _replica_reads.get():
+            return random.choice(settings.DATABASE_REPLICAS)
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # also for objects that were read from a replica
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas are copies of the primary, never migrated themselves
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
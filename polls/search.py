@@ -0,0 +1,124 @@
+"""
+Full-text search over poll questions and their choices.
+
+On SQLite the search runs on the polls_question_fts FTS5 index, which
+migration 0011 creates and its triggers keep in step with polls_question and
+polls_choice. Results are ranked by bm25, with matches in the question
+counting more than matches in its choices. Where the index doesn't exist
+(another database, or an SQLite built without FTS5) the search falls back to
+LIKE matching, newest first.
+"""
+import heapq
+import re
+
+from django.db import connections, router, transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .models import Choice, Question
+from .partitions import poll_databases
+
+FTS_TABLE = "polls_question_fts"
+
+REBUILD_SQL = [
+    f"DELETE FROM {FTS_TABLE}",
+    f"""INSERT INTO {FTS_TABLE} (rowid, question_text, choice_text)
+    SELECT id, question_text, coalesce((SELECT group_concat(choice_text, ' ') FROM polls_choice
+                                        WHERE question_id = polls_question.id), '')
+    FROM polls_question""",
+    # merge the index b-trees, which the triggers leave fragmented
+    f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')",
+]
+
+# aliases that have the index, looked up once per process
+_has_index = {}
+
+
+def has_search_index(using):
+    """Return whether the database using has the FTS5 index."""
+    if using not in _has_index:
+        connection = connections[using]
+        _has_index[using] = (connection.vendor == "sqlite"
+                             and FTS_TABLE in connection.introspection.table_names())
+    return _has_index[using]
+
+
+def search_terms(query):
+    """Split a search box query into words, dropping punctuation and FTS5 syntax."""
+    return re.findall(r"\w+", query)
+
+
+def _fts_search(using, terms, limit, now):
+    """Return [(rank, id, question), ...] of the best limit matches in one database."""
+    connection = connections[using]
+    # every word must match, as a prefix so that "pizz" finds "pizza"
+    match = " ".join(f'"{term}"*' for term in terms)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""SELECT bm25({FTS_TABLE}, 10.0, 1.0) AS rank, q.id
+            FROM {FTS_TABLE} JOIN polls_question q ON q.id = {FTS_TABLE}.rowid
+            WHERE {FTS_TABLE} MATCH %s
+            AND (q.status IN (%s, %s) OR (q.status = %s AND q.pub_date <= %s))
+            ORDER BY rank, q.id LIMIT %s""",
+            # like Question.objects.published(): the stored status can lag,
+            # so a scheduled poll goes once its pub_date has passed
+            [match, Question.Status.OPEN, Question.Status.CLOSED, Question.Status.SCHEDULED,
+             connection.ops.adapt_datetimefield_value(now), limit],
+        )
+        rows = cursor.fetchall()
+    questions = Question.objects.using(using).with_is_open(now).in_bulk([pk for _, pk in rows])
+    return [(rank, pk, questions[pk]) for rank, pk in rows if pk in questions]
+
+
+def _like_search(using, terms, limit, now):
+    """Return [(sort key, id, question), ...] of the newest limit LIKE matches."""
+    queryset = Question.objects.using(using).published(now).with_is_open(now)
+    for term in terms:
+        in_choices = Choice.objects.filter(question=OuterRef("pk"), choice_text__icontains=term)
+        queryset = queryset.filter(Q(question_text__icontains=term) | Exists(in_choices))
+    return [(-question.pub_date.timestamp(), question.pk, question)
+            for question in queryset.order_by("-pub_date", "id")[:limit]]
+
+
+def search_questions(query, offset=0, limit=20):
+    """
+    Search the published polls for query.
+
+    Every word of the query must appear in the question or in one of its
+    choices. With partitioned polls every poll database is searched and the
+    results merged.
+
+    Args:
+        query (str): The text typed in the search box.
+        offset (int): The number of results to skip.
+        limit (int): The maximum number of results to return.
+
+    Returns:
+        list: The matching questions, best first, annotated with is_open.
+    """
+    terms = search_terms(query)
+    if not terms or limit <= 0:
+        return []
+    now = timezone.now()
+    parts = []
+    for database in poll_databases():
+        using = database or router.db_for_read(Question)
+        search = _fts_search if has_search_index(using) else _like_search
+        parts.append(search(using, terms, offset + limit, now))
+    merged = heapq.merge(*parts, key=lambda row: row[:2])
+    return [question for _, _, question in merged][offset:offset + limit]
+
+
+def rebuild_search_index(using):
+    """
+    Refill the index of one database from its questions and choices.
+
+    Returns:
+        bool: False if the database has no index to rebuild.
+    """
+    if not has_search_index(using):
+        return False
+    with transaction.atomic(using=using), connections[using].cursor() as cursor:
+        for statement in REBUILD_SQL:
+            cursor.execute(statement)
+    return True
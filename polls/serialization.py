@@ -0,0 +1,224 @@
+"""
+Streaming reader and writer for poll fixtures.
+
+Both the Django fixture format (one JSON array of {"model", "pk", "fields"}
+objects, as in data/polls.json) and NDJSON (one such object per line) are
+supported. Records are parsed and written one at a time, so memory use does
+not grow with the size of the file.
+
+The same module streams the audit exports of a single poll (its raw votes and
+per-choice totals) as CSV or NDJSON.
+"""
+import csv
+import json
+import sys
+from itertools import chain, islice
+
+from django.contrib.auth.models import User
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import ArchivedVote, Choice, Vote
+from .partitions import poll_db
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FORMATS = ["json", "ndjson"]
+
+EXPORT_FORMATS = ["csv", "ndjson"]
+EXPORT_CONTENT_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+VOTE_COLUMNS = ["vote_id", "user_id", "username", "choice_id", "choice_text", "archived"]
+TOTAL_COLUMNS = ["choice_id", "choice_text", "votes", "counted"]
+
+
+def guess_format(path):
+    """Return the fixture format implied by a file name."""
+    return "ndjson" if str(path).endswith((".ndjson", ".jsonl")) else "json"
+
+
+def iter_json_array(fp, chunk_size=1 << 16):
+    """
+    Yield the elements of a top-level JSON array read incrementally from fp.
+
+    Only one element and one read chunk are held in memory at a time.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    started = False
+    eof = False
+
+    while True:
+        # skip whitespace and the separators between elements
+        while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+            pos += 1
+        if not started and pos < len(buffer):
+            if buffer[pos] != "[":
+                raise ValueError("Fixture must be a JSON array.")
+            started = True
+            pos += 1
+            continue
+        if started and pos < len(buffer) and buffer[pos] == "]":
+            return
+        if pos < len(buffer):
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                # a number at the end of the buffer may continue in the next chunk
+                if end < len(buffer) or eof:
+                    yield element
+                    pos = end
+                    continue
+        if eof:
+            if started:
+                raise ValueError("Unexpected end of fixture, missing ']'.")
+            return
+        chunk = fp.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+
+def iter_ndjson(fp):
+    """Yield one record per non-blank line of fp."""
+    for line in fp:
+        if line.strip():
+            yield json.loads(line)
+
+
+def iter_records(fp, fmt):
+    """Yield fixture records from fp in the given format."""
+    if fmt == "ndjson":
+        return iter_ndjson(fp)
+    return iter_json_array(fp)
+
+
+def write_records(fp, records, fmt):
+    """
+    Write fixture records to fp in the given format.
+
+    Returns:
+        int: The number of records written.
+    """
+    count = 0
+    if fmt == "ndjson":
+        for record in records:
+            fp.write(json.dumps(record, cls=DjangoJSONEncoder))
+            fp.write("\n")
+            count += 1
+        return count
+    fp.write("[")
+    for record in records:
+        fp.write(",\n" if count else "\n")
+        fp.write(json.dumps(record, cls=DjangoJSONEncoder))
+        count += 1
+    fp.write("\n]\n")
+    return count
+
+
+def _vote_rows(votes, archived, chunk_size):
+    rows = votes.order_by("pk") \
+        .values_list("pk", "user_id", "choice_id", "choice__choice_text") \
+        .iterator(chunk_size=chunk_size)
+    while chunk := list(islice(rows, chunk_size)):
+        # users stay in the default database when polls are partitioned
+        usernames = dict(User.objects.filter(pk__in={row[1] for row in chunk})
+                         .values_list("pk", "username"))
+        for pk, user_id, choice_id, choice_text in chunk:
+            yield pk, user_id, usernames.get(user_id, ""), choice_id, choice_text, archived
+
+
+def iter_vote_rows(question_id, chunk_size=2000):
+    """
+    Yield the votes of a question as tuples in VOTE_COLUMNS order.
+
+    Votes moved out by archive_votes come first, then the votes in the Vote
+    table; vote_id is the id in the table named by the archived column.
+    Only those columns are selected, and rows are fetched chunk_size at a time
+    with QuerySet.iterator(), so memory stays flat however many votes there are.
+    """
+    database = poll_db(question_id)
+    return chain(
+        _vote_rows(ArchivedVote.objects.using(database).filter(question_id=question_id),
+                   True, chunk_size),
+        _vote_rows(Vote.objects.using(database).filter(question_id=question_id),
+                   False, chunk_size),
+    )
+
+
+def iter_total_rows(question_id):
+    """
+    Yield the choices of a question as tuples in TOTAL_COLUMNS order.
+
+    "votes" is the stored counter (with its shards) and "counted" the number
+    of Vote and ArchivedVote rows, so auditors can see any drift the
+    reconcile_vote_counts command would fix.
+    """
+    counted = [
+        Coalesce(Subquery(model.objects.filter(choice=OuterRef("pk")).order_by()
+                          .values("choice").annotate(n=Count("pk")).values("n")), 0)
+        for model in (Vote, ArchivedVote)
+    ]
+    return (
+        Choice.objects.using(poll_db(question_id)).filter(question_id=question_id)
+        .order_by("pk")
+        .with_total_votes()
+        .annotate(counted=counted[0] + counted[1])
+        .values_list("pk", "choice_text", "total_votes", "counted")
+        .iterator()
+    )
+
+
+class _Echo:
+    """File-like object whose write() hands back what it was given."""
+
+    def write(self, value):
+        return value
+
+
+# a spreadsheet runs a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def _csv_cell(value):
+    """Return value with a ' in front if a spreadsheet would read it as a formula."""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def iter_export_lines(columns, rows, fmt, lines_per_chunk=500):
+    """
+    Turn rows into CSV (with a header line) or NDJSON text.
+
+    Lines are joined lines_per_chunk at a time, which keeps the number of
+    writes to a response or file low without holding the whole export.
+    CSV text cells that a spreadsheet would run as a formula, e.g. a choice
+    named "=HYPERLINK(...)", are prefixed with '.
+    """
+    if fmt == "csv":
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns)
+        lines = (writer.writerow([_csv_cell(value) for value in row]) for row in rows)
+    else:
+        lines = (json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + "\n"
+                 for row in rows)
+    while chunk := "".join(islice(lines, lines_per_chunk)):
+        yield chunk
+
+
+def peak_memory_mb():
+    """Return the peak resident memory of this process in MB, or None if unknown."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import bump_index_version, bump_results_version
+from .models import Choice, Question
+
+
+@receiver([post_save, post_delete], sender=Choice)
+def invalidate_choice_results(sender, instance, **kwargs):
+    """Drop cached results when a choice is added, renamed or removed."""
+    bump_results_version(instance.question_id)
+    bump_index_version()
+
+
+@receiver([post_save, post_delete], sender=Question)
+def invalidate_index(sender, instance, **kwargs):
+    """Drop the cached index page when a question is added, edited or removed."""
+    bump_index_version()
+
+
+@receiver(post_save, sender=Question)
+def invalidate_question_results(sender, instance, created, **kwargs):
+    """Change the results ETag when the question itself is edited."""
+    if not created:
+        bump_results_version(instance.id)
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Run the configured SQLITE_PRAGMAS on each new SQLite connection."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
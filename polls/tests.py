@@ -1,10 +1,43 @@
+import asyncio
+import csv
 import datetime
+import json
+import os
+import random
+import runpy
+import tempfile
+from contextlib import contextmanager
+from io import StringIO
+from types import ModuleType
+from unittest import mock
 
-from django.test import TestCase
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.cache.backends.db import DatabaseCache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, connections
+from django.db.models import F
+from django.conf import settings
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
-from django.urls import reverse
-from django.contrib.auth.models import User
-from .models import Question, Choice
+from django.urls import include, path, reverse
+from django.contrib.auth.models import Permission, User
+from .async_views import stream_results
+from .bench import percentile, scratch_database, seed_polls
+from .buffer import VoteBuffer
+from .cache import bump_results_version, get_results, results_cache_stats, results_version
+from .events import broker
+from .serialization import iter_json_array, iter_vote_rows
+from .middleware import get_summary
+from .models import (ArchivedVote, Question, Choice, ChoiceVoteShard, PollPlacement,
+                     ResultsSnapshot, Vote)
+from .partitions import record_ballots
+from .routers import PRIMARY_COOKIE, ReplicaRouter, use_replica
+from .signals import apply_sqlite_pragmas
+from .urls import build_urlpatterns
+from .views import IndexView, SearchView
 
 
 class QuestionModelTests(TestCase):
@@ -108,6 +141,10 @@ def create_question(question_text, days):
 
 
 class QuestionIndexViewTests(TestCase):
+    def setUp(self):
+        # the index page is cached, don't serve one from an earlier test
+        cache.clear()
+
     def test_no_questions(self):
         """
         If no questions exist, an appropriate message is displayed.
@@ -165,6 +202,55 @@ class QuestionIndexViewTests(TestCase):
         )
 
 
+class QuestionIndexPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        # three questions share a pub_date so the id tie-break is exercised
+        self.questions = [
+            Question.objects.create(question_text=f"Question {i}.",
+                                    pub_date=now - datetime.timedelta(days=i // 3 + 1))
+            for i in range(7)
+        ]
+
+    def walk(self, page_size):
+        seen = []
+        url = reverse("polls:index")
+        with mock.patch.object(IndexView, "page_size", page_size):
+            while url:
+                response = self.client.get(url)
+                seen.extend(response.context["latest_question_list"])
+                cursor = response.context["latest_question_list"].next_cursor
+                url = f"{reverse('polls:index')}?after={cursor}" if cursor else None
+        return seen
+
+    def test_pages_cover_every_question_once(self):
+        """Following ?after= visits each published question exactly once, newest first."""
+        seen = self.walk(page_size=2)
+        expected = sorted(self.questions, key=lambda q: (-q.pub_date.timestamp(), q.id))
+        self.assertEqual(seen, expected)
+
+    def test_last_page_has_no_cursor(self):
+        """A page that reaches the end of the list offers no next cursor."""
+        response = self.client.get(reverse("polls:index"))
+        self.assertEqual(len(response.context["latest_question_list"]), 7)
+        self.assertIsNone(response.context["latest_question_list"].next_cursor)
+
+    def test_invalid_cursor(self):
+        """A malformed ?after= token returns 404."""
+        response = self.client.get(reverse("polls:index"), {"after": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_status_is_annotated(self):
+        """The open/closed status comes from the database annotation."""
+        Question.objects.filter(pk=self.questions[0].pk).update(
+            end_date=timezone.now() - datetime.timedelta(hours=1))
+        response = self.client.get(reverse("polls:index"))
+        status = {q.pk: q.is_open for q in response.context["latest_question_list"]}
+        self.assertFalse(status[self.questions[0].pk])
+        self.assertTrue(status[self.questions[1].pk])
+
+
 class QuestionDetailViewTests(TestCase):
     def test_future_question(self):
         """
@@ -187,6 +273,38 @@ class QuestionDetailViewTests(TestCase):
         self.assertContains(response, past_question.question_text)
 
 
+class QuestionDetailQueryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='detail', password='testpassword')
+        self.question = create_question(question_text="Query question.", days=-1)
+
+    def add_choices(self, count):
+        return [Choice.objects.create(question=self.question, choice_text=f'Choice {i}')
+                for i in range(count)]
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_query_count_does_not_grow_with_choices(self):
+        """A logged-in detail page costs the same queries for 2 or 10 choices."""
+        self.client.force_login(self.user)
+        url = reverse('polls:detail', args=(self.question.id,))
+        choices = self.add_choices(2)
+        Vote.objects.record(self.user, choices[1])
+        # user, question, choices, previous vote (the session is cached)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(response.context['previous_choice'], choices[1])
+        self.add_choices(8)
+        with self.assertNumQueries(4):
+            self.client.get(url)
+
+    def test_anonymous_query_count(self):
+        """An anonymous visitor needs only the question and its choices."""
+        self.add_choices(3)
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertIsNone(response.context['previous_choice'])
+
+
 class SignUpViewTests(TestCase):
     def test_signup_view_exists(self):
         response = self.client.get(reverse('signup'))
@@ -274,3 +392,1568 @@ class VoteTests(TestCase):
         })
 
         self.assertRedirects(response, reverse('polls:detail', args=(self.test_question.id,)))
+
+
+def load_settings(**env):
+    """Evaluate mysite/settings.py with the CACHE_* and DB_PROFILE variables in env."""
+    environ = {key: value for key, value in os.environ.items()
+               if not key.startswith('CACHE_') and key != 'DB_PROFILE'}
+    with mock.patch.dict(os.environ, {**environ, **env}, clear=True):
+        return runpy.run_path(os.path.join(settings.BASE_DIR, 'mysite', 'settings.py'))
+
+
+PRODUCTION_SETTINGS = load_settings(DB_PROFILE='production',
+                                    CACHE_BACKEND='django.core.cache.backends.redis.RedisCache',
+                                    CACHE_LOCATION='redis://127.0.0.1:6379')
+
+
+class ProductionSettingsTests(SimpleTestCase):
+    def test_production_needs_memcached_or_redis(self):
+        """The production profile refuses caches without an atomic, shared incr()."""
+        for backend in ['', 'django.core.cache.backends.db.DatabaseCache',
+                        'django.core.cache.backends.filebased.FileBasedCache',
+                        'django.core.cache.backends.locmem.LocMemCache']:
+            with self.assertRaises(ImproperlyConfigured, msg=backend):
+                load_settings(DB_PROFILE='production', CACHE_BACKEND=backend,
+                              CACHE_LOCATION='polls_cache')
+
+    def test_sessions_follow_the_cache(self):
+        """Sessions are only read through the cache when it is shared."""
+        self.assertEqual(PRODUCTION_SETTINGS['SESSION_ENGINE'],
+                         'django.contrib.sessions.backends.cached_db')
+        self.assertEqual(load_settings()['SESSION_ENGINE'], 'django.contrib.sessions.backends.db')
+
+
+# The production session and cache setup. Redis doesn't run in the tests, the
+# local memory cache stands in for it: neither writes to the database.
+@override_settings(SESSION_ENGINE=PRODUCTION_SETTINGS['SESSION_ENGINE'])
+class VoteWriteTests(TestCase):
+    """The vote request writes the ballot and nothing else."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username='writer', password='testpassword')
+        self.question = create_question(question_text="Write path.", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="Only choice")
+        self.client.force_login(self.user)
+
+    def post_vote(self):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                                        {'choice': self.choice.id})
+        self.assertEqual(response.status_code, 302)
+        return [query['sql'] for query in ctx.captured_queries]
+
+    def test_vote_is_one_write_transaction(self):
+        """All writes of a vote happen inside a single transaction."""
+        statements = self.post_vote()
+        # inside TestCase, transaction.atomic() opens a savepoint
+        savepoints = [i for i, sql in enumerate(statements) if sql.startswith('SAVEPOINT')]
+        self.assertEqual(len(savepoints), 1)
+        start = savepoints[0]
+        end = next(i for i, sql in enumerate(statements) if sql.startswith('RELEASE SAVEPOINT'))
+        writes = [i for i, sql in enumerate(statements)
+                  if sql.startswith(('INSERT', 'UPDATE', 'DELETE'))]
+        self.assertTrue(writes)
+        self.assertTrue(all(start < i < end for i in writes))
+
+    def test_vote_does_not_touch_session_table(self):
+        """With a shared cache sessions are read from it, and messages go to a cookie."""
+        statements = self.post_vote()
+        self.assertFalse([sql for sql in statements if 'django_session' in sql])
+
+    def test_message_is_stored_in_cookie(self):
+        """The vote confirmation travels in the messages cookie."""
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                                    {'choice': self.choice.id}, follow=True)
+        self.assertIn('messages', response.cookies)
+        self.assertContains(response, "has been saved")
+
+
+class VoteCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='counter', password='testpassword')
+        self.question = create_question(question_text="Counted question.", days=-1)
+        self.first = Choice.objects.create(question=self.question, choice_text='First')
+        self.second = Choice.objects.create(question=self.question, choice_text='Second')
+        self.client.login(username='counter', password='testpassword')
+
+    def vote_for(self, choice):
+        return self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                                {'choice': choice.id})
+
+    def test_new_vote_increments_counter(self):
+        """A first vote adds one to the selected choice."""
+        self.vote_for(self.first)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+        self.assertEqual(self.second.votes, 0)
+
+    def test_changed_vote_moves_counter(self):
+        """Changing a vote moves the count from the old choice to the new one."""
+        self.vote_for(self.first)
+        self.vote_for(self.second)
+        self.vote_for(self.second)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.votes, 0)
+        self.assertEqual(self.second.votes, 1)
+        self.assertEqual(Vote.objects.count(), 1)
+
+    def test_reconcile_fixes_drift(self):
+        """reconcile_vote_counts rewrites counters that disagree with Vote."""
+        self.vote_for(self.first)
+        Choice.objects.filter(pk=self.first.pk).update(votes=7)
+        Choice.objects.filter(pk=self.second.pk).update(votes=3)
+        out = StringIO()
+        call_command('reconcile_vote_counts', batch_size=1, stdout=out)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+        self.assertEqual(self.second.votes, 0)
+        self.assertIn('2 drifted', out.getvalue())
+
+    def test_reconcile_dry_run_only_reports(self):
+        """With --dry-run the drift is reported but left in place."""
+        Choice.objects.filter(pk=self.first.pk).update(votes=4)
+        out = StringIO()
+        call_command('reconcile_vote_counts', dry_run=True, stdout=out)
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 4)
+        self.assertIn('stored 4, counted 0', out.getvalue())
+
+
+class VoteUpsertTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='upsert', password='testpassword')
+        self.question = create_question(question_text="Upsert question.", days=-1)
+        self.first = Choice.objects.create(question=self.question, choice_text='First')
+        self.second = Choice.objects.create(question=self.question, choice_text='Second')
+
+    def test_record_creates_then_moves_single_vote(self):
+        """Repeated ballots of one user leave exactly one vote on the question."""
+        self.assertTrue(Vote.objects.record(self.user, self.first))
+        self.assertTrue(Vote.objects.record(self.user, self.second))
+        vote = Vote.objects.get(user=self.user, question=self.question)
+        self.assertEqual(vote.choice, self.second)
+
+    def test_record_same_choice_is_noop(self):
+        """Voting twice for the same choice does not count twice."""
+        Vote.objects.record(self.user, self.first)
+        self.assertFalse(Vote.objects.record(self.user, self.first))
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.votes, 1)
+
+    def test_unique_vote_per_user_question(self):
+        """The database rejects a second vote row for the same user and question."""
+        Vote.objects.create(user=self.user, choice=self.first)
+        with self.assertRaises(IntegrityError):
+            Vote.objects.create(user=self.user, choice=self.second)
+
+    def test_record_query_count(self):
+        """Recording a vote costs a fixed number of statements."""
+        Vote.objects.record(self.user, self.first)
+        # savepoint, decrement, upsert, increment, release
+        with self.assertNumQueries(5):
+            Vote.objects.record(self.user, self.second)
+
+
+class ResultsCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='cached', password='testpassword')
+        self.question = create_question(question_text="Cached question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text='Only')
+        self.url = reverse('polls:results', args=(self.question.id,))
+
+    def test_second_view_is_a_hit(self):
+        """The second results page is served from the cache without a choice query."""
+        before = results_cache_stats()
+        self.client.get(self.url)
+        # one query for the question itself
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+        after = results_cache_stats()
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertEqual(after['hits'] - before['hits'], 1)
+
+    def test_vote_invalidates_results(self):
+        """A recorded vote bumps the version so the new count is shown."""
+        version = results_version(self.question.id)
+        self.client.get(self.url)
+        self.client.login(username='cached', password='testpassword')
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {'choice': self.choice.id})
+        self.assertNotEqual(results_version(self.question.id), version)
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['results'][0]['votes'], 1)
+
+    def test_choice_change_invalidates_results(self):
+        """Adding a choice drops the cached snapshot."""
+        self.client.get(self.url)
+        Choice.objects.create(question=self.question, choice_text='Another')
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.context['results']), 2)
+
+
+class VoteBufferTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'buffered{i}', password='testpassword')
+                      for i in range(3)]
+        self.question = create_question(question_text="Buffered question.", days=-1)
+        self.first = Choice.objects.create(question=self.question, choice_text='First')
+        self.second = Choice.objects.create(question=self.question, choice_text='Second')
+
+    def test_flush_applies_batches_last_write_wins(self):
+        """Queued ballots are applied in batches and a user's last ballot wins."""
+        buffer = VoteBuffer(batch_size=2)
+        q = self.question.id
+        buffer.submit(self.users[0].id, q, self.first.id)
+        buffer.submit(self.users[1].id, q, self.first.id)
+        buffer.submit(self.users[0].id, q, self.second.id)
+        buffer.submit(self.users[2].id, q, self.second.id)
+        self.assertEqual(buffer.flush(), 4)
+        self.assertEqual(len(buffer), 0)
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (1, 2))
+        self.assertEqual(Vote.objects.get(user=self.users[0]).choice, self.second)
+
+    def test_record_many_moves_existing_votes(self):
+        """A batch that changes an earlier vote moves its count."""
+        Vote.objects.record(self.users[0], self.first)
+        changed = Vote.objects.record_many([(self.users[0].id, self.question.id,
+                                             self.second.id)])
+        self.assertEqual(changed, {self.question.id})
+        self.first.refresh_from_db()
+        self.second.refresh_from_db()
+        self.assertEqual((self.first.votes, self.second.votes), (0, 1))
+
+    def test_failed_batch_is_retried_per_ballot(self):
+        """If a batch fails its ballots are retried one by one, dropping only bad ones."""
+        buffer = VoteBuffer()
+        buffer.submit(self.users[0].id, self.question.id, self.first.id)
+        buffer.submit(self.users[1].id, self.question.id, self.second.id)
+
+        def fail_on_second(ballots):
+            if any(choice_id == self.second.id for _, _, choice_id in ballots):
+                raise IntegrityError("choice was deleted")
+            return record_ballots(ballots)
+
+        with mock.patch('polls.buffer.record_ballots', side_effect=fail_on_second), \
+                self.assertLogs('polls.buffer', level='ERROR'):
+            buffer.flush()
+        self.assertEqual(list(Vote.objects.values_list('user', flat=True)), [self.users[0].id])
+
+    @override_settings(POLLS_VOTE_BUFFER=True)
+    def test_buffered_vote_view(self):
+        """In write-behind mode the view queues the ballot instead of writing it."""
+        buffer = VoteBuffer()
+        self.client.login(username='buffered0', password='testpassword')
+        with mock.patch('polls.views.get_vote_buffer', return_value=buffer):
+            response = self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                                        {'choice': self.first.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Vote.objects.exists())
+        buffer.flush()
+        self.assertTrue(Vote.objects.filter(user=self.users[0], choice=self.first).exists())
+
+
+class ResultsJSONTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='dashboard', password='testpassword')
+        self.question = create_question(question_text="JSON question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text='Only')
+        self.url = reverse('polls:results_json', args=(self.question.id,))
+
+    def test_counts_and_total(self):
+        """The endpoint returns per-choice counts and their total."""
+        Vote.objects.record(self.user, self.choice)
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['total'], 1)
+        self.assertEqual(data['choices'], [{'id': self.choice.id, 'choice_text': 'Only',
+                                            'votes': 1}])
+
+    def test_not_modified_without_queries(self):
+        """A matching If-None-Match is answered with 304 and no database access."""
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+    def test_vote_changes_etag(self):
+        """Recording a vote gives the results a new ETag."""
+        etag = self.client.get(self.url)['ETag']
+        self.client.login(username='dashboard', password='testpassword')
+        self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                         {'choice': self.choice.id})
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_missing_question(self):
+        """An unknown question is a 404."""
+        response = self.client.get(reverse('polls:results_json', args=(999,)))
+        self.assertEqual(response.status_code, 404)
+
+
+class SQLitePragmaTests(TestCase):
+    def test_pragmas_applied_on_new_connection(self):
+        """The connection_created hook runs every configured pragma."""
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            default_timeout = cursor.fetchone()[0]
+            try:
+                with override_settings(SQLITE_PRAGMAS={'busy_timeout': 1234}):
+                    apply_sqlite_pragmas(sender=None, connection=connection)
+                cursor.execute("PRAGMA busy_timeout")
+                self.assertEqual(cursor.fetchone()[0], 1234)
+            finally:
+                cursor.execute(f"PRAGMA busy_timeout = {default_timeout}")
+
+    def test_sqlite_pragmas_command(self):
+        """sqlite_pragmas reports the pragmas and runs PRAGMA optimize."""
+        out = StringIO()
+        call_command('sqlite_pragmas', optimize=True, stdout=out)
+        output = out.getvalue()
+        self.assertIn('journal_mode = ', output)
+        self.assertIn('busy_timeout = ', output)
+        self.assertIn('PRAGMA optimize done.', output)
+
+
+async_urls = ModuleType('async_urls')
+async_urls.urlpatterns = [
+    path('polls/', include((build_urlpatterns(use_async=True), 'polls'))),
+]
+
+
+@override_settings(ROOT_URLCONF=async_urls)
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='async', password='testpassword')
+        self.question = create_question(question_text="Async question.", days=-1)
+        self.first = Choice.objects.create(question=self.question, choice_text='First')
+        self.second = Choice.objects.create(question=self.question, choice_text='Second')
+
+    async def test_detail_shows_previous_choice(self):
+        """The async detail view renders the form with the user's earlier choice checked."""
+        await sync_to_async(Vote.objects.record)(self.user, self.second)
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.get(reverse('polls:detail', args=(self.question.id,)))
+        self.assertContains(response, self.question.question_text)
+        self.assertEqual(response.context['previous_choice'], self.second)
+
+    async def test_detail_future_question(self):
+        """A question that is not published yet is a 404."""
+        future = await Question.objects.acreate(
+            question_text="Future.", pub_date=timezone.now() + datetime.timedelta(days=1))
+        response = await self.async_client.get(reverse('polls:detail', args=(future.id,)))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_vote_and_results(self):
+        """An async vote is recorded and shown by the async results view."""
+        await sync_to_async(self.async_client.force_login)(self.user)
+        response = await self.async_client.post(
+            reverse('polls:vote', args=(self.question.id,)), {'choice': self.first.id})
+        self.assertRedirects(response, reverse('polls:results', args=(self.question.id,)),
+                             fetch_redirect_response=False)
+        response = await self.async_client.get(reverse('polls:results',
+                                                       args=(self.question.id,)))
+        votes = {row['id']: row['votes'] for row in response.context['results']}
+        self.assertEqual(votes, {self.first.id: 1, self.second.id: 0})
+
+    async def test_vote_requires_login(self):
+        """Anonymous async votes are sent to the login page."""
+        response = await self.async_client.post(
+            reverse('polls:vote', args=(self.question.id,)), {'choice': self.first.id})
+        self.assertEqual(response.status_code, 302)
+        self.assertIn('/accounts/login/', response.url)
+        self.assertEqual(await Vote.objects.acount(), 0)
+
+
+class LiveResultsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(username=f'live{i}', password='testpassword')
+                      for i in range(3)]
+        self.question = create_question(question_text="Live question.", days=-1)
+        self.choice = Choice.objects.create(question=self.question, choice_text='Only')
+
+    @staticmethod
+    def parse(message):
+        data = [line for line in message.splitlines() if line.startswith('data: ')][0]
+        return json.loads(data[len('data: '):])
+
+    async def test_stream_sends_snapshot_then_updates(self):
+        """The stream starts with the current counts and follows recorded votes."""
+        stream = stream_results(self.question, tick=0.01)
+        try:
+            self.assertEqual(self.parse(await anext(stream))['total'], 0)
+            await sync_to_async(Vote.objects.record)(self.users[0], self.choice)
+            await sync_to_async(bump_results_version)(self.question.id)
+            self.assertEqual(self.parse(await anext(stream))['total'], 1)
+        finally:
+            await stream.aclose()
+
+    async def test_burst_is_coalesced(self):
+        """Many changes within one tick produce a single message."""
+        stream = stream_results(self.question, tick=0.05)
+        try:
+            await anext(stream)
+            next_message = asyncio.ensure_future(anext(stream))
+            for user in self.users:
+                await sync_to_async(Vote.objects.record)(user, self.choice)
+                await sync_to_async(bump_results_version)(self.question.id)
+            self.assertEqual(self.parse(await next_message)['total'], 3)
+            # nothing else is pending after the coalesced message
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(anext(stream), 0.1)
+        finally:
+            await stream.aclose()
+
+    async def test_stream_ends_when_poll_closes(self):
+        """A closed poll gets its final counts and a closed event, then the stream ends."""
+        self.question.end_date = timezone.now() - datetime.timedelta(minutes=1)
+        stream = stream_results(self.question, tick=0.01)
+        self.assertEqual(self.parse(await anext(stream))['total'], 0)
+        self.assertTrue((await anext(stream)).startswith('event: closed'))
+        with self.assertRaises(StopAsyncIteration):
+            await anext(stream)
+        self.assertNotIn(self.question.id, broker._subscribers)
+
+    async def test_stream_ends_after_max_age(self):
+        """An idle stream ends once max_age has passed."""
+        stream = stream_results(self.question, tick=0.01, keepalive=0.02, max_age=0.1)
+        messages = [message async for message in stream]
+        self.assertIn(': keepalive\n\n', messages)
+        self.assertNotIn(self.question.id, broker._subscribers)
+
+    async def test_unsubscribes_on_close(self):
+        """Closing the stream removes its subscription."""
+        stream = stream_results(self.question, tick=0.01)
+        await anext(stream)
+        await stream.aclose()
+        self.assertNotIn(self.question.id, broker._subscribers)
+
+
+class FixtureStreamingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='fixture', password='testpassword')
+        self.question = create_question(question_text="Fixture question.", days=-1)
+        self.first = Choice.objects.create(question=self.question, choice_text='First')
+        self.second = Choice.objects.create(question=self.question, choice_text='Second')
+        Vote.objects.record(self.user, self.second)
+
+    def test_iter_json_array_small_chunks(self):
+        """The incremental parser yields every element even when chunks split them."""
+        data = [{"model": "polls.question", "pk": i, "fields": {"n": i * 1000}}
+                for i in range(20)]
+        parsed = list(iter_json_array(StringIO(json.dumps(data, indent=2)), chunk_size=7))
+        self.assertEqual(parsed, data)
+
+    def test_export_import_round_trip(self):
+        """Exported polls can be imported back in batches, in both formats."""
+        for fmt in ('json', 'ndjson'):
+            with self.subTest(fmt=fmt), tempfile.TemporaryDirectory() as tmpdir:
+                path = os.path.join(tmpdir, f'polls.{fmt}')
+                call_command('export_polls', output=path, stdout=StringIO())
+                Question.objects.all().delete()
+                out = StringIO()
+                call_command('import_polls', path, batch_size=1, stdout=out)
+                self.assertIn('Imported 4 rows', out.getvalue())
+                vote = Vote.objects.get()
+                self.assertEqual((vote.user, vote.question, vote.choice),
+                                 (self.user, self.question, self.second))
+                self.assertEqual(Choice.objects.get(pk=self.second.pk).votes, 1)
+
+    def test_round_trip_keeps_archived_votes(self):
+        """Archived votes are exported and imported, so the counters survive reconcile."""
+        vote = Vote.objects.get()
+        ArchivedVote.objects.create(question=self.question, choice=vote.choice, user=vote.user)
+        vote.delete()
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'polls.ndjson')
+            call_command('export_polls', output=path, stdout=StringIO())
+            Question.objects.all().delete()
+            call_command('import_polls', path, stdout=StringIO())
+        archived = ArchivedVote.objects.get()
+        self.assertEqual((archived.user, archived.question, archived.choice),
+                         (self.user, self.question, self.second))
+        self.assertFalse(Vote.objects.exists())
+        self.assertEqual(Choice.objects.get(pk=self.second.pk).votes, 1)
+
+    def test_export_to_stdout(self):
+        """Without --output the fixture goes to standard output as valid JSON."""
+        out = StringIO()
+        call_command('export_polls', stdout=out, stderr=StringIO())
+        models = [record['model'] for record in json.loads(out.getvalue())]
+        self.assertEqual(models, ['polls.question', 'polls.choice', 'polls.choice',
+                                  'polls.vote'])
+
+    def test_import_old_vote_format(self):
+        """Votes from fixtures written before Vote.question existed still import."""
+        Vote.objects.all().delete()
+        records = [{"model": "polls.vote", "pk": 50,
+                    "fields": {"choice": self.first.pk, "user": self.user.pk}}]
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, 'votes.json')
+            with open(path, 'w') as fp:
+                json.dump(records, fp)
+            call_command('import_polls', path, stdout=StringIO())
+        self.assertEqual(Vote.objects.get(pk=50).question, self.question)
+        self.assertEqual(Choice.objects.get(pk=self.first.pk).votes, 1)
+
+
+class BenchHelperTests(TestCase):
+    def test_seed_polls(self):
+        """seed_polls bulk-creates the requested rows with consistent counters."""
+        users, poll_choices = seed_polls(random.Random(1), users=5, questions=3,
+                                         choices=2, votes=10)
+        self.assertEqual(len(users), 5)
+        self.assertEqual(sum(len(c) for c in poll_choices.values()), 6)
+        self.assertEqual(Vote.objects.count(), 10)
+        self.assertEqual(sum(Choice.objects.values_list('votes', flat=True)), 10)
+
+    def test_percentile(self):
+        """percentile() uses the nearest-rank method."""
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 95), 0.0)
+
+    def test_scratch_database_restores_test_name(self):
+        """scratch_database puts the TEST NAME setting back, even after an error."""
+        test_name = connection.settings_dict['TEST']['NAME']
+        with mock.patch.object(connection.creation, 'create_test_db', return_value='old'), \
+                mock.patch.object(connection.creation, 'destroy_test_db') as destroy:
+            with self.assertRaises(RuntimeError), scratch_database():
+                self.assertTrue(connection.settings_dict['TEST']['NAME'].endswith('bench.sqlite3'))
+                raise RuntimeError
+        destroy.assert_called_once_with('old', 0)
+        self.assertEqual(connection.settings_dict['TEST']['NAME'], test_name)
+
+    def test_bench_needs_a_user_per_client(self):
+        """bench_polls refuses more concurrent clients than users."""
+        with self.assertRaisesMessage(CommandError, '--concurrency'):
+            call_command('bench_polls', users=2, concurrency=3, stdout=StringIO())
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = create_question(question_text="Timed question.", days=-1)
+        self.url = reverse('polls:detail', args=(self.question.id,))
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=1.0)
+    def test_server_timing_header(self):
+        """Sampled requests carry db, template and total timings."""
+        response = self.client.get(self.url)
+        timing = response['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries"')
+        self.assertIn('tpl;dur=', timing)
+        self.assertIn('total;dur=', timing)
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=1.0)
+    def test_summary_per_url_name(self):
+        """Timings are summed per URL name and printed by perf_summary."""
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.assertEqual(get_summary()['polls:detail']['requests'], 2)
+        out = StringIO()
+        call_command('perf_summary', reset=True, stdout=out)
+        self.assertIn('polls:detail', out.getvalue())
+        self.assertEqual(get_summary(), {})
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=1.0)
+    async def test_async_chain(self):
+        """Under ASGI the middleware runs async and still records the request."""
+        response = await self.async_client.get(self.url)
+        self.assertRegex(response['Server-Timing'], r'db;dur=[\d.]+;desc="[1-9]\d* queries"')
+        summary = await sync_to_async(get_summary)()
+        self.assertEqual(summary['polls:detail']['requests'], 1)
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=1.0)
+    def test_summary_counters_are_incremented(self):
+        """Each request only increments the counters, starting from an empty cache."""
+        self.client.get(self.url)
+        cache.delete('polls:perf:polls:detail:requests')
+        self.client.get(self.url)
+        self.client.get(self.url)
+        entry = get_summary()['polls:detail']
+        self.assertEqual(entry['requests'], 2)
+        self.assertGreaterEqual(entry['max'], entry['total'] / 3)
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=1.0)
+    def test_summary_needs_no_registry(self):
+        """Views are found from the URLconf, so losing other keys loses no view."""
+        self.client.get(self.url)
+        self.client.get(reverse('polls:results', args=(self.question.id,)))
+        cache.delete('polls:perf:polls:detail:requests')
+        self.assertEqual(set(get_summary()), {'polls:results'})
+        call_command('perf_summary', reset=True, stdout=StringIO())
+        self.assertFalse(cache.get('polls:perf:polls:results:requests'))
+
+    @override_settings(POLLS_PERF_SAMPLE_RATE=0.0)
+    def test_disabled_when_not_sampling(self):
+        """With sampling off no header is added and nothing is recorded."""
+        response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(get_summary(), {})
+
+
+class QuestionStatusTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_status_set_on_save(self):
+        """Saving a question stores the status its dates imply."""
+        now = timezone.now()
+        scheduled = Question.objects.create(question_text="Later.",
+                                            pub_date=now + datetime.timedelta(days=1))
+        closed = Question.objects.create(question_text="Over.",
+                                         pub_date=now - datetime.timedelta(days=2),
+                                         end_date=now - datetime.timedelta(days=1))
+        opened = Question.objects.create(question_text="Now.")
+        self.assertEqual(scheduled.status, Question.Status.SCHEDULED)
+        self.assertEqual(closed.status, Question.Status.CLOSED)
+        self.assertEqual(opened.status, Question.Status.OPEN)
+
+    def test_update_status_flips_at_boundaries(self):
+        """update_status() opens and closes polls whose dates have passed."""
+        now = timezone.now()
+        question = Question.objects.create(question_text="Soon.",
+                                           pub_date=now + datetime.timedelta(hours=1),
+                                           end_date=now + datetime.timedelta(hours=2))
+        later = now + datetime.timedelta(hours=1, minutes=30)
+        self.assertEqual(Question.objects.update_status(now=later), 1)
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.OPEN)
+        Question.objects.update_status(now=now + datetime.timedelta(hours=3))
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.CLOSED)
+
+    def test_update_poll_status_command(self):
+        """The command stores the status of polls changed behind save()'s back."""
+        question = create_question(question_text="Stale.", days=-2)
+        Question.objects.filter(pk=question.pk).update(
+            end_date=timezone.now() - datetime.timedelta(days=1))
+        out = StringIO()
+        call_command('update_poll_status', stdout=out)
+        self.assertIn('Updated the status of 1 polls.', out.getvalue())
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.CLOSED)
+
+    def test_index_hides_future_polls(self):
+        """A poll whose pub_date has not come is not listed."""
+        create_question(question_text="Hidden.", days=1)
+        response = self.client.get(reverse("polls:index"))
+        self.assertQuerySetEqual(response.context["latest_question_list"], [])
+
+    def test_index_shows_stale_scheduled_poll(self):
+        """A poll still marked scheduled after its pub_date passed is listed as open."""
+        question = create_question(question_text="Due.", days=1)
+        Question.objects.filter(pk=question.pk).update(
+            pub_date=timezone.now() - datetime.timedelta(minutes=10))
+        response = self.client.get(reverse("polls:index"))
+        page = list(response.context["latest_question_list"])
+        self.assertEqual(page, [question])
+        self.assertEqual(page[0].status, Question.Status.SCHEDULED)
+        self.assertTrue(page[0].is_open)
+
+    def test_published_filters_on_status(self):
+        """Only the scheduled rows need the pub_date bound, the others go by the status index."""
+        where = str(Question.objects.published().query).split(' WHERE ')[1]
+        self.assertTrue(where.startswith('("polls_question"."status" IN (open, closed) OR ('),
+                        where)
+        self.assertEqual(where.count('"pub_date" <='), 1)
+
+    def test_index_is_open_from_dates(self):
+        """A poll still marked open after its end_date passed is listed as closed."""
+        question = create_question(question_text="Ended.", days=-2)
+        Question.objects.filter(pk=question.pk).update(
+            end_date=timezone.now() - datetime.timedelta(minutes=10))
+        response = self.client.get(reverse("polls:index"))
+        self.assertFalse(list(response.context["latest_question_list"])[0].is_open)
+
+
+class IndexCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='indexed', password='testpassword')
+        self.question = create_question(question_text="Cached index question.", days=-1)
+        self.url = reverse('polls:index')
+
+    def test_anonymous_page_served_from_cache(self):
+        """A repeated anonymous request is answered without touching the database."""
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+        self.assertContains(response, self.question.question_text)
+        self.assertIn('Cookie', response['Vary'])
+
+    def test_question_save_invalidates_page(self):
+        """Saving a question drops the cached page."""
+        self.client.get(self.url)
+        self.question.question_text = "Renamed question."
+        self.question.save()
+        self.assertContains(self.client.get(self.url), "Renamed question.")
+
+    def test_logged_in_user_gets_own_page(self):
+        """Logged-in users see their welcome block, not the anonymous copy."""
+        self.client.get(self.url)
+        self.client.force_login(self.user)
+        response = self.client.get(self.url)
+        self.assertContains(response, "Welcome back")
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cached_db')
+    def test_question_list_fragment_is_cached(self):
+        """For logged-in users the question list comes from a cached fragment."""
+        self.client.force_login(self.user)
+        self.client.get(self.url)
+        # only the user, the session and the question list come from the cache
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url)
+        self.assertContains(response, self.question.question_text)
+
+    def test_status_update_invalidates_page(self):
+        """update_poll_status bumps the index when a poll flips."""
+        self.client.get(self.url)
+        Question.objects.filter(pk=self.question.pk).update(
+            end_date=timezone.now() - datetime.timedelta(hours=1))
+        call_command('update_poll_status', stdout=StringIO())
+        self.assertContains(self.client.get(self.url), "Status: Closed")
+
+
+class AdminTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username='admin', password='testpassword')
+        self.client.force_login(self.admin)
+        self.changelist = reverse('admin:polls_question_changelist')
+
+    def add_question(self, text, votes):
+        question = create_question(question_text=text, days=-1)
+        for count in votes:
+            question.choice_set.create(choice_text=f'{count} votes', votes=count)
+        return question
+
+    def test_total_votes_column(self):
+        """The changelist shows each question's vote total and sorts by it."""
+        self.add_question("Popular.", [5, 7])
+        self.add_question("Quiet.", [1])
+        self.add_question("No choices.", [])
+        # "total votes" is the sixth column, sort descending
+        response = self.client.get(self.changelist, {'o': '-6'})
+        totals = [(q.question_text, q.total_votes) for q in response.context['cl'].result_list]
+        self.assertEqual(totals, [("Popular.", 12), ("Quiet.", 1), ("No choices.", 0)])
+
+    def test_changelist_query_count_does_not_grow(self):
+        """The changelists cost the same number of queries for 2 or 12 rows."""
+        for url in (self.changelist, reverse('admin:polls_choice_changelist')):
+            for i in range(2):
+                self.add_question(f"Question {i}", [i])
+            with CaptureQueriesContext(connection) as few:
+                self.client.get(url)
+            for i in range(10):
+                self.add_question(f"More {i}", [i])
+            with self.assertNumQueries(len(few)):
+                self.client.get(url)
+
+    def test_close_polls_now(self):
+        """The close action ends the selected open polls in one UPDATE."""
+        questions = [self.add_question(f"Open {i}", [1]) for i in range(3)]
+        scheduled = create_question(question_text="Scheduled.", days=5)
+        selected = [q.pk for q in questions[:2]] + [scheduled.pk]
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.post(self.changelist, {
+                'action': 'close_polls_now',
+                '_selected_action': selected,
+            })
+        updates = [q['sql'] for q in ctx.captured_queries
+                   if q['sql'].startswith('UPDATE "polls_question"')]
+        self.assertEqual(len(updates), 1)
+        statuses = dict(Question.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[questions[0].pk], Question.Status.CLOSED)
+        self.assertEqual(statuses[questions[1].pk], Question.Status.CLOSED)
+        self.assertEqual(statuses[questions[2].pk], Question.Status.OPEN)
+        self.assertEqual(statuses[scheduled.pk], Question.Status.SCHEDULED)
+        self.assertFalse(Question.objects.get(pk=questions[0].pk).can_vote())
+
+
+class KioskBallotTests(TestCase):
+    def setUp(self):
+        self.kiosk = User.objects.create_user(username='kiosk', password='testpassword')
+        self.kiosk.user_permissions.add(Permission.objects.get(codename='add_vote'))
+        self.voters = [User.objects.create_user(username=f'voter{i}') for i in range(3)]
+        self.question = create_question(question_text="Kiosk question.", days=-2)
+        self.choices = [self.question.choice_set.create(choice_text=f'Choice {i}')
+                        for i in range(2)]
+        self.url = reverse('polls:submit_ballots')
+        self.client.force_login(self.kiosk)
+
+    def ballot(self, user, choice, hours_ago=1, question=None):
+        return {
+            'user': user.pk,
+            'question': (question or self.question).pk,
+            'choice': choice.pk,
+            'cast_at': (timezone.now() - datetime.timedelta(hours=hours_ago)).isoformat(),
+        }
+
+    def post(self, body):
+        return self.client.post(self.url, json.dumps(body), content_type='application/json')
+
+    def test_csrf_handshake(self):
+        """A kiosk with a real session needs the csrftoken cookie as X-CSRFToken."""
+        kiosk = Client(enforce_csrf_checks=True)
+        kiosk.get(reverse('login'))
+        kiosk.post(reverse('login'), {'username': 'kiosk', 'password': 'testpassword',
+                                      'csrfmiddlewaretoken': kiosk.cookies['csrftoken'].value})
+        body = json.dumps([self.ballot(self.voters[0], self.choices[0])])
+        response = kiosk.post(self.url, body, content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+        # the login rotated the token
+        response = kiosk.post(self.url, body, content_type='application/json',
+                              HTTP_X_CSRFTOKEN=kiosk.cookies['csrftoken'].value)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['accepted'], 1)
+
+    def test_requires_permission(self):
+        """Only users allowed to add votes may upload ballots."""
+        self.client.force_login(self.voters[0])
+        self.assertEqual(self.post([]).status_code, 403)
+        self.client.logout()
+        self.assertEqual(self.post([]).status_code, 403)
+
+    def test_batch_applied_with_per_record_results(self):
+        """Accepted ballots are written, others get a status and reason."""
+        other = create_question(question_text="Other.", days=-2)
+        # a kiosk clock running slightly fast is tolerated
+        ahead = self.ballot(self.voters[2], self.choices[0], hours_ago=-0.01)
+        response = self.post({'ballots': [
+            self.ballot(self.voters[0], self.choices[0], hours_ago=3),
+            self.ballot(self.voters[1], self.choices[1]),
+            self.ballot(self.voters[0], self.choices[1], hours_ago=2),
+            self.ballot(self.voters[2], self.choices[0], question=other),
+            {'user': self.voters[2].pk},
+            ahead,
+            self.ballot(self.voters[2], self.choices[0], hours_ago=-1),
+            self.ballot(self.voters[2], self.choices[0], hours_ago=72),
+        ]})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([r['status'] for r in data['results']], [
+            'superseded', 'accepted', 'accepted', 'rejected', 'rejected', 'accepted', 'rejected',
+            'rejected',
+        ])
+        self.assertEqual(data['results'][3]['error'], "choice does not belong to question")
+        self.assertEqual(data['results'][6]['error'], "cast_at is in the future")
+        self.assertEqual(data['results'][7]['error'], "voting was not open at cast_at")
+        self.assertEqual((data['accepted'], data['superseded'], data['rejected']), (3, 1, 4))
+        self.assertEqual(
+            dict(Vote.objects.values_list('user__username', 'choice_id')),
+            {'voter0': self.choices[1].pk, 'voter1': self.choices[1].pk,
+             'voter2': self.choices[0].pk})
+        self.assertEqual([c.votes for c in Choice.objects.order_by('id')], [1, 2])
+
+    def test_query_count_does_not_grow_with_batch(self):
+        """Validation and writes take a fixed number of queries."""
+        def batch(n):
+            users = [User(username=f'bulk{n}-{i}') for i in range(n)]
+            User.objects.bulk_create(users)
+            users = User.objects.filter(username__startswith=f'bulk{n}-')
+            return [self.ballot(user, self.choices[i % 2]) for i, user in enumerate(users)]
+
+        small, large = batch(4), batch(30)
+        with CaptureQueriesContext(connection) as few:
+            self.post(small)
+        with self.assertNumQueries(len(few)):
+            response = self.post(large)
+        self.assertEqual(response.json()['accepted'], 30)
+
+    def test_bad_body(self):
+        """Bodies that are not a list of ballots are refused."""
+        self.assertEqual(self.client.post(self.url, 'nope',
+                                          content_type='application/json').status_code, 400)
+        self.assertEqual(self.post({'ballot': []}).status_code, 400)
+        with override_settings(POLLS_BALLOT_BATCH_MAX=1):
+            self.assertEqual(self.post([{}, {}]).status_code, 400)
+
+
+class VoteExportTests(TestCase):
+    def setUp(self):
+        self.staff = User.objects.create_user(username='auditor', password='testpassword',
+                                              is_staff=True)
+        self.question = create_question(question_text="Audited.", days=-1)
+        self.choices = [self.question.choice_set.create(choice_text=f'Choice, {i}')
+                        for i in range(2)]
+        self.voters = [User.objects.create_user(username=f'v{i}') for i in range(3)]
+        for i, voter in enumerate(self.voters):
+            Vote.objects.record(voter, self.choices[i % 2])
+        self.url = reverse('polls:export_votes', args=(self.question.id,))
+
+    def test_staff_only(self):
+        """Visitors who are not staff are sent to the admin login."""
+        self.client.force_login(self.voters[0])
+        self.assertEqual(self.client.get(self.url).status_code, 302)
+
+    def test_csv_votes(self):
+        """The votes stream as CSV with a header line."""
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(rows[0], ['vote_id', 'user_id', 'username', 'choice_id', 'choice_text',
+                                   'archived'])
+        self.assertEqual([row[2:] for row in rows[1:]], [
+            ['v0', str(self.choices[0].id), 'Choice, 0', 'False'],
+            ['v1', str(self.choices[1].id), 'Choice, 1', 'False'],
+            ['v2', str(self.choices[0].id), 'Choice, 0', 'False'],
+        ])
+
+    def test_csv_escapes_formulas(self):
+        """Text a spreadsheet would run as a formula is prefixed with ' in CSV only."""
+        Choice.objects.filter(pk=self.choices[0].pk).update(choice_text='=1+1')
+        User.objects.filter(pk=self.voters[1].pk).update(username='@sum')
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url)
+        rows = list(csv.reader(StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual([(row[2], row[4]) for row in rows[1:]],
+                         [('v0', "'=1+1"), ("'@sum", 'Choice, 1'), ('v2', "'=1+1")])
+        response = self.client.get(self.url, {'format': 'ndjson', 'data': 'totals'})
+        first = json.loads(b''.join(response.streaming_content).decode().splitlines()[0])
+        self.assertEqual(first['choice_text'], '=1+1')
+
+    def test_ndjson_totals(self):
+        """Totals report both the stored counter and the counted votes."""
+        Choice.objects.filter(pk=self.choices[1].pk).update(votes=5)
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {'format': 'ndjson', 'data': 'totals'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'choice_id': self.choices[0].id, 'choice_text': 'Choice, 0', 'votes': 2, 'counted': 2},
+            {'choice_id': self.choices[1].id, 'choice_text': 'Choice, 1', 'votes': 5, 'counted': 1},
+        ])
+
+    def test_unknown_export(self):
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(self.url, {'format': 'xml'}).status_code, 404)
+
+    def test_command_matches_view(self):
+        """The command writes the same rows as the view."""
+        self.client.force_login(self.staff)
+        response = self.client.get(self.url, {'format': 'ndjson'})
+        out = StringIO()
+        call_command('export_votes', self.question.id, '--format', 'ndjson', '--batch-size', '2',
+                     stdout=out, stderr=StringIO())
+        self.assertEqual(out.getvalue(), b''.join(response.streaming_content).decode())
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'])
+class ReplicaRouterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.router = ReplicaRouter()
+        self.user = User.objects.create_user(username='reader', password='testpassword')
+        self.question = create_question(question_text="Replicated.", days=-1)
+        self.choice = self.question.choice_set.create(choice_text="Choice")
+
+    @contextmanager
+    def routed_reads(self):
+        """Collect the aliases the router picks for the poll reads inside the block."""
+        aliases = []
+        db_for_read = ReplicaRouter.db_for_read
+
+        def spy(router, model, **hints):
+            # sessions and users are loaded before the view runs
+            if model._meta.app_label == 'polls':
+                aliases.append(db_for_read(router, model, **hints))
+            # the replicas do not exist in the test run, read the primary
+            return 'default'
+
+        with mock.patch.object(ReplicaRouter, 'db_for_read', autospec=True, side_effect=spy):
+            yield aliases
+
+    def test_routing(self):
+        """Only reads inside use_replica() go to a replica, writes never do."""
+        cache_entry = DatabaseCache('polls_cache', {}).cache_model_class
+        self.assertEqual(self.router.db_for_read(Question), 'default')
+        with use_replica():
+            self.assertIn(self.router.db_for_read(Question), ['replica1', 'replica2'])
+            self.assertEqual(self.router.db_for_read(cache_entry), 'default')
+            self.assertEqual(self.router.db_for_write(Question), 'default')
+        self.assertIs(self.router.allow_migrate('replica1', 'polls'), False)
+        self.assertIsNone(self.router.allow_migrate('default', 'polls'))
+
+    def test_read_views_use_replica(self):
+        """The results and results JSON are read from a replica."""
+        self.client.force_login(self.user)
+        for url in (reverse('polls:results', args=(self.question.id,)),
+                    reverse('polls:results_json', args=(self.question.id,))):
+            with self.routed_reads() as aliases:
+                self.client.get(url)
+            self.assertTrue(aliases)
+            self.assertTrue(all(alias.startswith('replica') for alias in aliases), url)
+
+    def test_cached_page_is_rendered_from_primary(self):
+        """The index page shared with anonymous visitors is never read from a lagging replica."""
+        with self.routed_reads() as aliases:
+            self.client.get(reverse('polls:index'))
+        self.assertTrue(aliases)
+        self.assertEqual(set(aliases), {'default'})
+
+    def test_cached_fragment_is_rendered_from_primary(self):
+        """The question list fragment shared by logged-in users is read from the primary."""
+        self.client.force_login(self.user)
+        with self.routed_reads() as aliases:
+            response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, self.question.question_text)
+        self.assertTrue(aliases)
+        self.assertEqual(set(aliases), {'default'})
+
+    def test_cached_results_are_read_from_primary(self):
+        """Results cached under the current version are counted on the primary."""
+        question = Question.objects.get(pk=self.question.pk)
+        # as if read from a replica, which doesn't exist in the test run
+        question._state.db = 'replica1'
+        self.choice.votes = 3
+        self.choice.save()
+        self.assertEqual(get_results(question)[0]['votes'], 3)
+
+    def test_reads_stick_to_primary_after_vote(self):
+        """A voter reads their results from the primary for a short while."""
+        self.client.force_login(self.user)
+        response = self.client.post(reverse('polls:vote', args=(self.question.id,)),
+                                    {'choice': self.choice.id})
+        self.assertEqual(response.cookies[PRIMARY_COOKIE]['max-age'],
+                         settings.POLLS_REPLICA_STICKY_SECONDS)
+        with self.routed_reads() as aliases:
+            self.client.get(response.url)
+        self.assertTrue(aliases)
+        self.assertEqual(set(aliases), {'default'})
+
+    @override_settings(ROOT_URLCONF=async_urls)
+    async def test_async_results_view_uses_replica(self):
+        """The async results view keeps the replica through sync_to_async."""
+        with self.routed_reads() as aliases:
+            await self.async_client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertTrue(aliases)
+        self.assertTrue(all(alias.startswith('replica') for alias in aliases))
+
+
+class ShardedCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.question = Question.objects.create(
+            question_text="Hot poll.", pub_date=timezone.now() - datetime.timedelta(days=1),
+            counter_shards=4)
+        self.first = self.question.choice_set.create(choice_text='First')
+        self.second = self.question.choice_set.create(choice_text='Second')
+        self.users = [User.objects.create_user(username=f'hot{i}') for i in range(20)]
+
+    def totals(self):
+        return dict(Choice.objects.with_total_votes().values_list('choice_text', 'total_votes'))
+
+    def test_votes_go_to_shards(self):
+        """Votes on a sharded question update shard rows, not the choice row."""
+        for user in self.users:
+            Vote.objects.record(user, self.first)
+        Vote.objects.record(self.users[0], self.second)
+        self.assertEqual(self.totals(), {'First': 19, 'Second': 1})
+        self.assertEqual(Choice.objects.get(pk=self.first.pk).votes, 0)
+        shards = ChoiceVoteShard.objects.filter(choice=self.first)
+        self.assertLessEqual(shards.count(), 4)
+        self.assertEqual(sum(shard.votes for shard in shards), 19)
+        self.assertEqual([row['votes'] for row in get_results(self.question)], [19, 1])
+
+    def test_record_many(self):
+        """Batched ballots on a sharded question land in the shards too."""
+        Vote.objects.record_many(
+            [(user.pk, self.question.pk, self.second.pk) for user in self.users])
+        Vote.objects.record_many([(self.users[0].pk, self.question.pk, self.first.pk)])
+        self.assertEqual(self.totals(), {'First': 1, 'Second': 19})
+        self.assertEqual(Choice.objects.get(pk=self.second.pk).votes, 0)
+
+    def test_compact_and_reconcile(self):
+        """Compaction folds the shards into Choice.votes without changing totals."""
+        for user in self.users[:7]:
+            Vote.objects.record(user, self.first)
+        out = StringIO()
+        call_command('reconcile_vote_counts', '--dry-run', stdout=out)
+        self.assertIn("0 drifted", out.getvalue())
+        call_command('compact_vote_shards', stdout=StringIO())
+        self.assertFalse(ChoiceVoteShard.objects.exists())
+        self.assertEqual(Choice.objects.get(pk=self.first.pk).votes, 7)
+        self.assertEqual(self.totals(), {'First': 7, 'Second': 0})
+
+    def test_reconcile_folds_drifted_shards(self):
+        """A drifted sharded counter is rewritten from the Vote rows."""
+        Vote.objects.record(self.users[0], self.first)
+        ChoiceVoteShard.objects.filter(choice=self.first).update(votes=5)
+        call_command('reconcile_vote_counts', stdout=StringIO())
+        self.assertEqual(self.totals(), {'First': 1, 'Second': 0})
+        self.assertFalse(ChoiceVoteShard.objects.filter(choice=self.first).exists())
+
+    def test_reconcile_keeps_shard_votes_added_meanwhile(self):
+        """Only the shard votes read by reconcile are folded, a later vote stays."""
+        Vote.objects.record(self.users[0], self.first)
+        shard = ChoiceVoteShard.objects.get(choice=self.first)
+        ChoiceVoteShard.objects.filter(pk=shard.pk).update(votes=5)
+        using = ArchivedVote.objects.using
+
+        def vote_meanwhile(database):
+            # a vote's shard increment lands after the shards were read
+            ChoiceVoteShard.objects.filter(pk=shard.pk).update(votes=F('votes') + 1)
+            return using(database)
+
+        with mock.patch.object(ArchivedVote.objects, 'using', side_effect=vote_meanwhile):
+            call_command('reconcile_vote_counts', stdout=StringIO())
+        self.assertEqual(Choice.objects.get(pk=self.first.pk).votes, 1)
+        self.assertEqual(ChoiceVoteShard.objects.get(pk=shard.pk).votes, 1)
+
+
+POLL_PARTITIONS = ['polls_a', 'polls_b']
+
+
+@override_settings(POLL_DATABASES=POLL_PARTITIONS)
+class PartitionTests(TestCase):
+    # resolved in setUpClass, after the partitions below are added
+    databases = '__all__'
+
+    @classmethod
+    def setUpClass(cls):
+        # two extra in-memory databases, only for these tests
+        for alias in POLL_PARTITIONS:
+            connections.settings[alias] = connections.configure_settings({
+                'default': connections.settings['default'],
+                alias: {'ENGINE': 'django.db.backends.sqlite3', 'NAME': ':memory:'},
+            })[alias]
+            call_command('migrate', database=alias, verbosity=0)
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        for alias in POLL_PARTITIONS:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    def setUp(self):
+        # placements are cached for good
+        cache.clear()
+        self.user = User.objects.create_user(username='voter')
+        now = timezone.now()
+        self.questions = [
+            Question.objects.create(question_text=f'Poll {i}.',
+                                    pub_date=now - datetime.timedelta(hours=i))
+            for i in range(4)
+        ]
+        for question in self.questions:
+            question.choice_set.create(choice_text='Yes')
+            question.choice_set.create(choice_text='No')
+
+    def test_polls_are_spread_over_partitions(self):
+        """New polls get unique ids and land, with their choices, in their placement."""
+        self.assertEqual(len({question.pk for question in self.questions}), 4)
+        placements = dict(PollPlacement.objects.values_list('pk', 'database'))
+        self.assertEqual(set(placements.values()), set(POLL_PARTITIONS))
+        for question in self.questions:
+            database = placements[question.pk]
+            self.assertEqual(question._state.db, database)
+            self.assertEqual(Choice.objects.using(database).filter(question=question).count(), 2)
+        self.assertFalse(Question.objects.using('default').exists())
+
+    def test_index_merges_partitions(self):
+        """The index lists the polls of every partition, newest first."""
+        self.client.force_login(self.user)
+        with mock.patch.object(IndexView, 'page_size', 3):
+            response = self.client.get(reverse('polls:index'))
+            page = response.context['latest_question_list']
+            self.assertEqual(list(page), self.questions[:3])
+            response = self.client.get(reverse('polls:index'), {'after': page.next_cursor})
+        self.assertEqual(list(response.context['latest_question_list']), self.questions[3:])
+
+    def test_vote_in_partition(self):
+        """A vote is written to, and counted in, the database of its poll."""
+        question = self.questions[1]
+        choice = question.choice_set.get(choice_text='No')
+        self.client.force_login(self.user)
+        self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertEqual(Vote.objects.using(question._state.db).get().choice_id, choice.id)
+        response = self.client.get(reverse('polls:results_json', args=(question.id,)))
+        self.assertEqual(response.json()['total'], 1)
+
+    def test_record_ballots_across_partitions(self):
+        """Ballots for polls in different databases are each recorded at home."""
+        ballots = [(self.user.pk, question.pk, question.choice_set.get(choice_text='Yes').pk)
+                   for question in self.questions]
+        self.assertEqual(record_ballots(ballots), {question.pk for question in self.questions})
+        for alias in POLL_PARTITIONS:
+            self.assertEqual(Vote.objects.using(alias).count(), 2)
+        # usernames come from the default database
+        self.assertEqual([row[2] for row in iter_vote_rows(self.questions[0].pk)], ['voter'])
+
+    def test_stale_placement_is_refreshed(self):
+        """A worker whose cache still has the old placement finds a moved poll."""
+        question = self.questions[0]
+        source = question._state.db
+        target = next(alias for alias in POLL_PARTITIONS if alias != source)
+        call_command('rebalance_polls', question.pk, to=target, stdout=StringIO())
+        # what another process still has cached
+        cache.set(PollPlacement.objects._key(question.pk), source)
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('polls:detail', args=(question.id,)))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(PollPlacement.objects.database_for(question.pk), target)
+        cache.set(PollPlacement.objects._key(question.pk), source)
+        choice = Choice.objects.using(target).get(question_id=question.pk, choice_text='Yes')
+        self.client.post(reverse('polls:vote', args=(question.id,)), {'choice': choice.id})
+        self.assertEqual(Vote.objects.using(target).filter(question_id=question.pk).count(), 1)
+        self.assertFalse(Vote.objects.using(source).exists())
+
+    @override_settings(POLLS_PLACEMENT_CACHE_TIMEOUT=60)
+    def test_placements_expire(self):
+        """Placements are cached with a finite timeout."""
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set:
+            PollPlacement.objects.place(self.questions[0].pk, POLL_PARTITIONS[0])
+        self.assertEqual(cache_set.call_args.args[2], 60)
+
+    def test_admin_edits_polls_in_partitions(self):
+        """The admin adds a poll into its partition and finds it there afterwards."""
+        admin_user = User.objects.create_superuser(username='admin', password='testpassword')
+        self.client.force_login(admin_user)
+        now = timezone.now()
+        response = self.client.post(reverse('admin:polls_question_add'), {
+            'question_text': 'Added in the admin.',
+            'pub_date_0': now.strftime('%Y-%m-%d'), 'pub_date_1': '00:00:00',
+            'end_date_0': (now + datetime.timedelta(days=7)).strftime('%Y-%m-%d'),
+            'end_date_1': '00:00:00', 'counter_shards': 0,
+            'choice_set-TOTAL_FORMS': 2, 'choice_set-INITIAL_FORMS': 0,
+            'choice_set-0-choice_text': 'Red', 'choice_set-1-choice_text': 'Blue',
+        })
+        placement = PollPlacement.objects.latest('pk')
+        question = Question.objects.using(placement.database).get(pk=placement.pk)
+        self.assertRedirects(response, reverse('admin:polls_question_changelist'))
+        self.assertEqual(question.choice_set.count(), 2)
+
+        change = reverse('admin:polls_question_change', args=(question.pk,))
+        response = self.client.get(change)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'value="Blue"')
+        response = self.client.get(reverse('admin:polls_question_changelist'),
+                                   {'database': placement.database})
+        self.assertIn(question, response.context['cl'].result_list)
+        other = next(alias for alias in POLL_PARTITIONS if alias != placement.database)
+        response = self.client.get(reverse('admin:polls_question_changelist'),
+                                   {'database': other})
+        self.assertNotIn(question, response.context['cl'].result_list)
+
+        changelist = reverse('admin:polls_question_changelist')
+        self.client.post(f'{changelist}?database={placement.database}', {
+            'action': 'close_polls_now', '_selected_action': [question.pk],
+        })
+        question.refresh_from_db()
+        self.assertEqual(question.status, Question.Status.CLOSED)
+        self.assertEqual(self.client.get(reverse('admin:polls_choice_changelist')).status_code,
+                         403)
+
+    def test_new_ids_skip_legacy_polls(self):
+        """Polls from before partitioning keep their ids and can still be moved in."""
+        now = timezone.now()
+        legacy_pk = max(question.pk for question in self.questions) + 10
+        Question.objects.using('default').bulk_create(
+            [Question(pk=legacy_pk, question_text='Legacy.', pub_date=now)])
+        question = Question.objects.create(question_text='New.', pub_date=now)
+        self.assertEqual(question.pk, legacy_pk + 1)
+        self.assertEqual(Question.objects.create(question_text='Next.', pub_date=now).pk,
+                         legacy_pk + 2)
+        call_command('rebalance_polls', unplaced=True, stdout=StringIO())
+        self.assertFalse(Question.objects.using('default').exists())
+        database = PollPlacement.objects.database_for(legacy_pk)
+        self.assertEqual(Question.objects.using(database).get(pk=legacy_pk).question_text,
+                         'Legacy.')
+
+    def test_fixture_and_bench_commands_refuse_partitions(self):
+        """Commands that only know the default database refuse to run."""
+        for name, args in [('export_polls', []), ('import_polls', ['polls.json']),
+                           ('bench_polls', []), ('bench_async', [])]:
+            with self.assertRaises(CommandError, msg=name):
+                call_command(name, *args, stdout=StringIO())
+
+    def test_rebalance_moves_poll(self):
+        """rebalance_polls moves a poll with its votes and switches its placement."""
+        question = self.questions[0]
+        source = question._state.db
+        target = next(alias for alias in POLL_PARTITIONS if alias != source)
+        Vote.objects.db_manager(source).record(self.user, question.choice_set.first())
+        call_command('rebalance_polls', question.pk, to=target, stdout=StringIO())
+        self.assertEqual(PollPlacement.objects.get(pk=question.pk).database, target)
+        self.assertFalse(Question.objects.using(source).filter(pk=question.pk).exists())
+        self.assertEqual(Vote.objects.using(target).filter(question_id=question.pk).count(), 1)
+        response = self.client.get(reverse('polls:results_json', args=(question.id,)))
+        self.assertEqual([row['votes'] for row in response.json()['choices']], [1, 0])
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.pizza = Question.objects.create(question_text="Best pizza topping?",
+                                             pub_date=now - datetime.timedelta(days=2))
+        self.pizza.choice_set.create(choice_text="Pineapple")
+        self.lunch = Question.objects.create(question_text="What's for lunch?",
+                                             pub_date=now - datetime.timedelta(days=1))
+        self.lunch.choice_set.create(choice_text="Pizza")
+        self.lunch.choice_set.create(choice_text="Noodles")
+        self.future = Question.objects.create(question_text="Pizza party next week?",
+                                              pub_date=now + datetime.timedelta(days=1))
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('polls:search'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_ranked_results(self):
+        """Questions and choices are searched; a match in the question ranks first."""
+        response = self.search("pizza")
+        self.assertEqual(list(response.context['results']), [self.pizza, self.lunch])
+        self.assertContains(response, "Best pizza topping?")
+        self.assertNotContains(response, "Pizza party")
+
+    def test_stale_scheduled_poll_is_found(self):
+        """A poll still marked scheduled after its pub_date passed is searchable."""
+        Question.objects.filter(pk=self.future.pk).update(
+            pub_date=timezone.now() - datetime.timedelta(minutes=10))
+        self.assertEqual(Question.objects.get(pk=self.future.pk).status,
+                         Question.Status.SCHEDULED)
+        response = self.search("party")
+        self.assertIn(self.future, response.context['results'])
+        self.assertContains(response, 'Status: Open')
+        self.assertNotContains(response, 'Scheduled')
+        with mock.patch('polls.search.has_search_index', return_value=False):
+            response = self.search("party")
+        self.assertIn(self.future, response.context['results'])
+        self.assertContains(response, 'Status: Open')
+
+    def test_prefix_and_all_words(self):
+        """Every word must match, and a word matches as a prefix."""
+        self.assertEqual(list(self.search("noodl lunch").context['results']), [self.lunch])
+        self.assertEqual(list(self.search("noodles topping").context['results']), [])
+
+    def test_query_syntax_is_escaped(self):
+        """FTS5 operators and quotes in the query are treated as plain words."""
+        response = self.search('"pizza*: -(')
+        self.assertEqual(len(response.context['results']), 2)
+        self.assertEqual(list(self.search("").context['results']), [])
+
+    def test_index_follows_edits(self):
+        """The triggers keep the index in step with question and choice edits."""
+        self.pizza.question_text = "Best pasta shape?"
+        self.pizza.save()
+        choice = self.pizza.choice_set.create(choice_text="Farfalle")
+        self.assertEqual(list(self.search("pizza").context['results']), [self.lunch])
+        self.assertEqual(list(self.search("farfalle").context['results']), [self.pizza])
+        choice.delete()
+        self.assertEqual(list(self.search("farfalle").context['results']), [])
+        self.lunch.delete()
+        self.assertEqual(list(self.search("noodles").context['results']), [])
+
+    def test_pagination(self):
+        """Results are paginated with ?page= and a next link only when there are more."""
+        for i in range(3):
+            Question.objects.create(question_text=f"Pizza poll {i}",
+                                    pub_date=timezone.now() - datetime.timedelta(hours=i))
+        with mock.patch.object(SearchView, 'page_size', 2):
+            pages = [self.search("pizza", page=page).context for page in (1, 2, 3)]
+        self.assertEqual([len(page['results']) for page in pages], [2, 2, 1])
+        self.assertEqual([page['has_next'] for page in pages], [True, True, False])
+        seen = [question for page in pages for question in page['results']]
+        self.assertEqual(len(set(seen)), 5)
+        response = self.client.get(reverse('polls:search'), {'q': 'pizza', 'page': 'x'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_search_queries(self):
+        """A search page costs one FTS query and one query for the questions."""
+        with self.assertNumQueries(2):
+            self.search("pizza")
+
+    def test_like_fallback(self):
+        """Without the FTS5 index the same polls are found with LIKE, newest first."""
+        with mock.patch('polls.search.has_search_index', return_value=False):
+            response = self.search("PIZZA")
+        self.assertEqual(list(response.context['results']), [self.lunch, self.pizza])
+
+    def test_rebuild_command(self):
+        """rebuild_search_index refills an index that lost its rows."""
+        with connection.cursor() as cursor:
+            cursor.execute("DELETE FROM polls_question_fts")
+        self.assertEqual(list(self.search("pizza").context['results']), [])
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn("Rebuilt", out.getvalue())
+        self.assertEqual(len(self.search("pizza").context['results']), 2)
+
+
+class ResultsSnapshotTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.question = Question.objects.create(
+            question_text="Closed poll.", pub_date=now - datetime.timedelta(days=3),
+            end_date=now - datetime.timedelta(days=1))
+        self.yes = self.question.choice_set.create(choice_text='Yes')
+        self.no = self.question.choice_set.create(choice_text='No')
+        self.users = [User.objects.create_user(username=f'voter{i}') for i in range(3)]
+        Vote.objects.record_many([(self.users[0].pk, self.question.pk, self.yes.pk),
+                                  (self.users[1].pk, self.question.pk, self.yes.pk),
+                                  (self.users[2].pk, self.question.pk, self.no.pk)])
+
+    def test_backfill(self):
+        """snapshot_results freezes closed polls once, and skips open ones."""
+        Question.objects.create(question_text="Open poll.", pub_date=timezone.now())
+        out = StringIO()
+        call_command('snapshot_results', stdout=out)
+        self.assertIn("Took 1 results snapshots.", out.getvalue())
+        snapshot = ResultsSnapshot.objects.get()
+        self.assertEqual(snapshot.question, self.question)
+        self.assertEqual(snapshot.results, [[self.yes.pk, 'Yes', 2], [self.no.pk, 'No', 1]])
+        self.assertEqual(snapshot.total_votes, 3)
+        call_command('snapshot_results', stdout=out)
+        self.assertIn("Took 0 results snapshots.", out.getvalue())
+
+    def test_closing_takes_snapshot(self):
+        """update_poll_status snapshots the polls it closes."""
+        question = Question.objects.create(question_text="Closing poll.",
+                                           pub_date=timezone.now() - datetime.timedelta(days=1))
+        question.choice_set.create(choice_text='Maybe')
+        Question.objects.filter(pk=question.pk).update(
+            end_date=timezone.now() - datetime.timedelta(minutes=1))
+        call_command('update_poll_status', stdout=StringIO())
+        self.assertTrue(ResultsSnapshot.objects.filter(question=question).exists())
+
+    def test_results_served_from_snapshot(self):
+        """The results of a closed poll come from its snapshot, without reading votes."""
+        call_command('snapshot_results', stdout=StringIO())
+        # drift that the snapshot must not show
+        Choice.objects.filter(pk=self.yes.pk).update(votes=50)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual([row['votes'] for row in response.context['results']], [2, 1])
+        sql = " ".join(query['sql'] for query in queries)
+        self.assertNotIn('polls_choice', sql)
+        self.assertNotIn('polls_vote', sql)
+        response = self.client.get(reverse('polls:results_json', args=(self.question.id,)))
+        self.assertEqual(response.json()['total'], 3)
+
+    @override_settings(ROOT_URLCONF=async_urls)
+    async def test_async_results_served_from_snapshot(self):
+        """The async results view also reads the snapshot."""
+        await sync_to_async(call_command)('snapshot_results', stdout=StringIO())
+        await Choice.objects.filter(pk=self.yes.pk).aupdate(votes=50)
+        response = await self.async_client.get(reverse('polls:results', args=(self.question.id,)))
+        self.assertEqual([row['votes'] for row in response.context['results']], [2, 1])
+
+    def test_index_shows_final_total(self):
+        """The index shows the total of a closed poll from its snapshot."""
+        call_command('snapshot_results', stdout=StringIO())
+        response = self.client.get(reverse('polls:index'))
+        self.assertContains(response, "Final result: 3 votes")
+
+    def test_late_ballot_refreshes_snapshot(self):
+        """A kiosk ballot cast before the poll closed updates its snapshot."""
+        call_command('snapshot_results', stdout=StringIO())
+        late = User.objects.create_user(username='late')
+        Vote.objects.record_many([(late.pk, self.question.pk, self.no.pk)])
+        self.assertEqual(ResultsSnapshot.objects.get().total_votes, 4)
+
+    def test_reopening_drops_snapshot(self):
+        """A closed poll that is reopened is counted live again."""
+        call_command('snapshot_results', stdout=StringIO())
+        self.question.end_date = timezone.now() + datetime.timedelta(days=1)
+        self.question.save()
+        self.assertFalse(ResultsSnapshot.objects.exists())
+
+
+class ArchiveVotesTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        now = timezone.now()
+        self.old = Question.objects.create(
+            question_text="Old poll.", pub_date=now - datetime.timedelta(days=200),
+            end_date=now - datetime.timedelta(days=100))
+        self.recent = Question.objects.create(
+            question_text="Recent poll.", pub_date=now - datetime.timedelta(days=20),
+            end_date=now - datetime.timedelta(days=10))
+        self.users = [User.objects.create_user(username=f'archived{i}') for i in range(5)]
+        self.old_choices = [self.old.choice_set.create(choice_text=text) for text in 'AB']
+        recent_choice = self.recent.choice_set.create(choice_text='C')
+        Vote.objects.record_many(
+            [(user.pk, self.old.pk, self.old_choices[i % 2].pk)
+             for i, user in enumerate(self.users)]
+            + [(user.pk, self.recent.pk, recent_choice.pk) for user in self.users[:2]])
+
+    def archive(self, *args):
+        out = StringIO()
+        call_command('archive_votes', *args, stdout=out)
+        return out.getvalue()
+
+    def test_moves_old_polls_only(self):
+        """Votes of polls closed longer than --days move to the archive in batches."""
+        self.assertIn("Would archive 5 votes.", self.archive('--days', '30', '--dry-run'))
+        self.assertEqual(Vote.objects.count(), 7)
+        self.assertIn("Archived 5 votes.", self.archive('--days', '30', '--batch-size', '2'))
+        self.assertFalse(Vote.objects.filter(question=self.old).exists())
+        self.assertEqual(Vote.objects.filter(question=self.recent).count(), 2)
+        self.assertEqual(
+            sorted(ArchivedVote.objects.values_list('user_id', 'choice_id')),
+            sorted((user.pk, self.old_choices[i % 2].pk) for i, user in enumerate(self.users)))
+        self.assertIn("Archived 0 votes.", self.archive('--days', '30'))
+
+    def test_default_age(self):
+        """The age defaults to POLLS_ARCHIVE_VOTES_AFTER_DAYS."""
+        with override_settings(POLLS_ARCHIVE_VOTES_AFTER_DAYS=5):
+            self.assertIn("Archived 7 votes.", self.archive())
+
+    def test_archived_votes_still_count(self):
+        """Results, reconciliation and exports include the archived votes."""
+        self.archive('--days', '30')
+        self.assertEqual([row['votes'] for row in get_results(self.old)], [3, 2])
+        out = StringIO()
+        call_command('reconcile_vote_counts', '--dry-run', stdout=out)
+        self.assertIn("0 drifted", out.getvalue())
+        out = StringIO()
+        call_command('export_votes', self.old.id, '--format', 'ndjson', stdout=out,
+                     stderr=StringIO())
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 5)
+        self.assertTrue(all(row['archived'] for row in rows))
+        self.assertEqual(rows[0]['username'], 'archived0')
+        out = StringIO()
+        call_command('export_votes', self.old.id, '--totals', '--format', 'ndjson',
+                     stdout=out, stderr=StringIO())
+        totals = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual([row['counted'] for row in totals], [3, 2])
+
+    def test_late_ballot_replaces_archived_vote(self):
+        """A late ballot on an archived poll moves the user's vote instead of adding one."""
+        self.archive('--days', '30')
+        a, b = self.old_choices
+        Vote.objects.record_many([(self.users[0].pk, self.old.pk, b.pk)])
+        self.assertEqual(Vote.objects.filter(user=self.users[0], question=self.old).count(), 1)
+        self.assertEqual(Vote.objects.get(user=self.users[0], question=self.old).choice, b)
+        self.assertFalse(ArchivedVote.objects.filter(question=self.old).exists())
+        self.assertEqual([row['votes'] for row in get_results(self.old)], [2, 3])
+
+    def test_reopening_restores_archived_votes(self):
+        """Reopening an archived poll brings its votes back, so revotes move them."""
+        self.archive('--days', '30')
+        self.old.end_date = None
+        self.old.save()
+        self.assertEqual(Vote.objects.filter(question=self.old).count(), 5)
+        self.assertFalse(ArchivedVote.objects.exists())
+        a, b = self.old_choices
+        Vote.objects.record(self.users[0], b)
+        self.assertEqual(Vote.objects.filter(question=self.old).count(), 5)
+        self.assertEqual([row['votes'] for row in get_results(self.old)], [2, 3])
@@ -1,12 +1,31 @@
+from django.conf import settings
 from django.urls import path
 
-from . import views
+from . import async_views, views
 
 app_name = "polls"
-urlpatterns = [
-    path('', views.IndexView.as_view(), name='index'),
-    path('<int:pk>/', views.DetailView.as_view(), name='detail'),
-    path('<int:pk>/results/', views.ResultsView.as_view(), name='results'),
-    path("<int:question_id>/vote/", views.vote, name="vote"),
-    path('closed_poll/', views.closed_poll_view, name='closed_poll'),
-]
+
+
+def build_urlpatterns(use_async=False):
+    """
+    Return the polls URL patterns.
+
+    With use_async the detail, results and vote pages are served by the
+    native async views in polls.async_views.
+    """
+    impl = async_views if use_async else views
+    return [
+        path('', views.IndexView.as_view(), name='index'),
+        path('search/', views.SearchView.as_view(), name='search'),
+        path('<int:pk>/', impl.DetailView.as_view(), name='detail'),
+        path('<int:pk>/results/', impl.ResultsView.as_view(), name='results'),
+        path('<int:pk>/results.json', views.results_json, name='results_json'),
+        path('<int:pk>/results/stream/', async_views.results_stream, name='results_stream'),
+        path("<int:question_id>/vote/", impl.vote, name="vote"),
+        path('<int:pk>/export/', views.export_votes, name='export_votes'),
+        path('ballots/', views.submit_ballots, name='submit_ballots'),
+        path('closed_poll/', views.closed_poll_view, name='closed_poll'),
+    ]
+
+
+urlpatterns = build_urlpatterns(settings.POLLS_ASYNC_VIEWS)
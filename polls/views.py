@@ -1,44 +1,147 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
 from typing import Any
+from django.conf import settings
 from django.db.models.query import QuerySet
-from django.shortcuts import redirect, render, get_object_or_404
-from django.http import HttpResponseRedirect
+from django.shortcuts import redirect, render
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.http import Http404
 from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.utils.functional import cached_property
 from django.views import generic
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition, require_POST
 from django.utils import timezone
 from django.contrib import messages
+from .ballots import ACCEPTED, REJECTED, SUPERSEDED, check_ballots
+from .buffer import get_vote_buffer
+from .cache import (anonymous_cache_page, bump_results_version, get_results, index_version,
+                    results_version)
 from .models import Question, Choice, Vote
-from django.db.models import Q
-from django.contrib.auth.decorators import login_required
+from .partitions import fan_out, get_poll_or_404, record_ballots
+from .routers import read_from_replica, stick_to_primary
+from .search import search_questions
+from .serialization import (EXPORT_CONTENT_TYPES, TOTAL_COLUMNS, VOTE_COLUMNS, iter_export_lines,
+                            iter_total_rows, iter_vote_rows)
+from django.db.models import F, Prefetch, Q
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.auth.decorators import login_required, permission_required
 from django.contrib.auth.forms import UserCreationForm
 from django.contrib.auth import login, authenticate
 from django.urls import reverse_lazy
 from django.views.generic.edit import CreateView
 
 
+def encode_cursor(question):
+    """Return the opaque ?after= token that continues the index after question."""
+    raw = f"{question.pub_date.isoformat()}|{question.pk}"
+    return urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token):
+    """
+    Turn an ?after= token back into its (pub_date, id) keyset position.
+
+    Raises:
+        Http404: If the token is not one produced by encode_cursor.
+    """
+    try:
+        raw = urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        pub_date, pk = raw.rsplit("|", 1)
+        return datetime.fromisoformat(pub_date), int(pk)
+    except ValueError:
+        raise Http404("Invalid page cursor.")
+
+
+class QuestionPage:
+    """
+    One page of the index.
+
+    The query only runs when the page is first iterated, so a template that
+    serves the list from a cached fragment never touches the database.
+    """
+
+    def __init__(self, queryset, page_size):
+        self.queryset = queryset
+        self.page_size = page_size
+
+    @cached_property
+    def _rows(self):
+        # the queryset holds one extra row that tells whether there is a next page
+        return list(self.queryset)
+
+    def __iter__(self):
+        return iter(self._rows[:self.page_size])
+
+    def __len__(self):
+        return min(len(self._rows), self.page_size)
+
+    def __bool__(self):
+        return bool(self._rows)
+
+    @cached_property
+    def next_cursor(self):
+        """The ?after= token of the next page, or None on the last page."""
+        if len(self._rows) > self.page_size:
+            return encode_cursor(self._rows[self.page_size - 1])
+        return None
+
+
+@method_decorator(anonymous_cache_page, name="dispatch")
 class IndexView(generic.ListView):
     """
     View for displaying the list of the latest published questions.
 
+    The list is paginated by keyset on (-pub_date, id) so every page costs
+    the same no matter how deep into the history it is. Visitors who are not
+    logged in get the whole page from the cache, everyone else gets the
+    question list from a cached template fragment. The list is only read to
+    fill one of those shared caches, so it is read from the primary, never
+    from a replica that may lag behind the index version.
+
     Attributes:
         template_name (str): The name of the template to render.
         context_object_name (str): The name of the context variable containing the question list.
+        page_size (int): The number of questions shown on one page.
     """
 
     template_name = "polls/index.html"
     context_object_name = "latest_question_list"
+    page_size = 20
 
     def get_queryset(self) -> QuerySet[Any]:
         """
-        Return the last five published questions (not including those set to be
-        published in the future).
+        Return one page of published questions (not including those set to be
+        published in the future), newest first, with an is_open flag computed
+        by the database.
         """
         now = timezone.now()
+        # The stored status is only as fresh as the last run of
+        # update_poll_status, so published() lets in scheduled polls whose
+        # pub_date passed and is_open goes by the dates.
+        queryset = Question.objects.published(now).with_is_open(now).annotate(
+            # final total of closed polls, from their snapshots
+            final_votes=F("snapshot__total_votes"),
+        ).order_by("-pub_date", "id")
+        after = self.request.GET.get("after")
+        if after:
+            pub_date, pk = decode_cursor(after)
+            queryset = queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__gt=pk))
+        # one extra row tells us whether there is a next page; with partitioned
+        # polls every poll database is asked for a page and the pages merged
+        return fan_out(queryset, self.page_size + 1,
+                       key=lambda question: (-question.pub_date.timestamp(), question.pk))
 
-        return Question.objects.filter(
-            Q(pub_date__lte=now)).order_by("-pub_date")
+    def get_context_data(self, **kwargs):
+        page = QuestionPage(self.object_list, self.page_size)
+        context = super().get_context_data(object_list=page, **kwargs)
+        context['index_version'] = index_version()
+        context['index_cache_timeout'] = settings.POLLS_INDEX_CACHE_TIMEOUT
+        return context
 
-        # & (Q(end_date__gte=now) | Q(end_date=None))
     def index(self, request):
         latest_question_list = self.get_queryset()
         context = {
@@ -48,6 +151,44 @@ class IndexView(generic.ListView):
         return render(request, self.template_name, context)
 
 
+@method_decorator(read_from_replica, name="dispatch")
+class SearchView(generic.ListView):
+    """
+    View for searching the published questions and their choices.
+
+    Results are ranked by relevance and paginated with ?page=, fetching one
+    extra result to tell whether there is a next page.
+
+    Attributes:
+        template_name (str): The name of the template to render.
+        context_object_name (str): The name of the context variable containing the results.
+        page_size (int): The number of results shown on one page.
+    """
+
+    template_name = "polls/search.html"
+    context_object_name = "results"
+    page_size = 20
+
+    def get_queryset(self):
+        self.query = self.request.GET.get("q", "").strip()
+        try:
+            self.page_number = int(self.request.GET.get("page", 1))
+        except ValueError:
+            raise Http404("Invalid page number.")
+        if self.page_number < 1:
+            raise Http404("Invalid page number.")
+        return search_questions(self.query, offset=(self.page_number - 1) * self.page_size,
+                                limit=self.page_size + 1)
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(object_list=self.object_list[:self.page_size],
+                                           **kwargs)
+        context['query'] = self.query
+        context['page_number'] = self.page_number
+        context['has_next'] = len(self.object_list) > self.page_size
+        return context
+
+
 class DetailView(generic.DetailView):
     """
     View for displaying the details of a specific question.
@@ -71,16 +212,20 @@ class DetailView(generic.DetailView):
 
     def get_queryset(self) -> QuerySet[Any]:
         """
-        Return the last five published questions (not including those set to be
-        published in the future).
+        Return the published questions (not including those set to be
+        published in the future), with their choices prefetched for the form.
         """
-        return Question.objects.filter(pub_date__lte=timezone.now())
+        return Question.objects.filter(pub_date__lte=timezone.now()) \
+            .prefetch_related(Prefetch('choice_set', queryset=Choice.objects.order_by('id')))
+
+    def get_object(self, queryset=None):
+        return get_poll_or_404(queryset or self.get_queryset(), self.kwargs['pk'])
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         # Call the keep_context_of_user_vote function to get the previous choice
-        previous_choice = keep_context_of_user_vote(self.request, self.object.id)
+        previous_choice = keep_context_of_user_vote(self.request.user, self.object)
 
         # Add the previous_choice to the context
         context['previous_choice'] = previous_choice
@@ -88,30 +233,146 @@ class DetailView(generic.DetailView):
         return context
 
 
+@method_decorator(read_from_replica, name="dispatch")
 class ResultsView(generic.DetailView):
+    """
+    View for displaying the vote counts of a question.
+
+    The counts come from the per-question results cache, which the vote view
+    invalidates whenever a vote is recorded or moved.
+    """
     model = Question
     template_name = 'polls/results.html'
 
+    def get_queryset(self) -> QuerySet[Any]:
+        # a closed poll is shown from its snapshot, read in the same query
+        return Question.objects.select_related('snapshot')
 
-@login_required
-def keep_context_of_user_vote(request, question_id):
+    def get_object(self, queryset=None):
+        return get_poll_or_404(queryset or self.get_queryset(), self.kwargs['pk'])
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['results'] = get_results(self.object)
+        context['live_results'] = settings.POLLS_LIVE_RESULTS
+        return context
+
+
+def results_etag(request, pk):
+    """Return the ETag of a question's results, which changes with every recorded vote."""
+    return f"{pk}-{results_version(pk)}"
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=results_etag)
+@read_from_replica
+def results_json(request, pk):
+    """
+    Return the vote counts of a question as JSON.
+
+    Clients that send back the ETag they got get an empty 304 answer until a
+    vote changes the results, which costs a single cache lookup.
     """
-    Check if the user has voted on the current poll question and retrieve their previous choice.
+    question = get_poll_or_404(Question.objects.select_related('snapshot'), pk)
+    results = get_results(question)
+    return JsonResponse({
+        "question": question.id,
+        "question_text": question.question_text,
+        "choices": results,
+        "total": sum(choice["votes"] for choice in results),
+    })
+
+
+@require_POST
+@permission_required("polls.add_vote", raise_exception=True)
+def submit_ballots(request):
     """
-    question = get_object_or_404(Question, pk=question_id)
-    user = request.user
+    Apply a batch of ballots collected offline by a voting kiosk.
 
-    previous_choice = None
+    The body is a JSON list of {"user", "question", "choice", "cast_at"}
+    records, or an object holding that list under "ballots". The records are
+    validated together (see polls.ballots) and the accepted ones are written
+    with bulk upserts in one transaction.
 
-    if question.can_vote():
-        try:
-            # Get the choice associated with the user's vote on this question
-            previous_vote = Vote.objects.get(user=user, choice__question=question)
-            previous_choice = previous_vote.choice
-        except Vote.DoesNotExist:
-            pass  # User hasn't voted on this question before, so previous_choice remains None
+    The kiosk signs in like a browser and is protected by CSRF the same
+    way: it GETs the login page for a csrftoken cookie, POSTs the login form
+    with that token, then sends every upload with the session cookie and an
+    X-CSRFToken header holding the csrftoken cookie it got back from the
+    login, which rotates the token.
 
-    return previous_choice
+    Returns:
+        JsonResponse: The accepted, superseded and rejected counts, and a
+        "results" list with one {"status", "error"} entry per record, in
+        the order of the request. A body that is not a list of records, or
+        holds more than POLLS_BALLOT_BATCH_MAX of them, is answered with 400.
+    """
+    try:
+        records = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({"error": "Request body is not valid JSON."}, status=400)
+    if isinstance(records, dict):
+        records = records.get("ballots")
+    if not isinstance(records, list):
+        return JsonResponse({"error": "Expected a list of ballots."}, status=400)
+    if len(records) > settings.POLLS_BALLOT_BATCH_MAX:
+        return JsonResponse(
+            {"error": f"At most {settings.POLLS_BALLOT_BATCH_MAX} ballots per request."},
+            status=400)
+
+    results, ballots = check_ballots(records)
+    for question_id in record_ballots(ballots):
+        bump_results_version(question_id)
+    statuses = [result["status"] for result in results]
+    return JsonResponse({
+        ACCEPTED: statuses.count(ACCEPTED),
+        SUPERSEDED: statuses.count(SUPERSEDED),
+        REJECTED: statuses.count(REJECTED),
+        "results": results,
+    })
+
+
+@staff_member_required
+def export_votes(request, pk):
+    """
+    Stream the raw votes of a question, or its per-choice totals, for auditors.
+
+    Query parameters:
+        format: "csv" (default) or "ndjson".
+        data: "votes" (default) or "totals".
+
+    The rows are read in chunks and sent as they are read, so the response
+    never holds the whole poll in memory.
+    """
+    question = get_poll_or_404(Question.objects.all(), pk)
+    fmt = request.GET.get("format", "csv")
+    data = request.GET.get("data", "votes")
+    if fmt not in EXPORT_CONTENT_TYPES or data not in ("votes", "totals"):
+        raise Http404("Unknown export.")
+    if data == "votes":
+        lines = iter_export_lines(VOTE_COLUMNS, iter_vote_rows(question.pk), fmt)
+    else:
+        lines = iter_export_lines(TOTAL_COLUMNS, iter_total_rows(question.pk), fmt)
+    response = StreamingHttpResponse(lines, content_type=EXPORT_CONTENT_TYPES[fmt])
+    response["Content-Disposition"] = f'attachment; filename="poll-{question.pk}-{data}.{fmt}"'
+    return response
+
+
+def keep_context_of_user_vote(user, question):
+    """
+    Return the choice the user voted for on question, or None.
+
+    The question is the one the view already loaded, with its choices
+    prefetched, so this costs a single query on the (user, question) index.
+    """
+    if not user.is_authenticated or not question.can_vote():
+        return None
+    choice_id = Vote.objects.using(question._state.db).filter(user=user, question=question) \
+        .values_list('choice_id', flat=True).first()
+    if choice_id is None:
+        # User hasn't voted on this question before
+        return None
+    return next((choice for choice in question.choice_set.all() if choice.id == choice_id),
+                None)
 
 
 @login_required
@@ -127,7 +388,7 @@ def vote(request, question_id):
         HttpResponse: A redirect to the results page if the vote is successful, or
         a re-rendered voting form if there is an error.
     """
-    question = get_object_or_404(Question, pk=question_id)
+    question = get_poll_or_404(Question.objects.all(), question_id)
     # if not request.user.is_authenticated():
     #     # user must login to vote
     #     redirect('login')
@@ -140,28 +401,30 @@ def vote(request, question_id):
         # Redisplay the question voting form.
         messages.error(request, "You didn't select a choice.")
         return redirect("polls:detail", question_id)
-    this_user = request.user
-    try:
-        # find a vote for this user and this question
-        vote = Vote.objects.get(user=this_user, choice__question=question)
-        # update his vote
-        vote.choice = selected_choice
-    except Vote.DoesNotExist:
-        # no matching vote - create a new Vote
-        vote = Vote.objects.create(user=request.user, choice=selected_choice)
-    # if the user has a vote for this question
-    #     update his vote for selected_choice
-    # else :
-    #     create a new vote for this user and choice
-    #     save it
-    # selected_choice.votes += 1
-    # selected_choice.save()
-    vote.save()
+    save_vote(request, question, selected_choice)
+    # let the voter see their own vote even if the replicas lag behind
+    return stick_to_primary(HttpResponseRedirect(reverse("polls:results", args=(question.id,))))
+
+
+def save_vote(request, question, selected_choice):
+    """
+    Store the user's vote for selected_choice and tell them about it.
+
+    Shared by the sync and async vote views. In write-behind mode the ballot
+    is only queued, otherwise it is written straight away.
+    """
+    if settings.POLLS_VOTE_BUFFER:
+        # write-behind: acknowledge now, the buffer writes it in the next batch
+        get_vote_buffer().submit(request.user.pk, question.id, selected_choice.id)
+        messages.success(request,
+                         f"Your vote for '{selected_choice.choice_text}' has been received.")
+        return
+    # one upsert on (user, question) either creates the vote or moves it
+    if Vote.objects.db_manager(question._state.db).record(request.user, selected_choice):
+        bump_results_version(question.id)
     messages.success(request,
                      f"Your vote for '{selected_choice.choice_text}' has been saved. Successfully.")
 
-    return HttpResponseRedirect(reverse("polls:results", args=(question.id,)))
-
 
 class SignUpView(CreateView):
     """
@@ -182,7 +445,7 @@ class SignUpView(CreateView):
         username, password = form.cleaned_data.get("username"), form.cleaned_data.get("password1")
         user = authenticate(username=username, password=password)
         login(self.request, user)
-        return valid
+        return stick_to_primary(valid)
 
 def closed_poll_view(request):
     return render(request, 'polls/closed_poll.html')
\ No newline at end of file